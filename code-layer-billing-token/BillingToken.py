@@ -1,7 +1,66 @@
 from DelaySayExceptions import BillingTokenInvalidError
+from metrics import timer
 from datetime import datetime, timezone
+from os import environ as os_environ
+from uuid import uuid4
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from hmac import new as hmac_new, compare_digest as hmac_compare_digest
+from hashlib import sha256 as hashlib_sha256
+
+# Signed tokens look like "[payload].[signature]". The older tokens are
+# uuid4().hex strings, which never contain this separator, so both
+# kinds of token can be told apart (and keep working) during rollout.
+SIGNED_TOKEN_SEPARATOR = "."
+
+
+def setup():
+    from aws_clients import get_client
+    ssm = get_client('ssm')
+    with timer("SSM"):
+        signing_secret_parameter = ssm.get_parameter(
+            Name=os_environ['BILLING_TOKEN_SIGNING_SECRET_SSM_NAME'],
+            WithDecryption=True
+        )
+    return signing_secret_parameter['Parameter']['Value'].encode()
+
+
+def _encode(data):
+    return urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _decode(text):
+    return urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    if not BillingToken.SETUP_DONE:
+        BillingToken.SIGNING_KEY = setup()
+        BillingToken.SETUP_DONE = True
+    return hmac_new(
+        key=BillingToken.SIGNING_KEY,
+        msg=payload.encode(),
+        digestmod=hashlib_sha256).digest()
+
+
+def generate_signed_token(create_time, expiration_period, team_id, user_id,
+                          portal_session_prepared=False):
+    # The nonce keeps two tokens made in the same second distinct,
+    # and it's what the replay guard records once a token is used.
+    # Pass portal_session_prepared=True if a Stripe customer portal
+    # session will be prepared for the token (see BillingPortalSession);
+    # otherwise the billing redirect doesn't look for one.
+    expiration = int((create_time + expiration_period).timestamp())
+    payload = _encode(
+        f"{team_id}:{user_id}:{expiration}:{uuid4().hex[:16]}"
+        f":{int(portal_session_prepared)}".encode())
+    signature = _encode(_sign(payload))
+    return payload + SIGNED_TOKEN_SEPARATOR + signature
+
 
 class BillingToken:
+
+    SETUP_DONE = False
+    SIGNING_KEY = None
     
     def __init__(self, token):
         assert isinstance(token, str) or token == None
@@ -13,15 +72,54 @@ class BillingToken:
         self.datetime_format = DATETIME_FORMAT
         self.token = token
         self.table_entry = None
+        self.nonce = None
+        if self.is_signed():
+            self.table_entry = self._verify_signed_token()
+    
+    def is_signed(self):
+        return SIGNED_TOKEN_SEPARATOR in self.token
+    
+    def _verify_signed_token(self):
+        # Build the same entry that add_to_dynamodb() would have written,
+        # so the rest of the class doesn't care where it came from.
+        payload, _, signature = self.token.partition(SIGNED_TOKEN_SEPARATOR)
+        try:
+            received_signature = _decode(signature)
+        except ValueError:
+            raise BillingTokenInvalidError(
+                "Billing token invalid: " + self.token)
+        if not hmac_compare_digest(received_signature, _sign(payload)):
+            raise BillingTokenInvalidError(
+                "Billing token signature invalid: " + self.token)
+        try:
+            fields = _decode(payload).decode().split(":")
+            if len(fields) == 4:
+                # Made before the portal session flag; it might have one.
+                fields.append("1")
+            team_id, user_id, expiration, self.nonce, prepared = fields
+            expiration = datetime.fromtimestamp(int(expiration), timezone.utc)
+            if prepared not in ["0", "1"]:
+                raise ValueError("Unknown portal session flag: " + prepared)
+        except ValueError:
+            raise BillingTokenInvalidError(
+                "Billing token invalid: " + self.token)
+        return {
+            'token': self.token,
+            'token_expiration': expiration.strftime(self.datetime_format),
+            'team_id': team_id,
+            'user_id': user_id,
+            'portal_session_prepared': prepared == "1"
+        }
     
     def _get_table_entry(self):
         if not self.table_entry:
-            response = self.table.get_item(
-                Key={
-                    'PK': "BILLING#" + self.token,
-                    'SK': "billing"
-                    }
-            )
+            with timer("DynamoDB"):
+                response = self.table.get_item(
+                    Key={
+                        'PK': "BILLING#" + self.token,
+                        'SK': "billing"
+                        }
+                )
             if 'Item' not in response:
                 raise BillingTokenInvalidError(
                     "Billing token invalid: " + self.token)
@@ -44,7 +142,35 @@ class BillingToken:
         for key in list(item):
             if not item[key]:
                 del item[key]
-        self.table.put_item(Item=item)
+        with timer("DynamoDB"):
+            self.table.put_item(Item=item)
+    
+    def mark_as_used(self):
+        # Optional replay guard for signed tokens: the first redirect
+        # records the token's nonce, and any later one is rejected.
+        # DynamoDB's TTL cleans up the record after the token expires.
+        if not self.is_signed():
+            return
+        if os_environ.get('BILLING_TOKEN_SINGLE_USE', "false") != "true":
+            return
+        from botocore.exceptions import ClientError
+        token_expiration = datetime.strptime(
+            self._get_table_entry()['token_expiration'], self.datetime_format)
+        try:
+            with timer("DynamoDB"):
+                self.table.put_item(
+                    Item={
+                        'PK': "BILLINGNONCE#" + self.nonce,
+                        'SK': "billing nonce",
+                        'expiration_ttl': int(token_expiration.timestamp())
+                    },
+                    ConditionExpression="attribute_not_exists(PK)"
+                )
+        except ClientError as err:
+            if err.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+            raise BillingTokenInvalidError(
+                "Billing token already used: " + self.token)
     
     def has_expired(self):
         date = self._get_table_entry()['token_expiration']
@@ -52,6 +178,14 @@ class BillingToken:
         now = datetime.now(timezone.utc)
         return (token_expiration < now)
     
+    def may_have_prepared_portal_session(self):
+        # Signed tokens say whether one was prepared, which saves the
+        # billing redirect a DynamoDB read when there isn't one. Stored
+        # tokens don't, so it has to look.
+        if not self.is_signed():
+            return True
+        return self._get_table_entry()['portal_session_prepared']
+    
     def get_team_id(self):
         team_id = self._get_table_entry()['team_id']
         return team_id
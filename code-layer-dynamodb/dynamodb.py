@@ -1,8 +1,35 @@
-from boto3 import resource as boto3_resource
+from zlib import crc32
+from aws_clients import get_resource
 from os import environ as os_environ
 
 # This is the format used to log dates in the DynamoDB table.
 DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
 
-dynamodb = boto3_resource("dynamodb")
+# Sparse index of each team's users, for listing them with one query:
+# GSI1PK = "TEAM#[team_id]", GSI1SK = "USER#[user_id]"
+# Users from an org-wide install who haven't used DelaySay in any one
+# workspace are listed under their org: GSI1PK = "ENTERPRISE#[enterprise_id]"
+# (only "user" items with a token have these; billing_role and user_id
+# are projected)
+TEAM_MEMBERS_INDEX_NAME = "GSI1"
+
+# Sparse index of the workspaces in each Enterprise Grid org:
+# GSI2PK = "ENTERPRISE#[enterprise_id]#[shard]", GSI2SK = "TEAM#[team_id]"
+# (only "team" items in an org have these; team_id is projected)
+# Each org is spread over this many shards, so when a big org installs
+# DelaySay in every workspace at once, the writes to the index don't all
+# land on one partition.
+ENTERPRISE_TEAMS_INDEX_NAME = "GSI2"
+ENTERPRISE_TEAMS_INDEX_SHARDS = 8
+
+dynamodb = get_resource("dynamodb")
 dynamodb_table = dynamodb.Table(os_environ['AUTH_TABLE_NAME'])
+
+
+def get_enterprise_teams_index_key(enterprise_id, team_id):
+    # The same team always gets the same shard.
+    shard = crc32(team_id.encode()) % ENTERPRISE_TEAMS_INDEX_SHARDS
+    return {
+        'GSI2PK': f"ENTERPRISE#{enterprise_id}#{shard}",
+        'GSI2SK': "TEAM#" + team_id
+    }
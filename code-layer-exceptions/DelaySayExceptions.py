@@ -18,15 +18,25 @@ class SlackSignaturesDoNotMatchError(Exception):
 class SlackSignatureTimeToleranceExceededError(Exception):
     pass
 
+class SlackSignatureReplayedError(Exception):
+    pass
+
 class CommandParseError(Exception):
     def __init__(self, command_text, message):
         super().__init__(message)
         self.command_text = command_text
 
 class TimeParseError(Exception):
-    def __init__(self, time_text, message):
+    def __init__(self, time_text, message, scheduled_message=None,
+                 best_guess=None):
         super().__init__(message)
         self.time_text = time_text
+        # Set by SlashCommandParser, so the user can pick a time instead
+        self.scheduled_message = scheduled_message
+        self.best_guess = best_guess
+
+class ImportFileError(Exception):
+    pass
 
 class AllStripeSubscriptionsInvalid(Exception):
     def __init__(self, team_id, message=""):
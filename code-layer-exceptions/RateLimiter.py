@@ -0,0 +1,28 @@
+from threading import Lock
+from time import monotonic, sleep
+
+
+class RateLimiter:
+    # Token bucket, safe to share between threads. Slack's rate limits
+    # are per method and per workspace, so use one per (method, team).
+    
+    def __init__(self, calls_per_minute, burst):
+        self.rate = calls_per_minute / 60
+        self.capacity = burst
+        self.tokens = burst
+        self.last_refill = monotonic()
+        self.lock = Lock()
+    
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            sleep(wait)
@@ -0,0 +1,68 @@
+from hmac import new as hmac_new, compare_digest as hmac_compare_digest
+from hashlib import sha256 as hashlib_sha256
+from collections import OrderedDict
+from time import time
+from DelaySayExceptions import (
+    SlackSignaturesDoNotMatchError, SlackSignatureTimeToleranceExceededError,
+    SlackSignatureReplayedError)
+
+# If the timestamp is this old, reject the request.
+TIME_TOLERANCE_IN_SECONDS = 5 * 60
+
+# Remember this many recent signatures per container to reject replays.
+REPLAY_CACHE_SIZE = 4096
+
+class SlackSignatureVerifier:
+
+    def __init__(self, signing_secret, replay_cache_size=REPLAY_CACHE_SIZE):
+        assert signing_secret and isinstance(signing_secret, str)
+        # Key the HMAC once; each request copies this instead of rekeying.
+        self.hmac = hmac_new(
+            key=signing_secret.encode(),
+            digestmod=hashlib_sha256)
+        self.replay_cache_size = replay_cache_size
+        self.seen_signatures = OrderedDict()
+    
+    def _check_timestamp(self, request_timestamp):
+        current_timestamp = time()
+        if float(current_timestamp) - float(request_timestamp) > TIME_TOLERANCE_IN_SECONDS:
+            raise SlackSignatureTimeToleranceExceededError(
+                "Tolerance for timestamp difference was exceeded"
+                "\ncurrent_timestamp: " + str(current_timestamp) +
+                "\nrequest_timestamp: " + str(request_timestamp) +
+                "\nTIME_TOLERANCE_IN_SECONDS: " + str(TIME_TOLERANCE_IN_SECONDS))
+    
+    def compute_expected_signature(self, request_timestamp, request_body):
+        # Feed the pieces of "v0:[timestamp]:[body]" to the HMAC one at
+        # a time rather than building (and encoding) the whole string.
+        hash = self.hmac.copy()
+        hash.update(b"v0:")
+        hash.update(request_timestamp.encode())
+        hash.update(b":")
+        hash.update(request_body)
+        return b"v0=" + hash.hexdigest().encode()
+    
+    def _check_for_replay(self, received_signature):
+        if received_signature in self.seen_signatures:
+            raise SlackSignatureReplayedError(
+                "Slack signature was already used")
+        self.seen_signatures[received_signature] = None
+        if len(self.seen_signatures) > self.replay_cache_size:
+            self.seen_signatures.popitem(last=False)
+    
+    def verify(self, request_timestamp, received_signature, request_body):
+        # https://api.slack.com/docs/verifying-requests-from-slack
+        # Check the timestamp first, so stale requests cost no hashing.
+        self._check_timestamp(request_timestamp)
+        if request_body is None:
+            # Same as the str(request_body) this used to hash
+            # when API Gateway passes no body.
+            request_body = b"None"
+        elif isinstance(request_body, str):
+            request_body = request_body.encode()
+        received_signature = (received_signature or "").encode()
+        expected_signature = self.compute_expected_signature(
+            request_timestamp, request_body)
+        if not hmac_compare_digest(received_signature, expected_signature):
+            raise SlackSignaturesDoNotMatchError("Slack signatures do not match")
+        self._check_for_replay(received_signature)
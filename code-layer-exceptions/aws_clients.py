@@ -0,0 +1,101 @@
+from threading import Lock
+from boto3.session import Session
+from botocore.session import Session as BotocoreSession
+from botocore.config import Config
+
+# One boto3 session and one client (or resource) per AWS service and
+# config for the whole container, each created the first time it's
+# needed, so every function shares the same tuned settings and its
+# connections stay open between invocations.
+#     with timer("SSM"):
+#         get_client('ssm').get_parameter(...)
+#
+# (aws_clients.py lives in the exceptions layer for the same reason as
+# metrics.py: every function that makes AWS calls already uses it.)
+
+# Adaptive retries also slow down on throttling instead of retrying
+# straight into it.
+MAX_ATTEMPTS = 3
+
+# The second responder's scheduling threads can all write to DynamoDB at
+# once (see bulk_schedule_util.MAX_SCHEDULE_WORKERS); the default is 10.
+MAX_POOL_CONNECTIONS = 25
+
+# For most calls: botocore's timeouts, which leave room for the
+# reconciler's table scans, batch writes and Lambda invokes.
+CONFIG = Config(
+    retries={
+        'mode': "adaptive",
+        'max_attempts': MAX_ATTEMPTS
+    },
+    max_pool_connections=MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True
+)
+
+# For calls made while Slack waits for an answer (at most 3 seconds): the
+# first responder's and interactivity's, and the signing secret read when
+# their containers start.
+# These normally take tens of milliseconds, so a stuck connection fails
+# after 1 (connect) or 2 (read) seconds instead of 60, and one retry
+# usually still answers in time. If every attempt gets stuck, it takes
+# about MAX_ATTEMPTS * 3 seconds plus backoff, so Slack will have shown
+# a timeout by then, but the function doesn't hang for minutes.
+HOT_PATH_CONNECT_TIMEOUT_IN_SECONDS = 1
+HOT_PATH_READ_TIMEOUT_IN_SECONDS = 2
+HOT_PATH_CONFIG = CONFIG.merge(Config(
+    connect_timeout=HOT_PATH_CONNECT_TIMEOUT_IN_SECONDS,
+    read_timeout=HOT_PATH_READ_TIMEOUT_IN_SECONDS
+))
+
+_session = None
+clients = {}
+resources = {}
+botocore_sessions = {}
+_lock = Lock()
+
+
+def _get_session():
+    global _session
+    if not _session:
+        _session = Session()
+    return _session
+
+
+def get_client(service_name, config=CONFIG):
+    # One client per service and config (like HOT_PATH_CONFIG)
+    key = (service_name, config)
+    client = clients.get(key)
+    if client:
+        return client
+    # Creating clients from one session isn't thread-safe.
+    with _lock:
+        if key not in clients:
+            clients[key] = _get_session().client(service_name, config=config)
+    return clients[key]
+
+
+def get_resource(service_name, config=CONFIG):
+    key = (service_name, config)
+    resource = resources.get(key)
+    if resource:
+        return resource
+    with _lock:
+        if key not in resources:
+            resources[key] = _get_session().resource(
+                service_name, config=config)
+    return resources[key]
+
+
+def get_botocore_session(config=CONFIG):
+    # For libraries that create their own clients from a botocore session
+    # (like the AWS Encryption SDK's KMS clients), so those clients get
+    # the config too
+    session = botocore_sessions.get(config)
+    if session:
+        return session
+    with _lock:
+        if config not in botocore_sessions:
+            session = BotocoreSession()
+            session.set_default_client_config(config)
+            botocore_sessions[config] = session
+    return botocore_sessions[config]
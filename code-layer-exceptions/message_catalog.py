@@ -0,0 +1,130 @@
+from os import environ as os_environ
+from random import sample as random_sample
+
+# Text for DelaySay's responses that both slash command responders use.
+# Everything that only depends on the environment (the slash command,
+# the contact info and the subscribe URL) is rendered once per
+# container, so a response is just a few pieces joined together.
+#
+# (message_catalog.py lives in the exceptions layer because the first
+# responder has no other layer.)
+
+slash = os_environ['SLASH_COMMAND']
+contact_page = os_environ['CONTACT_PAGE']
+support_email = os_environ['SUPPORT_EMAIL']
+# The first responder doesn't link to the subscribe page.
+subscribe_url = os_environ.get('SUBSCRIBE_URL', "")
+
+HELP_INTRO = "Here is the command format:"
+
+HELP_EXAMPLES = [
+    "2 min say It's been :two: minutes.",
+    "1 hour say Hi, all! :wave:",
+    "9am PST say Good morning! :sunny:",
+    "12 noon say It's time for lunch :yum:",
+    "September 13, say It's International Chocolate Day! :chocolate_bar:",
+    "January 1, 2020, 12am EST, say Happy New Year! :tada:"
+]
+
+_HELP_FORMAT = f"\n        `{slash} [time] say [message]`"
+
+_HELP_EXAMPLE_LINES = [
+    f"\n        `{slash} {example}`" for example in HELP_EXAMPLES]
+
+_HELP_DETAILS = (
+    "\nI will send the message from your username at the specified date"
+    " and time, up to 120 days in the future. (Can't schedule messages to"
+    " send in the past yet, but we'll consider adding this feature"
+    " once time travel is possible!)"
+    "\n\nTo schedule the same message in several channels at once, list"
+    " them before `say`:"
+    f"\n        `{slash} 9am in #general #random say Good morning! :sunny:`"
+    "\nOr schedule messages from a CSV or JSON file you uploaded to"
+    f" Slack: `{slash} import [link to file]`"
+    "\n\nTo see your scheduled messages in this channel or cancel the next"
+    " scheduled message, type:"
+    f"\n        `{slash} list`        or        `{slash} delete 1`"
+    f"\nTo see your scheduled messages in every channel, type `{slash} list all`."
+    "\n\nIf you're an admin in this Slack workspace, you can view past"
+    " invoices, update your payment information, and more in your Stripe"
+    " customer portal:"
+    f"\n        `{slash} billing`"
+    "\nAdmins can also give another user access to your workspace's"
+    " billing portal by typing this:"
+    f"\n        `{slash} billing authorize @username`"
+    f"\nTo see who can manage billing, type `{slash} billing list`."
+    f"\n\nQuestions? Please reach out at {contact_page} or {support_email}")
+
+CONTACT_US = (
+    "\nIf you have any questions, please reach out at"
+    f" {contact_page} or {support_email}")
+
+_PAYMENT_WARNINGS = {
+    "yellow trial": (
+        "\n\nWe hope you're enjoying DelaySay! Your workspace's"
+        " free trial is almost over."),
+    "yellow": (
+        "\n\nWe hope you're enjoying DelaySay! Your workspace's"
+        " subscription is expiring.")
+}
+
+_SUBSCRIBE_HERE = "\nTo continue using DelaySay, *please subscribe here:*\n"
+
+_PAYMENT_REQUIRED = (
+    "\nWe hope you've enjoyed DelaySay! Your *message cannot be"
+    " sent* because your workspace's")
+
+_TRIAL_ENDED = _PAYMENT_REQUIRED + " free trial has ended." + _SUBSCRIBE_HERE
+
+_SUBSCRIPTION_ENDED = (
+    _PAYMENT_REQUIRED
+    + " subscription has expired or the last payment failed.")
+
+_VIEW_BILLING_PORTAL = (
+    "\n\nTo see why, please *view your Stripe customer portal*:\n")
+
+_ASK_ADMIN_TO_VIEW_BILLING_PORTAL = (
+    "\n\nTo see why, an admin in your Slack workspace can type"
+    " this to *view your Stripe customer portal*:"
+    f"\n        `{slash} billing`")
+
+_START_NEW_SUBSCRIPTION = (
+    "\nIn your billing portal, you can add credit cards, view past"
+    " invoices, and manage your DelaySay subscription."
+    "\n\nOr if you prefer, you can start a new subscription:\n")
+
+_CHAT_WITH_US = (
+    "\n\nIf you have any questions or concerns, we'd be happy to"
+    f" chat with you at {contact_page} or {support_email}")
+
+
+def build_help_text(intro=HELP_INTRO):
+    return "".join([
+        intro, _HELP_FORMAT, *random_sample(_HELP_EXAMPLE_LINES, 2),
+        _HELP_DETAILS])
+
+
+def get_subscribe_link(team_id):
+    return f"{subscribe_url}/?team={team_id}"
+
+
+def write_payment_warning(payment_status, team_id):
+    warning = _PAYMENT_WARNINGS.get(payment_status)
+    if not warning:
+        return ""
+    return "".join([
+        warning, _SUBSCRIBE_HERE, get_subscribe_link(team_id), CONTACT_US])
+
+
+def write_payment_required_message(payment_status, team_id,
+                                   billing_url=None):
+    # Without a billing_url, asks the user to have an admin look instead.
+    if payment_status == "red trial":
+        return "".join([_TRIAL_ENDED, get_subscribe_link(team_id), CONTACT_US])
+    if billing_url:
+        see_why = _VIEW_BILLING_PORTAL + billing_url
+    else:
+        see_why = _ASK_ADMIN_TO_VIEW_BILLING_PORTAL
+    return "".join([
+        _SUBSCRIPTION_ENDED, see_why, _START_NEW_SUBSCRIPTION,
+        get_subscribe_link(team_id), _CHAT_WITH_US])
@@ -0,0 +1,121 @@
+from time import perf_counter, time
+from json import dumps as json_dumps
+from os import environ as os_environ
+from functools import wraps
+from threading import Lock
+
+# Set DELAYSAY_METRICS to "true" to log how long each remote call takes.
+# When it's off, timer() hands back a shared do-nothing context manager,
+# so instrumented code pays only for a function call and a "with".
+METRICS_ENABLED = os_environ.get('DELAYSAY_METRICS', "false") == "true"
+
+# CloudWatch namespace for the Embedded Metric Format log lines
+NAMESPACE = "DelaySay"
+
+# Totals for the current invocation, keyed by dependency ("DynamoDB",
+# "Slack", ...). Calls made while the module is imported (like loading
+# secrets from SSM) count toward the first, cold-start invocation.
+durations = {}
+counts = {}
+is_cold_start = True
+
+# Timers also run in worker threads (BulkScheduler, the prefetch in
+# asyncio.to_thread), so the totals are only updated under this lock.
+totals_lock = Lock()
+
+
+class _Timer:
+    __slots__ = ("dependency", "start")
+    
+    def __init__(self, dependency):
+        self.dependency = dependency
+    
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        elapsed = (perf_counter() - self.start) * 1000
+        with totals_lock:
+            durations[self.dependency] = (
+                durations.get(self.dependency, 0) + elapsed)
+            counts[self.dependency] = counts.get(self.dependency, 0) + 1
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+NO_TIMER = _NoTimer()
+
+
+def timer(dependency):
+    # Usage:
+    #     with timer("DynamoDB"):
+    #         response = table.get_item(...)
+    if not METRICS_ENABLED:
+        return NO_TIMER
+    return _Timer(dependency)
+
+
+def emit_metrics(function_name, invocation_duration):
+    # Print one CloudWatch Embedded Metric Format line for the invocation:
+    # https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+    global is_cold_start
+    record = {
+        'FunctionName': function_name,
+        'ColdStart': int(is_cold_start),
+        'InvocationDuration': round(invocation_duration, 3)
+    }
+    metric_definitions = [
+        {'Name': "ColdStart", 'Unit': "Count"},
+        {'Name': "InvocationDuration", 'Unit': "Milliseconds"}
+    ]
+    with totals_lock:
+        invocation_durations = dict(durations)
+        invocation_counts = dict(counts)
+        durations.clear()
+        counts.clear()
+    for dependency in sorted(invocation_durations):
+        record[dependency + "Duration"] = round(
+            invocation_durations[dependency], 3)
+        record[dependency + "Calls"] = invocation_counts[dependency]
+        metric_definitions.append(
+            {'Name': dependency + "Duration", 'Unit': "Milliseconds"})
+        metric_definitions.append(
+            {'Name': dependency + "Calls", 'Unit': "Count"})
+    record['_aws'] = {
+        'Timestamp': int(time() * 1000),
+        'CloudWatchMetrics': [
+            {
+                'Namespace': NAMESPACE,
+                'Dimensions': [["FunctionName"]],
+                'Metrics': metric_definitions
+            }
+        ]
+    }
+    print(json_dumps(record))
+    is_cold_start = False
+
+
+def record_invocation(handler):
+    # Decorate a Lambda handler to emit its metrics when it finishes.
+    if not METRICS_ENABLED:
+        return handler
+    @wraps(handler)
+    def handler_with_metrics(event, context):
+        start = perf_counter()
+        try:
+            return handler(event, context)
+        finally:
+            function_name = getattr(
+                context, 'function_name', handler.__module__)
+            emit_metrics(function_name, (perf_counter() - start) * 1000)
+    return handler_with_metrics
@@ -0,0 +1,23 @@
+from os import environ as os_environ
+from SlackSignatureVerifier import SlackSignatureVerifier
+from metrics import timer
+from aws_clients import get_client, HOT_PATH_CONFIG
+
+# Read when the container starts, while Slack waits for the first request
+ssm = get_client('ssm', HOT_PATH_CONFIG)
+with timer("SSM"):
+    slack_signing_secret_parameter = ssm.get_parameter(
+        Name=os_environ['SLACK_SIGNING_SECRET_SSM_NAME'],
+        WithDecryption=True
+    )
+SLACK_SIGNING_SECRET = slack_signing_secret_parameter['Parameter']['Value']
+
+# Built once per container, so every request reuses the keyed HMAC
+# and the cache of recently seen signatures.
+slack_signature_verifier = SlackSignatureVerifier(SLACK_SIGNING_SECRET)
+
+
+def verify_slack_signature(request_timestamp, received_signature,
+                           request_body):
+    slack_signature_verifier.verify(
+        request_timestamp, received_signature, request_body)
@@ -0,0 +1,63 @@
+from StripeSubscription import StripeSubscription
+from datetime import datetime, timedelta, timezone
+from metrics import timer
+
+# Stripe's billing portal session URLs are short-lived, so only reuse a
+# prepared session for this long; after that, create a fresh one.
+PORTAL_SESSION_PERIOD = timedelta(minutes=4)
+
+class BillingPortalSession:
+
+    def __init__(self, billing_token):
+        assert billing_token and isinstance(billing_token, str)
+        from dynamodb import dynamodb_table, DATETIME_FORMAT
+        self.table = dynamodb_table
+        self.datetime_format = DATETIME_FORMAT
+        self.billing_token = billing_token
+    
+    def create(self, stripe_subscription, return_url):
+        assert isinstance(stripe_subscription, StripeSubscription)
+        from stripe import billing_portal as stripe_billing_portal
+        if stripe_subscription.is_in_test_mode():
+            api_key = StripeSubscription.TEST_MODE_API_KEY
+        else:
+            api_key = StripeSubscription.API_KEY
+        with timer("Stripe"):
+            session = stripe_billing_portal.Session.create(
+                customer=stripe_subscription.get_customer_id(),
+                return_url=return_url,
+                api_key=api_key
+            )
+        return session.url
+    
+    def add_to_dynamodb(self, url, create_time):
+        expiration = create_time + PORTAL_SESSION_PERIOD
+        with timer("DynamoDB"):
+            self.table.put_item(
+                Item={
+                    'PK': "BILLINGPORTAL#" + self.billing_token,
+                    'SK': "billing portal",
+                    'url': url,
+                    'create_time': create_time.strftime(self.datetime_format),
+                    'session_expiration': expiration.strftime(self.datetime_format),
+                    'expiration_ttl': int(expiration.timestamp())
+                }
+            )
+    
+    def get_prepared_url(self):
+        # Returns None if no session was prepared or it has expired,
+        # in which case the caller should create one itself.
+        with timer("DynamoDB"):
+            response = self.table.get_item(
+                Key={
+                    'PK': "BILLINGPORTAL#" + self.billing_token,
+                    'SK': "billing portal"
+                }
+            )
+        if 'Item' not in response:
+            return None
+        date = response['Item']['session_expiration']
+        session_expiration = datetime.strptime(date, self.datetime_format)
+        if session_expiration < datetime.now(timezone.utc):
+            return None
+        return response['Item']['url']
@@ -0,0 +1,109 @@
+from datetime import datetime
+from boto3.dynamodb.conditions import Key
+from metrics import timer
+
+class Enterprise:
+    # An Enterprise Grid org. If the whole org pays for DelaySay, its
+    # "enterprise" item (PK "ENTERPRISE#[enterprise_id]") has a
+    # payment_expiration and payment_plan that cover every workspace in
+    # it, so one read settles whether any of them can use DelaySay.
+    # (Like a "never" payment_expiration, it's set up by hand for now.)
+    # Each workspace still has its own "team" item. An org-wide install
+    # writes the item without payment info, to record who installed it.
+    
+    def __init__(self, id):
+        assert id and isinstance(id, str)
+        from dynamodb import (
+            dynamodb_table, DATETIME_FORMAT, TEAM_MEMBERS_INDEX_NAME,
+            ENTERPRISE_TEAMS_INDEX_NAME, ENTERPRISE_TEAMS_INDEX_SHARDS)
+        self.table = dynamodb_table
+        self.datetime_format = DATETIME_FORMAT
+        self.members_index_name = TEAM_MEMBERS_INDEX_NAME
+        self.teams_index_name = ENTERPRISE_TEAMS_INDEX_NAME
+        self.teams_index_shards = ENTERPRISE_TEAMS_INDEX_SHARDS
+        self.id = id
+    
+    def get_key(self):
+        return {
+            'PK': "ENTERPRISE#" + self.id,
+            'SK': "enterprise"
+        }
+    
+    def add_to_dynamodb(self, enterprise_name, installer_id, create_time):
+        # One conditional put, so reinstalling doesn't overwrite the org's
+        # payment info. Returns whether the item was created.
+        item = {
+            **self.get_key(),
+            'enterprise_id': self.id,
+            'enterprise_name': enterprise_name,
+            'installer_id': installer_id,
+            'create_time': create_time.strftime(self.datetime_format)
+        }
+        for key in list(item):
+            if not item[key]:
+                del item[key]
+        try:
+            with timer("DynamoDB"):
+                self.table.put_item(
+                    Item=item,
+                    ConditionExpression="attribute_not_exists(PK)"
+                )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        return True
+    
+    def read_payment_info(self, item):
+        # Returns (payment_expiration, payment_plan) from the enterprise
+        # item, or None if the org doesn't pay as a whole.
+        if not item or 'payment_expiration' not in item:
+            return None
+        date = item['payment_expiration']
+        try:
+            payment_expiration = datetime.strptime(date, self.datetime_format)
+        except ValueError:
+            # The expiration is probably "never".
+            payment_expiration = date
+        return (payment_expiration, item.get('payment_plan'))
+    
+    def get_payment_info(self):
+        with timer("DynamoDB"):
+            response = self.table.get_item(Key=self.get_key())
+        return self.read_payment_info(response.get('Item'))
+    
+    def get_team_ids(self):
+        # Every workspace in the org that installed DelaySay, one query
+        # per shard of the index
+        team_ids = []
+        for shard in range(self.teams_index_shards):
+            query_arguments = {
+                'IndexName': self.teams_index_name,
+                'KeyConditionExpression':
+                    Key('GSI2PK').eq(f"ENTERPRISE#{self.id}#{shard}")
+            }
+            while True:
+                with timer("DynamoDB"):
+                    response = self.table.query(**query_arguments)
+                team_ids.extend(item['team_id'] for item in response['Items'])
+                if 'LastEvaluatedKey' not in response:
+                    break
+                query_arguments['ExclusiveStartKey'] = (
+                    response['LastEvaluatedKey'])
+        return team_ids
+    
+    def get_members(self):
+        # The org-wide install's authorized users who aren't in any one
+        # workspace's members (see User.add_token_to_dynamodb), as dicts
+        # with user_id
+        query_arguments = {
+            'IndexName': self.members_index_name,
+            'KeyConditionExpression':
+                Key('GSI1PK').eq("ENTERPRISE#" + self.id)
+        }
+        members = []
+        while True:
+            with timer("DynamoDB"):
+                response = self.table.query(**query_arguments)
+            members.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return members
+            query_arguments['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -1,21 +1,24 @@
-from boto3 import client as boto3_client
 from time import time
 from os import environ as os_environ
 from datetime import datetime, timezone
+from metrics import timer
+from aws_clients import get_client
 
 def setup():
-    ssm = boto3_client('ssm')
+    ssm = get_client('ssm')
 
-    stripe_api_key_parameter = ssm.get_parameter(
-        Name=os_environ['STRIPE_API_KEY_SSM_NAME'],
-        WithDecryption=True
-    )
+    with timer("SSM"):
+        stripe_api_key_parameter = ssm.get_parameter(
+            Name=os_environ['STRIPE_API_KEY_SSM_NAME'],
+            WithDecryption=True
+        )
     API_KEY = stripe_api_key_parameter['Parameter']['Value']
 
-    stripe_test_api_key_parameter = ssm.get_parameter(
-        Name=os_environ['STRIPE_TESTING_API_KEY_SSM_NAME'],
-        WithDecryption=True
-    )
+    with timer("SSM"):
+        stripe_test_api_key_parameter = ssm.get_parameter(
+            Name=os_environ['STRIPE_TESTING_API_KEY_SSM_NAME'],
+            WithDecryption=True
+        )
     TEST_MODE_API_KEY = stripe_test_api_key_parameter['Parameter']['Value']
     return (API_KEY, TEST_MODE_API_KEY)
 
@@ -45,12 +48,14 @@ class StripeSubscription:
         self.last_updated = time()
         self.mode = "live"
         try:
-            subscription = stripe_Subscription.retrieve(
-                self.id, api_key=StripeSubscription.API_KEY)
+            with timer("Stripe"):
+                subscription = stripe_Subscription.retrieve(
+                    self.id, api_key=StripeSubscription.API_KEY)
         except stripe_error.InvalidRequestError:
             self.mode = "test"
-            subscription = stripe_Subscription.retrieve(
-                self.id, api_key=StripeSubscription.TEST_MODE_API_KEY)
+            with timer("Stripe"):
+                subscription = stripe_Subscription.retrieve(
+                    self.id, api_key=StripeSubscription.TEST_MODE_API_KEY)
         self.payment_status = subscription['status']
         subscription_item = subscription['items']['data'][0]
         unix_timestamp = subscription_item['current_period_end']
@@ -1,19 +1,105 @@
 from time import time
 from traceback import format_exc
 from StripeSubscription import StripeSubscription
-from DelaySayExceptions import AllStripeSubscriptionsInvalid
+from Enterprise import Enterprise
+from DelaySayExceptions import (
+    AllStripeSubscriptionsInvalid, TeamNotInDynamoDBError)
+from metrics import timer
+from boto3.dynamodb.conditions import Key, Attr
 from datetime import datetime, timedelta, timezone
 
+def expires_later(payment_expiration, other_payment_expiration):
+    # Either can be "never" instead of a datetime.
+    if not isinstance(payment_expiration, datetime):
+        return True
+    if not isinstance(other_payment_expiration, datetime):
+        return False
+    return payment_expiration > other_payment_expiration
+
+def add_new_team_to_dynamodb(team_id, team_name, enterprise_id, create_time,
+                             trial_expiration):
+    # Writes the team's "team" item with one conditional put instead of
+    # reading it first, so installs don't need a Team(). Returns the item
+    # if it was created, or None if the team was already in DynamoDB
+    # (then its payment info is left alone).
+    from dynamodb import (
+        dynamodb_table, DATETIME_FORMAT, get_enterprise_teams_index_key)
+    item = {
+        'PK': "TEAM#" + team_id,
+        'SK': "team",
+        'team_name': team_name,
+        'team_id': team_id,
+        'enterprise_id': enterprise_id,
+        'create_time': create_time.strftime(DATETIME_FORMAT),
+        'payment_expiration': trial_expiration.strftime(DATETIME_FORMAT),
+        'payment_plan': "trial",
+        'stripe_subscriptions': []
+    }
+    if enterprise_id:
+        # See ENTERPRISE_TEAMS_INDEX_NAME
+        item.update(get_enterprise_teams_index_key(enterprise_id, team_id))
+    for key in list(item):
+        if key == 'stripe_subscriptions':
+            continue
+        if not item[key]:
+            del item[key]
+    try:
+        with timer("DynamoDB"):
+            dynamodb_table.put_item(
+                Item=item,
+                ConditionExpression="attribute_not_exists(PK)"
+            )
+    except dynamodb_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    return item
+
+def add_subscription_team_to_dynamodb(subscription_id, team_id):
+    # Stripe's invoice and subscription events don't say which team the
+    # subscription is for (only the checkout does), so keep track.
+    from dynamodb import dynamodb_table
+    with timer("DynamoDB"):
+        dynamodb_table.put_item(
+            Item={
+                'PK': "SUBSCRIPTION#" + subscription_id,
+                'SK': "subscription",
+                'team_id': team_id
+            }
+        )
+
+def get_subscription_team_id(subscription_id):
+    # Returns None if the subscription's checkout hasn't been recorded.
+    from dynamodb import dynamodb_table
+    with timer("DynamoDB"):
+        response = dynamodb_table.get_item(
+            Key={
+                'PK': "SUBSCRIPTION#" + subscription_id,
+                'SK': "subscription"
+            }
+        )
+    return response.get('Item', {}).get('team_id')
+
 class Team:
     
-    def __init__(self, id):
+    def __init__(self, id, enterprise_id=None, load=True):
+        # Pass the team's enterprise_id (from Slack's request) if it's
+        # in an Enterprise Grid org, so the org's payment info is read
+        # along with the team's instead of after it. With load=False,
+        # the team isn't read until something needs it (for callers that
+        # only write, like the Stripe webhook).
         assert id and isinstance(id, str)
-        from dynamodb import dynamodb_table, DATETIME_FORMAT
+        from dynamodb import (
+            dynamodb, dynamodb_table, DATETIME_FORMAT, TEAM_MEMBERS_INDEX_NAME,
+            get_enterprise_teams_index_key)
+        self.dynamodb = dynamodb
         self.table = dynamodb_table
         self.datetime_format = DATETIME_FORMAT
+        self.members_index_name = TEAM_MEMBERS_INDEX_NAME
+        self.get_enterprise_teams_index_key = get_enterprise_teams_index_key
         self.id = id
+        self.enterprise = Enterprise(enterprise_id) if enterprise_id else None
         self.last_updated = 0
-        self._refresh()
+        if load:
+            self._refresh()
     
     def _get_payment_expiration_as_string(self):
         if self.never_expires():
@@ -48,19 +134,20 @@ class Team:
     
     def _update_payment_info_in_dynamodb(self):
         payment_expiration_as_string = self._get_payment_expiration_as_string()
-        self.table.update_item(
-            Key={
-                'PK': "TEAM#" + self.id,
-                'SK': "team"
-            },
-            UpdateExpression=
-                "SET payment_expiration = :val,"
-                " payment_plan = :val2",
-            ExpressionAttributeValues={
-                ":val": payment_expiration_as_string,
-                ":val2": self.payment_plan
-            }
-        )
+        with timer("DynamoDB"):
+            self.table.update_item(
+                Key={
+                    'PK': "TEAM#" + self.id,
+                    'SK': "team"
+                },
+                UpdateExpression=
+                    "SET payment_expiration = :val,"
+                    " payment_plan = :val2",
+                ExpressionAttributeValues={
+                    ":val": payment_expiration_as_string,
+                    ":val2": self.payment_plan
+                }
+            )
     
     def _update_payment_info(self, require_current_subscription=True):
         # Note as of 2020-05-02: The "best_subscription" is the one that
@@ -90,13 +177,8 @@ class Team:
         if not force and time() - self.last_updated < 2:
             return
         self.last_updated = time()
-        response = self.table.get_item(
-            Key={
-                'PK': "TEAM#" + self.id,
-                'SK': "team"
-                }
-        )
-        if 'Item' not in response:
+        item, enterprise_item = self._get_team_and_enterprise_items()
+        if not item:
             self.is_in_dynamodb = False
             if alert_if_not_in_dynamodb:
                 # 2020-05-04: For some reason, this wasn't called.
@@ -105,18 +187,59 @@ class Team:
                 raise TeamNotInDynamoDBError("Unauthorized team: " + self.id)
             else:
                 return
+        self._read_item(item, enterprise_item)
+        if self.get_time_payment_has_been_overdue() > timedelta(0):
+            self._update_payment_info()
+    
+    def _read_item(self, item, enterprise_item):
+        # Fills in the team from its "team" item (and its org's
+        # "enterprise" item, if it's in one and the item was read).
         self.is_in_dynamodb = True
-        date = response['Item']['payment_expiration']
+        date = item['payment_expiration']
         try:
             self.payment_expiration = datetime.strptime(date, self.datetime_format)
         except:
             # The expiration is probably "never".
             self.payment_expiration = date
-        self.payment_plan = response['Item']['payment_plan']
-        self.subscription_ids = response['Item'].get(
-            'stripe_subscriptions', [])
-        if self.get_time_payment_has_been_overdue() > timedelta(0):
-            self._update_payment_info()
+        self.payment_plan = item['payment_plan']
+        self.subscription_ids = item.get('stripe_subscriptions', [])
+        if self.enterprise:
+            enterprise_payment_info = self.enterprise.read_payment_info(
+                enterprise_item)
+        elif item.get('enterprise_id'):
+            # The caller didn't know the org, so it takes another read.
+            self.enterprise = Enterprise(item['enterprise_id'])
+            enterprise_payment_info = self.enterprise.get_payment_info()
+        else:
+            enterprise_payment_info = None
+        if (enterprise_payment_info and expires_later(
+                enterprise_payment_info[0], self.payment_expiration)):
+            # The org's plan covers the team for longer than its own.
+            self.payment_expiration, self.payment_plan = (
+                enterprise_payment_info)
+    
+    def _get_team_and_enterprise_items(self):
+        # Returns (team item, enterprise item), either of which can be
+        # None. With a known org, both come from one BatchGetItem.
+        team_key = {
+            'PK': "TEAM#" + self.id,
+            'SK': "team"
+        }
+        if not self.enterprise:
+            with timer("DynamoDB"):
+                response = self.table.get_item(Key=team_key)
+            return response.get('Item'), None
+        keys = [team_key, self.enterprise.get_key()]
+        items = {}
+        while keys:
+            with timer("DynamoDB"):
+                response = self.dynamodb.batch_get_item(
+                    RequestItems={self.table.name: {'Keys': keys}})
+            for item in response['Responses'][self.table.name]:
+                items[item['SK']] = item
+            keys = response.get('UnprocessedKeys', {}).get(
+                self.table.name, {}).get('Keys', [])
+        return items.get("team"), items.get("enterprise")
     
     def is_trialing(self):
         self._refresh(alert_if_not_in_dynamodb=True)
@@ -145,49 +268,139 @@ class Team:
     
     def add_to_dynamodb(self, team_name, enterprise_id, create_time,
                         trial_expiration):
-        self._refresh()
-        if self.is_in_dynamodb:
-            return
-        item = {
-            'PK': "TEAM#" + self.id,
-            'SK': "team",
-            'team_name': team_name,
-            'team_id': self.id,
-            'enterprise_id': enterprise_id,
-            'create_time': create_time.strftime(self.datetime_format),
-            'payment_expiration': trial_expiration.strftime(self.datetime_format),
-            'payment_plan': "trial",
-            'stripe_subscriptions': []
-        }
-        for key in list(item):
-            if key == 'stripe_subscriptions':
-                continue
-            if not item[key]:
-                del item[key]
-        self.table.put_item(Item=item)
-        self._refresh(force=True)
+        # One conditional put, with no reads (see add_new_team_to_dynamodb).
+        # Returns whether the team was created.
+        item = add_new_team_to_dynamodb(
+            self.id, team_name, enterprise_id, create_time, trial_expiration)
+        if not item:
+            # Someone else created it, so read it next time.
+            self.last_updated = 0
+            return False
+        if enterprise_id and not self.enterprise:
+            self.enterprise = Enterprise(enterprise_id)
+        # What was just written is what a read would return (apart from
+        # the org's plan, if it has one, which the next refresh reads).
+        self.last_updated = time()
+        self._read_item(item, None)
+        return True
     
-    def add_subscription(self, subscription_id):
+    def add_subscription(self, subscription_id, payment_expiration=None,
+                         payment_plan=None):
         # Note as of 2020-05-02: There should only be one subscription
         # for each team, but in the case that there are multiple,
         # I want DynamoDB to keep track for debugging/support purposes.
-        self._refresh(alert_if_not_in_dynamodb=True)
-        self.subscription_ids.append(subscription_id)
-        self._update_payment_info()
-        self.table.update_item(
-            Key={
-                'PK': "TEAM#" + self.id,
-                'SK': "team"
-            },
-            UpdateExpression=
-                "SET stripe_subscriptions"
-                " = list_append(stripe_subscriptions, :val)",
-            ExpressionAttributeValues={
-                ":val": [subscription_id]
-            }
-        )
+        # One update, with no reads: Stripe retries and duplicate
+        # checkout events don't add the same subscription twice, and the
+        # payment info comes from the webhook instead of Stripe. It only
+        # replaces a trial or an earlier expiration. Returns whether the
+        # subscription was added.
+        update_expression = (
+            "SET stripe_subscriptions"
+            " = list_append(if_not_exists(stripe_subscriptions, :empty), :val)")
+        condition_expression = (
+            "attribute_exists(PK) AND NOT contains(stripe_subscriptions, :id)")
+        values = {
+            ":val": [subscription_id],
+            ":empty": [],
+            ":id": subscription_id
+        }
+        if payment_expiration:
+            update_expression += (
+                ", payment_expiration = :val2, payment_plan = :val3")
+            # "never" sorts after any date.
+            condition_expression += (
+                " AND (payment_plan = :trial OR payment_expiration < :val2)")
+            values[":val2"] = payment_expiration.strftime(self.datetime_format)
+            values[":val3"] = payment_plan
+            values[":trial"] = "trial"
+        try:
+            with timer("DynamoDB"):
+                self.table.update_item(
+                    Key={
+                        'PK': "TEAM#" + self.id,
+                        'SK': "team"
+                    },
+                    UpdateExpression=update_expression,
+                    ConditionExpression=condition_expression,
+                    ExpressionAttributeValues=values,
+                    ReturnValuesOnConditionCheckFailure="ALL_OLD"
+                )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException as err:
+            item = err.response.get('Item')
+            if not item:
+                raise TeamNotInDynamoDBError("Unauthorized team: " + self.id)
+            if {'S': subscription_id} in item.get(
+                    'stripe_subscriptions', {}).get('L', []):
+                return False
+            # The team already has a better plan, so just keep track.
+            return self.add_subscription(subscription_id)
+        self.last_updated = 0
+        return True
+    
+    def update_subscription_payment_info(self, subscription_id,
+                                         payment_expiration, payment_plan):
+        # For Stripe's invoice and subscription events, which have the
+        # subscription's real period end. Like add_subscription(), it only
+        # replaces a trial or an earlier expiration. The subscription may
+        # not be in stripe_subscriptions yet, since Stripe can send these
+        # before the checkout; add_subscription() adds it when the
+        # checkout arrives. Returns whether it was written.
+        try:
+            with timer("DynamoDB"):
+                self.table.update_item(
+                    Key={
+                        'PK': "TEAM#" + self.id,
+                        'SK': "team"
+                    },
+                    UpdateExpression=
+                        "SET payment_expiration = :val, payment_plan = :val2",
+                    ConditionExpression=
+                        "attribute_exists(PK)"
+                        " AND (payment_plan = :trial OR payment_expiration < :val)",
+                    ExpressionAttributeValues={
+                        ":val": payment_expiration.strftime(self.datetime_format),
+                        ":val2": payment_plan,
+                        ":trial": "trial"
+                    }
+                )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        self.last_updated = 0
+        return True
     
     def get_best_subscription(self):
         self._refresh(alert_if_not_in_dynamodb=True)
         self._update_payment_info(require_current_subscription=False)
         return self.best_subscription
+    
+    def get_members(self, billing_roles=None):
+        # Returns the team's authorized users as dicts with user_id and
+        # billing_role (if they have one), optionally only those with one
+        # of the given billing roles.
+        query_arguments = {
+            'IndexName': self.members_index_name,
+            'KeyConditionExpression': Key('GSI1PK').eq("TEAM#" + self.id)
+        }
+        if billing_roles:
+            query_arguments['FilterExpression'] = (
+                Attr('billing_role').is_in(billing_roles))
+        members = []
+        while True:
+            with timer("DynamoDB"):
+                response = self.table.query(**query_arguments)
+            members.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return members
+            query_arguments['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    
+    def has_member(self, user_id):
+        # Whether the user authorized DelaySay in this team
+        with timer("DynamoDB"):
+            response = self.table.query(
+                IndexName=self.members_index_name,
+                KeyConditionExpression=
+                    Key('GSI1PK').eq("TEAM#" + self.id)
+                    & Key('GSI1SK').eq("USER#" + user_id),
+                Select="COUNT"
+            )
+        return response['Count'] > 0
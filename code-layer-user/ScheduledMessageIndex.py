@@ -0,0 +1,131 @@
+from hashlib import sha256
+from time import time
+from boto3.dynamodb.conditions import Key, Attr
+from metrics import timer
+
+# Index items sort after the "user" item in the user's partition:
+# SK = "SCHEDULED#[post_at, zero-padded]#[scheduled_message_id]"
+SORT_KEY_PREFIX = "SCHEDULED#"
+# Sorts after every digit, so it bounds "all future post_at values".
+SORT_KEY_END = SORT_KEY_PREFIX + "~"
+
+# Keep an index entry this long after its message should have been sent,
+# then let DynamoDB's TTL remove it.
+EXPIRATION_AFTER_POST_IN_SECONDS = 24 * 60 * 60
+
+
+def hash_message_text(text):
+    return sha256(text.encode()).hexdigest()
+
+
+class ScheduledMessageIndex:
+    # DelaySay's own record of the messages a user scheduled, so they can
+    # be listed across channels with one query instead of asking Slack
+    # about every channel. Slack is still the source of truth; entries
+    # are written when chat.scheduleMessage succeeds and reconciled
+    # whenever DelaySay gets a fresh listing from Slack.
+    
+    def __init__(self, user_id):
+        assert user_id and isinstance(user_id, str)
+        from dynamodb import dynamodb_table
+        self.table = dynamodb_table
+        self.user_id = user_id
+        self.partition_key = "USER#" + user_id
+    
+    def _sort_key(self, post_at, scheduled_message_id):
+        return f"{SORT_KEY_PREFIX}{int(post_at):010d}#{scheduled_message_id}"
+    
+    def _item(self, scheduled_message_id, channel_id, post_at, text):
+        return {
+            'PK': self.partition_key,
+            'SK': self._sort_key(post_at, scheduled_message_id),
+            'scheduled_message_id': scheduled_message_id,
+            'channel_id': channel_id,
+            'post_at': int(post_at),
+            'text_hash': hash_message_text(text),
+            'expiration_ttl': int(post_at) + EXPIRATION_AFTER_POST_IN_SECONDS
+        }
+    
+    def add(self, scheduled_message_id, channel_id, post_at, text):
+        with timer("DynamoDB"):
+            self.table.put_item(
+                Item=self._item(scheduled_message_id, channel_id, post_at, text))
+    
+    def add_many(self, messages):
+        # messages: iterable of (scheduled_message_id, channel_id, post_at,
+        # text). Written 25 at a time with BatchWriteItem.
+        with self.table.batch_writer() as batch:
+            for scheduled_message_id, channel_id, post_at, text in messages:
+                with timer("DynamoDB"):
+                    batch.put_item(
+                        Item=self._item(
+                            scheduled_message_id, channel_id, post_at, text))
+    
+    def remove(self, scheduled_message_id, post_at):
+        with timer("DynamoDB"):
+            self.table.delete_item(
+                Key={
+                    'PK': self.partition_key,
+                    'SK': self._sort_key(post_at, scheduled_message_id)
+                }
+            )
+    
+    def get_page(self, page_size, exclusive_start_key=None, channel_id=None):
+        # Returns (entries, last_evaluated_key) for messages that haven't
+        # been sent yet, soonest first. Pass last_evaluated_key back in to
+        # get the next page; it's None after the last page.
+        query_arguments = {
+            'KeyConditionExpression':
+                Key('PK').eq(self.partition_key)
+                & Key('SK').between(
+                    self._sort_key(time(), ""), SORT_KEY_END),
+            'Limit': page_size
+        }
+        if channel_id:
+            query_arguments['FilterExpression'] = Attr('channel_id').eq(channel_id)
+        if exclusive_start_key:
+            query_arguments['ExclusiveStartKey'] = exclusive_start_key
+        with timer("DynamoDB"):
+            response = self.table.query(**query_arguments)
+        return (response['Items'], response.get('LastEvaluatedKey'))
+    
+    def get_all(self, channel_id=None, page_size=100):
+        entries = []
+        last_evaluated_key = None
+        while True:
+            page, last_evaluated_key = self.get_page(
+                page_size, last_evaluated_key, channel_id)
+            entries.extend(page)
+            if not last_evaluated_key:
+                return entries
+    
+    def reconcile(self, scheduled_messages, channel_id=None):
+        # Make the index match a listing from chat.scheduledMessages.list
+        # (of one channel, or of every channel if channel_id is None).
+        # Slack only lists what was scheduled with the user's DelaySay
+        # token, so messages missing from the index are added too.
+        # Returns (number added or updated, number removed).
+        entries = {
+            entry['scheduled_message_id']: entry
+            for entry in self.get_all(channel_id)}
+        now = time()
+        to_add = []
+        for message in scheduled_messages:
+            if message['post_at'] < now:
+                # Already sent (or about to be), so it's not listed either
+                continue
+            entry = entries.pop(message['id'], None)
+            if (entry
+                    and entry['post_at'] == message['post_at']
+                    and entry['text_hash'] == hash_message_text(message['text'])):
+                continue
+            if entry:
+                # Rescheduled or edited, so its sort key may have changed
+                self.remove(entry['scheduled_message_id'], entry['post_at'])
+            to_add.append((
+                message['id'], message['channel_id'], message['post_at'],
+                message['text']))
+        self.add_many(to_add)
+        for entry in entries.values():
+            self.remove(entry['scheduled_message_id'], entry['post_at'])
+        return (len(to_add), len(entries))
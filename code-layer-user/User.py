@@ -2,33 +2,81 @@ from requests import post as requests_post
 from json import loads as json_loads
 from os import environ as os_environ
 from DelaySayExceptions import UserAuthorizeError
-from datetime import timezone, timedelta
+from metrics import timer
+from aws_clients import CONFIG, get_botocore_session
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
 from aws_encryption_sdk import (
-    EncryptionSDKClient, StrictAwsKmsMasterKeyProvider, CommitmentPolicy)
+    EncryptionSDKClient, StrictAwsKmsMasterKeyProvider, CommitmentPolicy,
+    CachingCryptoMaterialsManager, LocalCryptoMaterialsCache)
 
 encryption_client = EncryptionSDKClient(
     commitment_policy=CommitmentPolicy.REQUIRE_ENCRYPT_ALLOW_DECRYPT
 )
-kms_key_provider = StrictAwsKmsMasterKeyProvider(
-    key_ids=[
-        os_environ['KMS_MASTER_KEY_ARN']
-    ]
-)
+
+# Reuse each data key for a while instead of asking KMS for a new one for
+# every token. When a whole org authorizes DelaySay at once, most OAuth
+# callbacks land on warm Lambdas, so this saves a KMS call per user (and
+# a decrypt call for tokens encrypted under a key that's still cached).
+MAX_DATA_KEY_AGE_IN_SECONDS = 300.0
+MAX_TOKENS_PER_DATA_KEY = 1000
+
+# One per AWS client config (see aws_clients), so a function answering
+# Slack can decrypt with HOT_PATH_CONFIG
+crypto_materials_managers = {}
+
+def get_crypto_materials_manager(config=CONFIG):
+    if config not in crypto_materials_managers:
+        kms_key_provider = StrictAwsKmsMasterKeyProvider(
+            key_ids=[
+                os_environ['KMS_MASTER_KEY_ARN']
+            ],
+            botocore_session=get_botocore_session(config)
+        )
+        crypto_materials_managers[config] = CachingCryptoMaterialsManager(
+            master_key_provider=kms_key_provider,
+            cache=LocalCryptoMaterialsCache(capacity=100),
+            max_age=MAX_DATA_KEY_AGE_IN_SECONDS,
+            max_messages_encrypted=MAX_TOKENS_PER_DATA_KEY
+        )
+    return crypto_materials_managers[config]
+
+# The user's time zone is saved in their "user" item, but ask Slack again
+# after this long in case they changed it and we missed the user_change
+# event.
+TIMEZONE_MAX_AGE = timedelta(days=7)
+
+# Same for whether they're a workspace admin, which decides whether they
+# can manage billing, so it isn't trusted for as long.
+ADMIN_STATUS_MAX_AGE = timedelta(days=1)
+
+# IANA time zone name -> ZoneInfo (or None if it isn't a known zone)
+zoneinfo_cache = {}
+
+def get_zoneinfo(tz_name):
+    if tz_name not in zoneinfo_cache:
+        try:
+            zoneinfo_cache[tz_name] = ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            zoneinfo_cache[tz_name] = None
+    return zoneinfo_cache[tz_name]
 
 def encrypt_oauth_token(token):
     token_as_bytes = token.encode()
-    encrypted_token, encryptor_header = encryption_client.encrypt(
-        source=token_as_bytes,
-        key_provider=kms_key_provider
-    )
+    with timer("KMS"):
+        encrypted_token, encryptor_header = encryption_client.encrypt(
+            source=token_as_bytes,
+            materials_manager=get_crypto_materials_manager()
+        )
     return encrypted_token
 
-def decrypt_oauth_token(encrypted_token):
-    token_as_bytes, decryptor_header = encryption_client.decrypt(
-        source=encrypted_token,
-        key_provider=kms_key_provider
-    )
+def decrypt_oauth_token(encrypted_token, config=CONFIG):
+    with timer("KMS"):
+        token_as_bytes, decryptor_header = encryption_client.decrypt(
+            source=encrypted_token,
+            materials_manager=get_crypto_materials_manager(config)
+        )
     token = token_as_bytes.decode()
     return token
 
@@ -45,53 +93,87 @@ class User:
     def _reset(self):
         self.token = None
         self.timezone = None
+        self.tz_name = None
+        self.tz_update_time = None
         self.is_admin = None
+        self.is_admin_update_time = None
         self.billing_role = None
     
     def _reencrypt_token_with_key_commitment(self):
         token_encrypted_with_key_commitment = encrypt_oauth_token(self.token)
-        self.table.update_item(
-            Key={
-                'PK': "USER#" + self.id,
-                'SK': "user"
-            },
-            UpdateExpression=
-                "SET #t = :val",
-            ExpressionAttributeValues={
-                ":val": token_encrypted_with_key_commitment
-            },
-            ExpressionAttributeNames={
-                "#t": "token"
-            }
-        )
+        with timer("DynamoDB"):
+            self.table.update_item(
+                Key={
+                    'PK': "USER#" + self.id,
+                    'SK': "user"
+                },
+                UpdateExpression=
+                    "SET #t = :val",
+                ExpressionAttributeValues={
+                    ":val": token_encrypted_with_key_commitment
+                },
+                ExpressionAttributeNames={
+                    "#t": "token"
+                }
+            )
     
     def _update_billing_role_in_dynamodb(self, billing_role):
         # Update their admin status or approval to handle billing
-        self.table.update_item(
-            Key={
-                'PK': "USER#" + self.id,
-                'SK': "user"
-            },
-            UpdateExpression=
-                "SET billing_role = :val",
-            ExpressionAttributeValues={
-                ":val": billing_role
-            }
-        )
+        with timer("DynamoDB"):
+            self.table.update_item(
+                Key={
+                    'PK': "USER#" + self.id,
+                    'SK': "user"
+                },
+                UpdateExpression=
+                    "SET billing_role = :val",
+                ExpressionAttributeValues={
+                    ":val": billing_role
+                }
+            )
     
-    def is_slack_admin(self):
-        if not self.is_admin:
-            self.token = self.get_auth_token()
-            r = requests_post(
-                url="https://slack.com/api/users.info",
-                data={
-                    'user': self.id
+    def _is_saved_admin_status_current(self):
+        if self.is_admin is None or not self.is_admin_update_time:
+            return False
+        age = datetime.now(timezone.utc) - self.is_admin_update_time
+        return age < ADMIN_STATUS_MAX_AGE
+    
+    def _update_admin_status_in_dynamodb(self, is_admin):
+        now = datetime.now(timezone.utc)
+        with timer("DynamoDB"):
+            self.table.update_item(
+                Key={
+                    'PK': "USER#" + self.id,
+                    'SK': "user"
                 },
-                headers={
-                    'Content-Type': "application/x-www-form-urlencoded",
-                    'Authorization': "Bearer " + self.token
+                UpdateExpression=
+                    "SET is_admin = :val, is_admin_update_time = :val2",
+                ExpressionAttributeValues={
+                    ":val": is_admin,
+                    ":val2": now.strftime(self.datetime_format)
                 }
             )
+        self.is_admin_update_time = now
+    
+    def is_slack_admin(self):
+        if self.is_admin is None:
+            if not self.token:
+                # Also loads the saved admin status
+                self.get_auth_token()
+            if not self._is_saved_admin_status_current():
+                self.is_admin = None
+        if self.is_admin is None:
+            with timer("Slack"):
+                r = requests_post(
+                    url="https://slack.com/api/users.info",
+                    data={
+                        'user': self.id
+                    },
+                    headers={
+                        'Content-Type': "application/x-www-form-urlencoded",
+                        'Authorization': "Bearer " + self.token
+                    }
+                )
             if r.status_code != 200:
                 print(r.status_code, r.reason)
                 raise Exception("requests.post failed")
@@ -102,6 +184,7 @@ class User:
                     "\nFor more information, see here:"
                     "\nhttps://api.slack.com/methods/users.info")
             self.is_admin = user_object['user']['is_admin']
+            self._update_admin_status_in_dynamodb(self.is_admin)
         return self.is_admin
     
     def _get_billing_role_from_dynamodb(self):
@@ -109,12 +192,13 @@ class User:
         # if not force and time.time() - self.last_updated < 2:
         #     return
         # self.last_updated = time.time()
-        response = self.table.get_item(
-            Key={
-                'PK': "USER#" + self.id,
-                'SK': "user"
-                }
-        )
+        with timer("DynamoDB"):
+            response = self.table.get_item(
+                Key={
+                    'PK': "USER#" + self.id,
+                    'SK': "user"
+                    }
+            )
         try:
             item = response['Item']
         except KeyError:
@@ -159,33 +243,46 @@ class User:
         return self.billing_role
     
     def is_in_dynamodb(self):
-        response = self.table.get_item(
-            Key={
-                'PK': "USER#" + self.id,
-                'SK': "user"
-            }
-        )
-        return ('Item' in response)
-    
-    def get_auth_token(self):
-        if not self.token:
+        with timer("DynamoDB"):
             response = self.table.get_item(
                 Key={
                     'PK': "USER#" + self.id,
                     'SK': "user"
                 }
             )
+        return ('Item' in response)
+    
+    def get_auth_token(self, config=CONFIG):
+        # Pass HOT_PATH_CONFIG while Slack waits, for the KMS decrypt.
+        if not self.token:
+            with timer("DynamoDB"):
+                response = self.table.get_item(
+                    Key={
+                        'PK': "USER#" + self.id,
+                        'SK': "user"
+                    }
+                )
             try:
                 encrypted_token_as_boto3_binary = response['Item']['token']
             except KeyError:
                 raise UserAuthorizeError("Unauthorized user: " + self.id)
+            # Saves looking up the time zone and admin status separately
+            self.tz_name = response['Item'].get('tz')
+            if response['Item'].get('tz_update_time'):
+                self.tz_update_time = datetime.strptime(
+                    response['Item']['tz_update_time'], self.datetime_format)
+            self.is_admin = response['Item'].get('is_admin')
+            if response['Item'].get('is_admin_update_time'):
+                self.is_admin_update_time = datetime.strptime(
+                    response['Item']['is_admin_update_time'],
+                    self.datetime_format)
             encrypted_token_as_bytes = encrypted_token_as_boto3_binary.value
-            self.token = decrypt_oauth_token(encrypted_token_as_bytes)
+            self.token = decrypt_oauth_token(encrypted_token_as_bytes, config)
             self._reencrypt_token_with_key_commitment()
         return self.token
     
-    def get_timezone(self):
-        if not self.timezone:
+    def _get_timezone_from_slack(self):
+        with timer("Slack"):
             r = requests_post(
                 url="https://slack.com/api/users.info",
                 data={
@@ -196,19 +293,127 @@ class User:
                     'Authorization': "Bearer " + self.token
                 }
             )
-            if r.status_code != 200:
-                print(r.status_code, r.reason)
-                raise Exception("requests.post failed")
-            user_object = json_loads(r.content)
-            if not user_object['ok']:
-                raise Exception(
-                    "User.get_timezone() failed: " + user_object['error'] +
-                    "\nFor more information, see here:"
-                    "\nhttps://api.slack.com/methods/users.info")
-            tz_offset = user_object['user']['tz_offset']
-            self.timezone = timezone(timedelta(seconds=tz_offset))
+        if r.status_code != 200:
+            print(r.status_code, r.reason)
+            raise Exception("requests.post failed")
+        user_object = json_loads(r.content)
+        if not user_object['ok']:
+            raise Exception(
+                "User.get_timezone() failed: " + user_object['error'] +
+                "\nFor more information, see here:"
+                "\nhttps://api.slack.com/methods/users.info")
+        tz_name = user_object['user'].get('tz')
+        if tz_name and get_zoneinfo(tz_name):
+            self.set_timezone(tz_name)
+            return self.timezone
+        # Without a known IANA zone, fall back to the current offset
+        # (which will be wrong across a daylight saving time change).
+        tz_offset = user_object['user']['tz_offset']
+        return timezone(timedelta(seconds=tz_offset))
+    
+    def _is_saved_timezone_current(self):
+        if not self.tz_name or not self.tz_update_time:
+            return False
+        age = datetime.now(timezone.utc) - self.tz_update_time
+        return age < TIMEZONE_MAX_AGE
+    
+    def get_timezone(self):
+        if not self.timezone:
+            if not self.token:
+                # Also loads the saved time zone
+                self.get_auth_token()
+            if self._is_saved_timezone_current():
+                self.timezone = get_zoneinfo(self.tz_name)
+            if not self.timezone:
+                self.timezone = self._get_timezone_from_slack()
         return self.timezone
     
+    def set_timezone(self, tz_name):
+        # Saves the user's IANA time zone (like "America/Los_Angeles").
+        # Returns False if they haven't authorized DelaySay.
+        now = datetime.now(timezone.utc)
+        try:
+            with timer("DynamoDB"):
+                self.table.update_item(
+                    Key={
+                        'PK': "USER#" + self.id,
+                        'SK': "user"
+                    },
+                    UpdateExpression=
+                        "SET tz = :val, tz_update_time = :val2",
+                    ConditionExpression="attribute_exists(PK)",
+                    ExpressionAttributeValues={
+                        ":val": tz_name,
+                        ":val2": now.strftime(self.datetime_format)
+                    }
+                )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        self.tz_name = tz_name
+        self.tz_update_time = now
+        self.timezone = get_zoneinfo(tz_name)
+        return True
+    
+    def update_from_slack_profile(self, tz_name, is_admin):
+        # For user_change events, which keep the saved time zone and admin
+        # status current. Returns False if they haven't authorized
+        # DelaySay.
+        now = datetime.now(timezone.utc)
+        now_string = now.strftime(self.datetime_format)
+        set_clauses = ["is_admin = :val", "is_admin_update_time = :val2"]
+        values = {
+            ":val": is_admin,
+            ":val2": now_string
+        }
+        if tz_name and get_zoneinfo(tz_name):
+            set_clauses += ["tz = :val3", "tz_update_time = :val2"]
+            values[":val3"] = tz_name
+        if is_admin:
+            set_clauses.append("billing_role = :val4")
+            values[":val4"] = "admin"
+        try:
+            with timer("DynamoDB"):
+                response = self.table.update_item(
+                    Key={
+                        'PK': "USER#" + self.id,
+                        'SK': "user"
+                    },
+                    UpdateExpression="SET " + ", ".join(set_clauses),
+                    ConditionExpression="attribute_exists(PK)",
+                    ExpressionAttributeValues=values,
+                    ReturnValues="UPDATED_OLD"
+                )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        old_billing_role = response.get('Attributes', {}).get('billing_role')
+        if not is_admin and old_billing_role == "admin":
+            # No longer a workspace admin, so no longer allowed to
+            # manage billing (same as _get_and_update_billing_role)
+            self._update_billing_role_in_dynamodb("no approval")
+        self._reset()
+        return True
+    
+    def remove_token(self):
+        # For tokens_revoked and app_uninstalled events. Also takes the
+        # user out of the team members index until they authorize again.
+        try:
+            with timer("DynamoDB"):
+                self.table.update_item(
+                    Key={
+                        'PK': "USER#" + self.id,
+                        'SK': "user"
+                    },
+                    UpdateExpression="REMOVE #t, GSI1PK, GSI1SK",
+                    ConditionExpression="attribute_exists(PK)",
+                    ExpressionAttributeNames={
+                        "#t": "token"
+                    }
+                )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+        self._reset()
+        return True
+    
     def add_to_dynamodb(self, token, team_id, team_name, enterprise_id,
                         create_time):
         item = {
@@ -219,12 +424,64 @@ class User:
             'team_name': team_name,
             'team_id': team_id,
             'enterprise_id': enterprise_id,
-            'create_time': create_time.strftime(self.datetime_format)
+            'create_time': create_time.strftime(self.datetime_format),
+            # See TEAM_MEMBERS_INDEX_NAME
+            'GSI1PK': "TEAM#" + team_id if team_id else None,
+            'GSI1SK': "USER#" + self.id
         }
         for key in list(item):
             if not item[key]:
                 del item[key]
-        self.table.put_item(Item=item)
+        with timer("DynamoDB"):
+            self.table.put_item(Item=item)
+        self._reset()
+    
+    def add_token_to_dynamodb(self, token, enterprise_id, create_time):
+        # For org-wide installs, which aren't in any one workspace. A new
+        # user gets an item without a team, listed in the team members
+        # index (GSI1) under their org instead so an org uninstall can
+        # find them; a user who already authorized in a workspace only
+        # gets the new token, so they keep their team_id, billing_role,
+        # tz, and team membership.
+        encrypted_token = encrypt_oauth_token(token)
+        enterprise_key = "ENTERPRISE#" + enterprise_id
+        item = {
+            'PK': "USER#" + self.id,
+            'SK': "user",
+            'GSI1PK': enterprise_key,
+            'GSI1SK': "USER#" + self.id,
+            'token': encrypted_token,
+            'user_id': self.id,
+            'enterprise_id': enterprise_id,
+            'create_time': create_time.strftime(self.datetime_format)
+        }
+        try:
+            with timer("DynamoDB"):
+                self.table.put_item(
+                    Item=item,
+                    ConditionExpression="attribute_not_exists(PK)"
+                )
+        except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+            with timer("DynamoDB"):
+                self.table.update_item(
+                    Key={
+                        'PK': "USER#" + self.id,
+                        'SK': "user"
+                    },
+                    UpdateExpression=
+                        "SET #t = :val, enterprise_id = :val2,"
+                        " GSI1PK = if_not_exists(GSI1PK, :val3),"
+                        " GSI1SK = if_not_exists(GSI1SK, :val4)",
+                    ExpressionAttributeValues={
+                        ":val": encrypted_token,
+                        ":val2": enterprise_id,
+                        ":val3": enterprise_key,
+                        ":val4": "USER#" + self.id
+                    },
+                    ExpressionAttributeNames={
+                        "#t": "token"
+                    }
+                )
         self._reset()
     
     def __eq__(self, other):
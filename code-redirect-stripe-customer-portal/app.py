@@ -1,10 +1,12 @@
-import boto3
 import stripe
 import traceback
 import os
 from BillingToken import BillingToken
+from BillingPortalSession import BillingPortalSession
 from Team import Team
 from DelaySayExceptions import BillingTokenInvalidError
+from metrics import timer, record_invocation
+from aws_clients import get_client
 
 # This is the Lambda function that creates a redirect to a specific
 # team's billing portal.
@@ -12,18 +14,20 @@ from DelaySayExceptions import BillingTokenInvalidError
 BILLING_PORTAL_FAIL_URL = os.environ['BILLING_PORTAL_FAIL_URL']
 REDIRECT_URL_AFTER_PORTAL = os.environ['REDIRECT_URL_AFTER_PORTAL']
 
-ssm = boto3.client('ssm')
+ssm = get_client('ssm')
 
-stripe_api_key_parameter = ssm.get_parameter(
-    Name=os.environ['STRIPE_API_KEY_SSM_NAME'],
-    WithDecryption=True
-)
+with timer("SSM"):
+    stripe_api_key_parameter = ssm.get_parameter(
+        Name=os.environ['STRIPE_API_KEY_SSM_NAME'],
+        WithDecryption=True
+    )
 stripe.api_key = stripe_api_key_parameter['Parameter']['Value']
 
-stripe_test_api_key_parameter = ssm.get_parameter(
-    Name=os.environ['STRIPE_TESTING_API_KEY_SSM_NAME'],
-    WithDecryption=True
-)
+with timer("SSM"):
+    stripe_test_api_key_parameter = ssm.get_parameter(
+        Name=os.environ['STRIPE_TESTING_API_KEY_SSM_NAME'],
+        WithDecryption=True
+    )
 TEST_MODE_API_KEY = stripe_test_api_key_parameter['Parameter']['Value']
 
 
@@ -42,16 +46,19 @@ def redirect_because_invalid_token():
     return build_response("failed", BILLING_PORTAL_FAIL_URL)
 
 
-def fetch_stripe_subscription(token):
-    try:
-        billing_token = BillingToken(token)
-        if billing_token.has_expired():
-            raise BillingTokenInvalidError(
-                "Billing token expired: " + str(billing_token))
-        team_id = billing_token.get_team_id()
-    except BillingTokenInvalidError:
-        raise
-    
+def validate_billing_token(token):
+    billing_token = BillingToken(token)
+    if billing_token.has_expired():
+        raise BillingTokenInvalidError(
+            "Billing token expired: " + str(billing_token))
+    # Signed tokens are verified locally (no DynamoDB read); this only
+    # writes to DynamoDB if they're configured to be single-use.
+    billing_token.mark_as_used()
+    return billing_token
+
+
+def fetch_stripe_subscription(billing_token):
+    team_id = billing_token.get_team_id()
     team = Team(team_id)
     
     if team.is_trialing():
@@ -93,7 +100,16 @@ def lambda_handler(event, context):
         return redirect_because_invalid_token()
     
     try:
-        stripe_subscription = fetch_stripe_subscription(token)
+        billing_token = validate_billing_token(token)
+        # The billing command usually prepares the portal session ahead
+        # of time. If it didn't, or the session expired, create one now.
+        # (Signed tokens from other messages say there isn't one, so
+        # there's no DynamoDB read at all for them.)
+        if billing_token.may_have_prepared_portal_session():
+            url = BillingPortalSession(str(billing_token)).get_prepared_url()
+            if url:
+                return build_response("success", url)
+        stripe_subscription = fetch_stripe_subscription(billing_token)
     except BillingTokenInvalidError as err:
         # Maybe remove this, since it could print sensitive information,
         # like the user's OAuth token.
@@ -105,13 +121,14 @@ def lambda_handler(event, context):
     customer_id = stripe_subscription.get_customer_id()
     if stripe_subscription.is_in_test_mode():
         stripe.api_key = TEST_MODE_API_KEY
-    session = stripe.billing_portal.Session.create(
-        customer=customer_id,
-        return_url=REDIRECT_URL_AFTER_PORTAL,
-        # could also create a thank-you page
-        # or return to their Slack workspace:
-        # return_url="https://app.slack.com/client/" + team_id,
-    )
+    with timer("Stripe"):
+        session = stripe.billing_portal.Session.create(
+            customer=customer_id,
+            return_url=REDIRECT_URL_AFTER_PORTAL,
+            # could also create a thank-you page
+            # or return to their Slack workspace:
+            # return_url="https://app.slack.com/client/" + team_id,
+        )
     url = session.url
     
     # JavaScript version from .html page:
@@ -122,6 +139,7 @@ def lambda_handler(event, context):
     return build_response("success", url)
 
 
+@record_invocation
 def lambda_handler_with_catch_all(event, context):
     try:
         return lambda_handler(event, context)
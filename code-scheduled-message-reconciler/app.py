@@ -0,0 +1,274 @@
+from traceback import format_exc
+from requests import post as requests_post
+from json import loads as json_loads, dumps as json_dumps
+from os import environ as os_environ
+from time import monotonic, sleep
+
+from User import decrypt_oauth_token
+from ScheduledMessageIndex import ScheduledMessageIndex
+from RateLimiter import RateLimiter
+from metrics import timer, record_invocation
+from aws_clients import get_client
+
+# This is the Lambda function that runs on a schedule to make each user's
+# ScheduledMessageIndex match what Slack actually has scheduled (messages
+# can be sent, deleted or edited without DelaySay knowing).
+# The scheduled run only starts one invocation per scan segment; each of
+# those walks its segment of the users until its time budget runs out,
+# and the next run picks up where it left off.
+# Users are read from the team members index (GSI1), which only has the
+# authorized users (including those from an org-wide install, listed
+# under their org), so a pass doesn't read every scheduled message
+# entry and team in the table too. Their tokens aren't projected into
+# it, so each page's tokens come from one BatchGetItem.
+# Every message the listing returns is indexed, not just those already
+# in the index: Slack only lists the messages scheduled with the token
+# DelaySay was given, so they're all DelaySay's, and a message whose
+# index entry was never written (say, a command that timed out after
+# scheduling it) shows up in `list` again.
+
+TOTAL_SEGMENTS = int(os_environ.get('RECONCILE_TOTAL_SEGMENTS', "4"))
+TIME_BUDGET_IN_SECONDS = int(
+    os_environ.get('RECONCILE_TIME_BUDGET_IN_SECONDS', "240"))
+
+# Stop this long before Lambda's own timeout, whatever the budget says.
+TIME_RESERVE_IN_SECONDS = 15
+
+# chat.scheduledMessages.list is a Tier 3 Slack method (50+ calls per
+# minute per workspace). `list` commands use it too, so the reconciler
+# only takes this much of that, split between the segments.
+LIST_CALLS_PER_MINUTE = 20
+LIST_PAGE_SIZE = 100
+MAX_RETRY_AFTER_IN_SECONDS = 30
+
+# Users read from the index per scan page (BatchGetItem takes up to 100)
+SCAN_PAGE_SIZE = 25
+
+# The user's token no longer works, so there's nothing to reconcile.
+SKIPPABLE_SLACK_ERRORS = [
+    "token_revoked", "invalid_auth", "account_inactive", "not_authed",
+    "missing_scope", "user_not_found"]
+
+
+class OutOfTime(Exception):
+    pass
+
+
+class SkipUser(Exception):
+    pass
+
+
+class ReconcileProgress:
+    # Where each segment's scan stopped, so the next run continues from
+    # there instead of starting over with the same users every time.
+    
+    def __init__(self, segment, total_segments):
+        from dynamodb import dynamodb_table, TEAM_MEMBERS_INDEX_NAME
+        self.table = dynamodb_table
+        self.index_name = TEAM_MEMBERS_INDEX_NAME
+        self.key = {
+            'PK': f"RECONCILE#{segment}",
+            'SK': "reconcile"
+        }
+        self.total_segments = total_segments
+    
+    def load(self):
+        with timer("DynamoDB"):
+            response = self.table.get_item(Key=self.key)
+        item = response.get('Item')
+        # Segments cover different users if TOTAL_SEGMENTS changed, and
+        # a key from a scan of something else doesn't fit this scan.
+        if (not item
+                or item['total_segments'] != self.total_segments
+                or item.get('index_name') != self.index_name):
+            return None
+        return item['exclusive_start_key']
+    
+    def save(self, exclusive_start_key):
+        with timer("DynamoDB"):
+            if exclusive_start_key:
+                self.table.put_item(
+                    Item={
+                        **self.key,
+                        'total_segments': self.total_segments,
+                        'index_name': self.index_name,
+                        'exclusive_start_key': exclusive_start_key
+                    }
+                )
+            else:
+                # Finished a full pass (or stopped before the first
+                # user); start from the beginning next time.
+                self.table.delete_item(Key=self.key)
+
+
+def get_tokens(items):
+    # Returns {PK: encrypted token} for the users' items from the index.
+    from dynamodb import dynamodb, dynamodb_table
+    keys = [
+        {
+            'PK': item['PK'],
+            'SK': item['SK']
+        }
+        for item in items]
+    tokens = {}
+    while keys:
+        with timer("DynamoDB"):
+            response = dynamodb.batch_get_item(
+                RequestItems={
+                    dynamodb_table.name: {
+                        'Keys': keys,
+                        'ProjectionExpression': "PK, #t",
+                        'ExpressionAttributeNames': {
+                            "#t": "token"
+                        }
+                    }
+                }
+            )
+        for item in response['Responses'][dynamodb_table.name]:
+            if 'token' in item:
+                tokens[item['PK']] = item['token']
+        keys = response.get('UnprocessedKeys', {}).get(
+            dynamodb_table.name, {}).get('Keys', [])
+    return tokens
+
+
+def list_all_scheduled_messages(token, rate_limiter, deadline):
+    # Pages through the user's scheduled messages in every channel.
+    scheduled_messages = []
+    cursor = ""
+    while True:
+        if monotonic() >= deadline:
+            raise OutOfTime()
+        rate_limiter.acquire()
+        data = {
+            'limit': LIST_PAGE_SIZE
+        }
+        if cursor:
+            data['cursor'] = cursor
+        with timer("Slack"):
+            r = requests_post(
+                url="https://slack.com/api/chat.scheduledMessages.list",
+                data=data,
+                headers={
+                    'Content-Type': "application/x-www-form-urlencoded",
+                    'Authorization': "Bearer " + token
+                }
+            )
+        if r.status_code == 429:
+            retry_after = int(r.headers.get('Retry-After', 1))
+            sleep(min(retry_after, MAX_RETRY_AFTER_IN_SECONDS))
+            continue
+        if r.status_code != 200:
+            print(r.status_code, r.reason)
+            raise Exception("requests.post failed")
+        messages_object = json_loads(r.content)
+        if not messages_object['ok']:
+            if messages_object['error'] in SKIPPABLE_SLACK_ERRORS:
+                raise SkipUser(messages_object['error'])
+            raise Exception(
+                "list_all_scheduled_messages() failed: "
+                + messages_object['error'])
+        scheduled_messages.extend(messages_object['scheduled_messages'])
+        cursor = messages_object.get(
+            'response_metadata', {}).get('next_cursor')
+        if not cursor:
+            return scheduled_messages
+
+
+def reconcile_segment(segment, total_segments, context):
+    from dynamodb import dynamodb_table, TEAM_MEMBERS_INDEX_NAME
+    deadline = monotonic() + min(
+        TIME_BUDGET_IN_SECONDS,
+        context.get_remaining_time_in_millis() / 1000
+        - TIME_RESERVE_IN_SECONDS)
+    progress = ReconcileProgress(segment, total_segments)
+    exclusive_start_key = progress.load()
+    # One per team (or org, for users from an org-wide install), since
+    # Slack's rate limits are per workspace
+    rate_limiters = {}
+    totals = {
+        'users': 0,
+        'skipped': 0,
+        'failed': 0,
+        'added': 0,
+        'removed': 0
+    }
+    is_out_of_time = False
+    while not is_out_of_time:
+        scan_arguments = {
+            'IndexName': TEAM_MEMBERS_INDEX_NAME,
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'Limit': SCAN_PAGE_SIZE
+        }
+        if exclusive_start_key:
+            scan_arguments['ExclusiveStartKey'] = exclusive_start_key
+        with timer("DynamoDB"):
+            response = dynamodb_table.scan(**scan_arguments)
+        tokens = get_tokens(response['Items']) if response['Items'] else {}
+        for item in response['Items']:
+            # "TEAM#[team_id]" or "ENTERPRISE#[enterprise_id]"
+            workspace = item['GSI1PK']
+            if workspace not in rate_limiters:
+                rate_limiters[workspace] = RateLimiter(
+                    LIST_CALLS_PER_MINUTE / total_segments, burst=1)
+            try:
+                if monotonic() >= deadline:
+                    raise OutOfTime()
+                if item['PK'] not in tokens:
+                    # Revoked since the index page was read
+                    raise SkipUser("no token")
+                token = decrypt_oauth_token(tokens[item['PK']].value)
+                scheduled_messages = list_all_scheduled_messages(
+                    token, rate_limiters[workspace], deadline)
+                index = ScheduledMessageIndex(item['PK'][len("USER#"):])
+                added, removed = index.reconcile(scheduled_messages)
+                totals['added'] += added
+                totals['removed'] += removed
+                totals['users'] += 1
+            except OutOfTime:
+                # Don't move past this user; the next run starts here.
+                is_out_of_time = True
+                break
+            except SkipUser as err:
+                print(f"Skipping {item['PK']}: {err}")
+                totals['skipped'] += 1
+            except Exception:
+                print(
+                    f"Couldn't reconcile {item['PK']}:\r\r"
+                    + format_exc().replace('\n', '\r'))
+                totals['failed'] += 1
+            exclusive_start_key = {
+                key: item[key] for key in ["PK", "SK", "GSI1PK", "GSI1SK"]}
+        else:
+            exclusive_start_key = response.get('LastEvaluatedKey')
+            if not exclusive_start_key:
+                break
+            if monotonic() >= deadline:
+                is_out_of_time = True
+    progress.save(exclusive_start_key)
+    totals['segment'] = segment
+    totals['finished_pass'] = not is_out_of_time
+    print(json_dumps(totals))
+    return totals
+
+
+@record_invocation
+def lambda_handler(event, context):
+    if 'segment' not in event:
+        # Started by the schedule: run the segments in parallel.
+        print("~~~   RECONCILER: STARTING SEGMENTS   ~~~")
+        for segment in range(TOTAL_SEGMENTS):
+            with timer("Lambda"):
+                get_client('lambda').invoke(
+                    FunctionName=context.function_name,
+                    InvocationType="Event",
+                    Payload=json_dumps({
+                        'segment': segment,
+                        'total_segments': TOTAL_SEGMENTS
+                    })
+                )
+        return
+    print(f"~~~   RECONCILER: SEGMENT {event['segment']}   ~~~")
+    return reconcile_segment(
+        event['segment'], event['total_segments'], context)
@@ -0,0 +1,105 @@
+from json import loads as json_loads
+from traceback import format_exc
+
+from User import User
+from Team import Team
+from Enterprise import Enterprise
+from DelaySayExceptions import (
+    SlackSignaturesDoNotMatchError, SlackSignatureTimeToleranceExceededError,
+    SlackSignatureReplayedError)
+
+from verify_slack_signature import verify_slack_signature
+from metrics import record_invocation
+
+# This is the Lambda function for Slack's Events API. It keeps what
+# DynamoDB knows about users and teams up to date when it changes in
+# Slack, instead of waiting for the next command to notice:
+#   user_change: the user's time zone and admin status
+#   tokens_revoked: delete the revoked user tokens
+#   app_uninstalled: delete every token in the team (or, for an
+#     org-wide install, in the org)
+# Slack retries an event if it doesn't get a 200 within 3 seconds, and
+# every handler here is safe to run more than once.
+
+
+def build_response(status_code, body=""):
+    return {
+        'statusCode': str(status_code),
+        'body': body,
+        'headers': {
+            'Content-Type': "text/plain",
+        }
+    }
+
+
+def handle_user_change(event):
+    profile = event['user']
+    user = User(profile['id'])
+    if not user.update_from_slack_profile(
+            profile.get('tz'), bool(profile.get('is_admin'))):
+        print("Skipping user_change: user hasn't authorized DelaySay")
+
+
+def handle_tokens_revoked(event):
+    # Bot tokens aren't saved, so only the user (OAuth) tokens matter.
+    user_ids = event['tokens'].get('oauth', [])
+    for user_id in user_ids:
+        User(user_id).remove_token()
+    print(f"Removed {len(user_ids)} revoked tokens")
+
+
+def handle_app_uninstalled(body):
+    # The team's payment info is kept in case they reinstall.
+    if body.get('is_enterprise_install') and body.get('enterprise_id'):
+        enterprise = Enterprise(body['enterprise_id'])
+        members = enterprise.get_members()
+        for team_id in enterprise.get_team_ids():
+            members.extend(Team(team_id, load=False).get_members())
+    else:
+        members = Team(body['team_id'], load=False).get_members()
+    for member in members:
+        User(member['user_id']).remove_token()
+    print(f"Removed the tokens of {len(members)} users")
+
+
+def lambda_handler(event, context):
+    verify_slack_signature(
+        request_timestamp=event['headers']['X-Slack-Request-Timestamp'],
+        received_signature=event['headers']['X-Slack-Signature'],
+        request_body=event['body'])
+    body = json_loads(event['body'])
+    if body['type'] == "url_verification":
+        print("~~~   VERIFICATION OF EVENTS REQUEST URL   ~~~")
+        return build_response(200, body['challenge'])
+    if body['type'] != "event_callback":
+        print(f"Ignoring request of type {body['type']}")
+        return build_response(200)
+    event_type = body['event']['type']
+    print(f"~~~   EVENT: {event_type}   ~~~")
+    if event_type == "user_change":
+        handle_user_change(body['event'])
+    elif event_type == "tokens_revoked":
+        handle_tokens_revoked(body['event'])
+    elif event_type == "app_uninstalled":
+        handle_app_uninstalled(body)
+    else:
+        print(f"Ignoring event {event_type}")
+    return build_response(200)
+
+
+@record_invocation
+def lambda_handler_with_catch_all(event, context):
+    try:
+        return lambda_handler(event, context)
+    except SlackSignatureReplayedError:
+        # Already handled (or being handled) in this container
+        print(format_exc().replace('\n', '\r'))
+        return build_response(200)
+    except (SlackSignaturesDoNotMatchError,
+            SlackSignatureTimeToleranceExceededError):
+        print(format_exc().replace('\n', '\r'))
+        return build_response(403)
+    except Exception:
+        # Slack will retry the event.
+        print(format_exc().replace('\n', '\r'))
+        return build_response(500)
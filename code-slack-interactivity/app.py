@@ -0,0 +1,282 @@
+from json import dumps as json_dumps, loads as json_loads
+from traceback import format_exc
+from os import environ as os_environ
+from time import time
+from urllib.parse import parse_qs
+from requests import post as requests_post
+
+from User import User
+from DelaySayExceptions import (
+    UserAuthorizeError, SlackSignaturesDoNotMatchError,
+    SlackSignatureTimeToleranceExceededError, SlackSignatureReplayedError)
+
+from verify_slack_signature import verify_slack_signature
+from metrics import timer, record_invocation
+from aws_clients import (
+    get_client, HOT_PATH_CONFIG, HOT_PATH_CONNECT_TIMEOUT_IN_SECONDS,
+    HOT_PATH_READ_TIMEOUT_IN_SECONDS)
+
+# This is the Lambda function for Slack's interactivity requests: clicks
+# on buttons and pickers in DelaySay's responses, and the "Send later"
+# shortcuts and their modal. Like the first responder, it only checks
+# the request and hands the work to the second responder, because Slack
+# wants an answer within 3 seconds. (Opening the modal is the exception:
+# its trigger_id expires in those 3 seconds.)
+
+lambda_client = get_client('lambda', HOT_PATH_CONFIG)
+
+second_responder_function = os_environ['SECOND_RESPONDER_FUNCTION']
+api_domain = os_environ['SLASH_COMMAND_LINKS_DOMAIN']
+
+# The callback ID of the global and message shortcuts (set up in the
+# Slack app's settings) and of the modal they open
+SEND_LATER_CALLBACK_ID = "send_later"
+
+# Start the modal's time picker this far ahead, on a quarter hour.
+DEFAULT_DELAY_IN_SECONDS = 60 * 60
+
+# The longest initial_value Slack takes for a plain_text_input. A
+# longer message (from the message shortcut) is cut to this, or Slack
+# won't open the modal at all.
+MAX_MESSAGE_INPUT_LENGTH = 3000
+
+# Block action ID -> what the second responder does with it. Other
+# actions (like changing a picker) need nothing until a button is clicked.
+FUNCTION_BY_ACTION_ID = {
+    "schedule_picked_time": "schedule at"
+}
+
+
+def build_response(status_code):
+    return {
+        'statusCode': str(status_code),
+        'body': "",
+        'headers': {
+            'Content-Type': "text/plain",
+        }
+    }
+
+
+def build_errors_response(errors):
+    # Shows each error under its block in the modal, instead of closing it
+    return {
+        'statusCode': "200",
+        'body': json_dumps({
+            'response_action': "errors",
+            'errors': errors
+        }),
+        'headers': {
+            'Content-Type': "application/json",
+        }
+    }
+
+
+def forward_block_action(payload, action, request_timestamp):
+    # Passes the click on in the same form as a slash command, so the
+    # second responder's idempotency, prefetching, and error responses
+    # work the same for it.
+    params = {
+        'currentFunctionOfFunction': FUNCTION_BY_ACTION_ID[action['action_id']],
+        'team_id': [payload['team']['id']],
+        'team_domain': [payload['team']['domain']],
+        'user_id': [payload['user']['id']],
+        'channel_id': [payload['channel']['id']],
+        'response_url': [payload['response_url']],
+        'text': [action.get('value', "")],
+        'state_values': payload.get('state', {}).get('values', {}),
+        'request_timestamp': request_timestamp
+    }
+    if payload.get('enterprise'):
+        params['enterprise_id'] = [payload['enterprise']['id']]
+    with timer("Lambda"):
+        lambda_client.invoke(
+            ClientContext="DelaySay handler",
+            FunctionName=second_responder_function,
+            InvocationType="Event",
+            Payload=json_dumps(params)
+        )
+
+
+def build_send_later_modal(channel_id=None, message=""):
+    post_at = (int(time()) + DEFAULT_DELAY_IN_SECONDS) // 900 * 900
+    channel_select = {
+        "type": "conversations_select",
+        "action_id": "channel",
+        "default_to_current_conversation": True,
+        # So the second responder can answer in the channel
+        "response_url_enabled": True
+    }
+    if channel_id:
+        channel_select["initial_conversation"] = channel_id
+    message_block = {
+        "type": "input",
+        "block_id": "message",
+        "label": {"type": "plain_text", "text": "Message"},
+        "element": {
+            "type": "plain_text_input",
+            "action_id": "message",
+            "multiline": True,
+            "initial_value": message[:MAX_MESSAGE_INPUT_LENGTH]
+        }
+    }
+    if len(message) > MAX_MESSAGE_INPUT_LENGTH:
+        message_block["hint"] = {
+            "type": "plain_text",
+            "text": (
+                f"Only the first {MAX_MESSAGE_INPUT_LENGTH:,} characters of"
+                " the message fit here.")
+        }
+    return {
+        "type": "modal",
+        "callback_id": SEND_LATER_CALLBACK_ID,
+        "title": {"type": "plain_text", "text": "Send later"},
+        "submit": {"type": "plain_text", "text": "Schedule"},
+        "close": {"type": "plain_text", "text": "Cancel"},
+        "blocks": [
+            {
+                "type": "input",
+                "block_id": "channel",
+                "label": {"type": "plain_text", "text": "Channel"},
+                "element": channel_select
+            },
+            {
+                "type": "input",
+                "block_id": "post_at",
+                "label": {"type": "plain_text", "text": "Send at"},
+                "element": {
+                    "type": "datetimepicker",
+                    "action_id": "post_at",
+                    "initial_date_time": post_at
+                }
+            },
+            message_block
+        ]
+    }
+
+
+def open_send_later_modal(payload):
+    # The global shortcut has no channel; the message shortcut starts
+    # with the message's channel and text.
+    user_id = payload['user']['id']
+    try:
+        token = User(user_id).get_auth_token(HOT_PATH_CONFIG)
+    except UserAuthorizeError:
+        print("Not opening the modal: user hasn't authorized DelaySay")
+        if payload.get('response_url'):
+            with timer("ResponseUrl"):
+                requests_post(
+                    url=payload['response_url'],
+                    json={
+                        'text': (
+                            "Sorry, I can't schedule messages for you because"
+                            " you haven't authorized DelaySay yet."
+                            "\n*Please grant DelaySay permission* to schedule"
+                            " your messages:"
+                            f"\n{api_domain}/add/?team="
+                            + payload['team']['id'])
+                    }
+                )
+        return
+    view = build_send_later_modal(
+        payload.get('channel', {}).get('id'),
+        payload.get('message', {}).get('text', ""))
+    with timer("Slack"):
+        r = requests_post(
+            url="https://slack.com/api/views.open",
+            json={
+                'trigger_id': payload['trigger_id'],
+                'view': view
+            },
+            headers={
+                'Content-Type': "application/json; charset=utf-8",
+                'Authorization': "Bearer " + token
+            },
+            # The trigger_id expires with Slack's 3 seconds anyway.
+            timeout=(
+                HOT_PATH_CONNECT_TIMEOUT_IN_SECONDS,
+                HOT_PATH_READ_TIMEOUT_IN_SECONDS)
+        )
+    response = json_loads(r.content)
+    if not response['ok']:
+        raise Exception("views.open failed: " + response['error'])
+
+
+def forward_send_later_submission(payload, request_timestamp):
+    # Returns the modal's errors, or None if the message was handed to
+    # the second responder to schedule.
+    values = payload['view']['state']['values']
+    post_at = values['post_at']['post_at'].get('selected_date_time')
+    if not post_at or post_at <= time():
+        return {'post_at': "Pick a time in the future."}
+    response_urls = payload.get('response_urls', [])
+    if not response_urls:
+        return {'channel': "Pick a channel to send the message in."}
+    params = {
+        'currentFunctionOfFunction': "send later",
+        'team_id': [payload['team']['id']],
+        'team_domain': [payload['team']['domain']],
+        'user_id': [payload['user']['id']],
+        'channel_id': [response_urls[0]['channel_id']],
+        'response_url': [response_urls[0]['response_url']],
+        'text': [values['message']['message']['value']],
+        'post_at': post_at,
+        'request_timestamp': request_timestamp
+    }
+    if payload.get('enterprise'):
+        params['enterprise_id'] = [payload['enterprise']['id']]
+    with timer("Lambda"):
+        lambda_client.invoke(
+            ClientContext="DelaySay handler",
+            FunctionName=second_responder_function,
+            InvocationType="Event",
+            Payload=json_dumps(params)
+        )
+    return None
+
+
+def lambda_handler(event, context):
+    verify_slack_signature(
+        request_timestamp=event['headers']['X-Slack-Request-Timestamp'],
+        received_signature=event['headers']['X-Slack-Signature'],
+        request_body=event['body'])
+    request_timestamp = int(event['headers']['X-Slack-Request-Timestamp'])
+    payload = json_loads(parse_qs(event['body'])['payload'][0])
+    if payload['type'] in ["shortcut", "message_action"]:
+        if payload['callback_id'] == SEND_LATER_CALLBACK_ID:
+            print("~~~   SEND LATER SHORTCUT   ~~~")
+            open_send_later_modal(payload)
+        return build_response(200)
+    if payload['type'] == "view_submission":
+        if payload['view']['callback_id'] == SEND_LATER_CALLBACK_ID:
+            print("~~~   SEND LATER SUBMISSION   ~~~")
+            errors = forward_send_later_submission(payload, request_timestamp)
+            if errors:
+                return build_errors_response(errors)
+        return build_response(200)
+    if payload['type'] != "block_actions":
+        print(f"Ignoring interaction of type {payload['type']}")
+        return build_response(200)
+    for action in payload['actions']:
+        if action['action_id'] not in FUNCTION_BY_ACTION_ID:
+            continue
+        print(f"~~~   BLOCK ACTION: {action['action_id']}   ~~~")
+        forward_block_action(payload, action, request_timestamp)
+    return build_response(200)
+
+
+@record_invocation
+def lambda_handler_with_catch_all(event, context):
+    try:
+        return lambda_handler(event, context)
+    except SlackSignatureReplayedError:
+        # Already handled (or being handled) in this container
+        print(format_exc().replace('\n', '\r'))
+        return build_response(200)
+    except (SlackSignaturesDoNotMatchError,
+            SlackSignatureTimeToleranceExceededError):
+        print(format_exc().replace('\n', '\r'))
+        return build_response(403)
+    except Exception:
+        # Slack shows the user an error next to what they clicked.
+        print(format_exc().replace('\n', '\r'))
+        return build_response(500)
@@ -5,21 +5,22 @@ https://github.com/awslabs/serverless-application-model/blob/master/examples/app
 
 from json import dumps as json_dumps
 from traceback import format_exc
-from boto3 import client as boto3_client
 from re import compile as re_compile
 from os import environ as os_environ
 from urllib.parse import parse_qs
-from random import sample as random_sample
 
 from DelaySayExceptions import (
-    SlackSignaturesDoNotMatchError, SlackSignatureTimeToleranceExceededError)
+    SlackSignaturesDoNotMatchError, SlackSignatureTimeToleranceExceededError,
+    SlackSignatureReplayedError)
 
 from verify_slack_signature import verify_slack_signature
+from message_catalog import build_help_text
+from metrics import timer, record_invocation
+from aws_clients import get_client, HOT_PATH_CONFIG
 
-lambda_client = boto3_client('lambda')
+lambda_client = get_client('lambda', HOT_PATH_CONFIG)
 
 second_responder_function = os_environ['SECOND_RESPONDER_FUNCTION']
-slash = os_environ['SLASH_COMMAND']
 contact_page = os_environ['CONTACT_PAGE']
 support_email = os_environ['SUPPORT_EMAIL']
 
@@ -36,36 +37,8 @@ def build_response(res):
 
 def build_help_response(params):
     user_id = params['user_id'][0]
-    examples = [
-        "2 min say It's been :two: minutes.",
-        "1 hour say Hi, all! :wave:",
-        "9am PST say Good morning! :sunny:",
-        "12 noon say It's time for lunch :yum:",
-        "September 13, say It's International Chocolate Day! :chocolate_bar:",
-        "January 1, 2020, 12am EST, say Happy New Year! :tada:"
-    ]
-    two_examples = random_sample(examples, 2)
-    res = f"Hi, <@{user_id}>! Open your favorite channel and type a command:"
-    res += (
-        f"\n        `{slash} [time] say [message]`"
-        f"\n        `{slash} {two_examples[0]}`"
-        f"\n        `{slash} {two_examples[1]}`"
-        "\nI will send the message from your username at the specified date"
-        " and time, up to 120 days in the future. (Can't schedule messages to"
-        " send in the past yet, but we'll consider adding this feature"
-        " once time travel is possible!)"
-        "\n\nTo see your scheduled messages in this channel or cancel the next"
-        " scheduled message, type:"
-        f"\n        `{slash} list`        or        `{slash} delete 1`"
-        "\n\nIf you're an admin in this Slack workspace, you can view past"
-        " invoices, update your payment information, and more in your Stripe"
-        " customer portal:"
-        f"\n        `{slash} billing`"
-        "\nAdmins can also give another user access to your workspace's"
-        " billing portal by typing this:"
-        f"\n        `{slash} billing authorize @username`"
-        f"\n\nQuestions? Please reach out at {contact_page} or {support_email}")
-    return build_response(res)
+    return build_response(build_help_text(
+        f"Hi, <@{user_id}>! Open your favorite channel and type a command:"))
 
 
 def respond_before_timeout(event, context):
@@ -81,23 +54,28 @@ def respond_before_timeout(event, context):
         return build_help_response(params)
     if command_text_only_letters == "list":
         params['currentFunctionOfFunction'] = "list"
+    elif command_text_only_letters == "listall":
+        params['currentFunctionOfFunction'] = "list all"
     elif command_text_only_letters in ["delete", "cancel", "remove"]:
         params['currentFunctionOfFunction'] = "delete"
     elif (command_text_only_letters.startswith("billing")
           or command_text_only_letters.startswith("pay")
           or command_text_only_letters.startswith("subscribe")):
         params['currentFunctionOfFunction'] = "billing"
+    elif command_text_only_letters.startswith("import"):
+        params['currentFunctionOfFunction'] = "import"
     else:
         params['currentFunctionOfFunction'] = "parse/schedule"
     
     params['request_timestamp'] = (
         int(event['multiValueHeaders']['X-Slack-Request-Timestamp'][0]))
-    lambda_client.invoke(
-        ClientContext="DelaySay handler",
-        FunctionName=second_responder_function,
-        InvocationType="Event",
-        Payload=json_dumps(params)
-    )
+    with timer("Lambda"):
+        lambda_client.invoke(
+            ClientContext="DelaySay handler",
+            FunctionName=second_responder_function,
+            InvocationType="Event",
+            Payload=json_dumps(params)
+        )
     
     user_command = f"{command} {command_text}"
     if "\n" in user_command:
@@ -126,6 +104,7 @@ def lambda_handler(event, context):
         return respond_before_timeout(event, context)
 
 
+@record_invocation
 def lambda_handler_with_catch_all(event, context):
     support_message = (
         "\nIf the error persists, feel free to reach out at"
@@ -142,6 +121,11 @@ def lambda_handler_with_catch_all(event, context):
         return build_response(
             "Hi, there! There's been an issue, error 403-B."
             + support_message)
+    except SlackSignatureReplayedError:
+        print(format_exc().replace('\n', '\r'))
+        return build_response(
+            "Hi, there! There's been an issue, error 403-C."
+            + support_message)
     except Exception:
         # Maybe remove this, since it could print sensitive information,
         # like the message parsed by SlashCommandParser.
@@ -19,8 +19,35 @@ class SlashCommandParser:
         except ValueError:
             raise CommandParseError(
                 self.command_text, "Cannot parse time and message")
-        self.time, self.force_timezone = self._parse_time()
+        try:
+            self.time, self.force_timezone = self._parse_time()
+        except TimeParseError as err:
+            # So the user can pick the time instead of retyping the command
+            err.scheduled_message = self._parse_message()
+            err.best_guess = self._guess_time()
+            raise
         self.message = self._parse_message()
+        self._clear_strings()
+    
+    @classmethod
+    def from_picked_time(cls, scheduled_time, message):
+        # For a time the user picked (with a date picker, say) rather
+        # than typed, so there's nothing for dateparser to do.
+        assert isinstance(scheduled_time, datetime)
+        assert bool(scheduled_time.tzinfo)
+        parser = cls.__new__(cls)
+        parser.initial_time = None
+        parser.user_tz = scheduled_time.tzinfo
+        parser.command_text = None
+        parser.original_time = None
+        parser.original_message = message
+        parser.time = scheduled_time
+        parser.force_timezone = False
+        parser.message = message
+        parser._clear_strings()
+        return parser
+    
+    def _clear_strings(self):
         self.date_string = None
         self.time_string = None
         self.date_string_for_slack = None
@@ -69,6 +96,27 @@ class SlashCommandParser:
             scheduled_time = scheduled_time.replace(second=0)
         return (scheduled_time, force_timezone)
     
+    def _guess_time(self):
+        # The first time dateparser can find anywhere in a time it
+        # couldn't parse as a whole (like the "tomorrow" in "tomorrow
+        # around 9ish"), or else the next whole hour.
+        from dateparser.search import search_dates
+        found = search_dates(
+            self.original_time,
+            languages=["en"],
+            settings={
+                'PREFER_DATES_FROM': "future",
+                'RELATIVE_BASE': self.initial_time.replace(tzinfo=None)
+            }
+        )
+        for _, guess in found or []:
+            if not guess.tzinfo:
+                guess = guess.replace(tzinfo=self.user_tz)
+            if guess > self.initial_time:
+                return guess.astimezone(self.user_tz)
+        next_hour = self.initial_time + timedelta(hours=1)
+        return next_hour.replace(minute=0, second=0, microsecond=0)
+    
     def _compose_datetime_strings_for_slack(self):
         # timestamp: seconds since January 1, 1970, 00:00:00 UTC
         timestamp = int(self.time.timestamp())
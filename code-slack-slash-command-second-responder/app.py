@@ -3,36 +3,54 @@ Code included from:
 https://github.com/awslabs/serverless-application-model/blob/master/examples/apps/slack-echo-command-python/lambda_function.py
 '''
 
+import asyncio
 from traceback import format_exc
 from requests import post as requests_post
+from json import dumps as json_dumps
 
-from slack import (
+from slack_sdk import (
     WebClient as slack_WebClient,
     errors as slack_errors)
 
-from os import environ as os_environ
+from os import environ as os_environ, remove as os_remove
 from datetime import datetime, timedelta, timezone
-from random import sample as random_sample
 
 from User import User
 from Team import Team
+from ScheduledMessageIndex import ScheduledMessageIndex
 from SlashCommandParser import SlashCommandParser
 from DelaySayExceptions import (
-    UserAuthorizeError, CommandParseError, TimeParseError, AllStripeSubscriptionsInvalid)
+    UserAuthorizeError, CommandParseError, TimeParseError, AllStripeSubscriptionsInvalid,
+    ImportFileError)
 
 from billing_util import (
     parse_option_and_user, write_message_and_add_or_remove_billing_role,
-    write_billing_portal_message, generate_billing_url)
+    write_billing_managers_message,
+    write_billing_portal_message, generate_billing_url,
+    generate_billing_token, prepare_billing_portal_session)
 from list_and_delete_util import (
     convert_to_slack_datetime, get_scheduled_messages,
-    validate_index_against_scheduled_messages)
+    validate_index_against_scheduled_messages, split_scheduled_messages_list)
+from bulk_schedule_util import (
+    BulkScheduler, split_off_channels, describe_schedule_error,
+    MAX_CHANNELS_PER_COMMAND)
+from import_util import (
+    find_file_id, get_file_info, open_import_file, add_to_index,
+    ImportReport, ScheduledMessageImport, IMPORT_TIME_RESERVE_IN_MS,
+    MAX_IMPORT_ROWS)
+from idempotency_util import IdempotencyRecord, is_transient_error
+from time_picker_util import write_time_picker_blocks, read_picked_time
+from message_catalog import (
+    build_help_text, write_payment_warning, get_subscribe_link, CONTACT_US,
+    write_payment_required_message as write_payment_required_text)
+from metrics import timer, record_invocation
+from aws_clients import get_client
 
 
 slash = os_environ['SLASH_COMMAND']
 api_domain = os_environ['SLASH_COMMAND_LINKS_DOMAIN']
 contact_page = os_environ['CONTACT_PAGE']
 support_email = os_environ['SUPPORT_EMAIL']
-subscribe_url = os_environ['SUBSCRIBE_URL']
 
 
 # Let the team try DelaySay without paying.
@@ -58,16 +76,72 @@ MIN_TIME_FOR_DELETION = timedelta(minutes=5)
 MIN_TIME_FOR_DELETION_STRING = "5 minutes"
 
 
-def post_and_print_info_and_confirm_success(response_url, text):
-    r = requests_post(
-        url=response_url,
-        json={
-            'text': text
-        },
-        headers={
-            'Content-Type': "application/json"
-        }
-    )
+# Show this many messages at a time for `list all`
+LIST_ALL_PAGE_SIZE = 20
+
+# Slack only shows so much of one message, and a response_url takes at
+# most 5 replies, so `list` sends long listings in parts of about this
+# many characters, up to this many parts.
+LIST_RESPONSE_PART_LENGTH = 3500
+MAX_LIST_RESPONSE_PARTS = 5
+
+# The parts of `list` and `list all` responses that are the same every time
+LIST_HEADER = (
+    f"Here are the messages you have scheduled in this channel with `{slash}`:"
+    "\nTo cancel the first message"
+    f" (if it is sending in over {MIN_TIME_FOR_DELETION_STRING}),"
+    f" reply with `{slash} delete 1`.")
+LIST_ALL_HEADER = (
+    f"Here are the messages you have scheduled with `{slash}` in every channel:")
+LIST_ALL_FOOTER = (
+    "\n\nTo see a message's text or cancel it, type"
+    f" `{slash} list` in its channel.")
+
+# What to load for each command while the request is being claimed (see
+# lambda_handler_async). These don't depend on each other: "token" is a
+# DynamoDB read and a KMS decrypt, "timezone" is users.info right after
+# that, and "team" is a DynamoDB read and sometimes Stripe.
+PREFETCH_BY_FUNCTION = {
+    "parse/schedule": {"token", "timezone", "team"},
+    "schedule at": {"token", "timezone", "team"},
+    "send later": {"token", "timezone", "team"},
+    "list": {"token"},
+    "delete": {"token"},
+    "billing": {"token", "team"},
+    "import": {"token", "team"}
+}
+
+
+# The request this container is handling right now. Every response is
+# saved to it before it's posted, so a duplicate delivery of the same
+# request can be answered without running the command again.
+current_request = None
+
+
+def post_and_print_info_and_confirm_success(response_url, text,
+                                            save_response=True, blocks=None,
+                                            replace_original=False):
+    # save_response=False for the later parts of a response sent in
+    # parts, so a duplicate request gets (only) the first part again.
+    # With blocks, the text is what notifications and duplicate requests
+    # show instead.
+    if current_request and save_response:
+        current_request.save_response(text)
+    response = {
+        'text': text
+    }
+    if blocks:
+        response['blocks'] = blocks
+    if replace_original:
+        response['replace_original'] = True
+    with timer("ResponseUrl"):
+        r = requests_post(
+            url=response_url,
+            json=response,
+            headers={
+                'Content-Type': "application/json"
+            }
+        )
     if r.status_code != 200:
         print(r.status_code, r.reason)
         print(r.text)
@@ -75,13 +149,86 @@ def post_and_print_info_and_confirm_success(response_url, text):
     return r
 
 
-def list_scheduled_messages(params):
+def reconcile_index(user_id, scheduled_messages, channel_id):
+    # Slack's listing is the truth; bring the index in line with it.
+    try:
+        ScheduledMessageIndex(user_id).reconcile(scheduled_messages, channel_id)
+    except Exception:
+        print(
+            "Couldn't reconcile the scheduled message index:\r\r"
+            + format_exc().replace('\n', '\r'))
+
+
+def remove_from_index(user_id, message_info):
+    try:
+        ScheduledMessageIndex(user_id).remove(
+            message_info['id'], message_info['post_at'])
+    except Exception:
+        print(
+            "Couldn't remove the message from the scheduled message index:\r\r"
+            + format_exc().replace('\n', '\r'))
+
+
+def list_all_scheduled_messages(params):
+    user_id = params['user_id'][0]
+    team_id = params['team_id'][0]
+    response_url = params['response_url'][0]
+    command_text = params['text'][0]
+    
+    # Nothing here needs the token, so don't decrypt it.
+    if not User(user_id).is_in_dynamodb():
+        post_and_print_info_and_confirm_success(
+            response_url,
+            "Sorry, I can't check your scheduled texts because you haven't"
+            " authorized DelaySay yet."
+            "\n*Please grant DelaySay permission* to schedule your messages:"
+            f"\n{api_domain}/add/?team=" + team_id)
+        return
+    
+    try:
+        page_number = max(1, int(command_text.split()[-1]))
+    except ValueError:
+        page_number = 1
+    
+    # Page through the index itself rather than asking Slack about every
+    # channel; each page is one query.
+    index = ScheduledMessageIndex(user_id)
+    last_evaluated_key = None
+    for page in range(1, page_number + 1):
+        entries, last_evaluated_key = index.get_page(
+            LIST_ALL_PAGE_SIZE, last_evaluated_key)
+        if page < page_number and not last_evaluated_key:
+            entries = []
+            break
+    first_number = (page_number - 1) * LIST_ALL_PAGE_SIZE + 1
+    if not entries:
+        if page_number > 1:
+            res = f"There are no more messages. Try `{slash} list all`."
+        else:
+            res = (
+                f"You haven't scheduled any messages using `{slash}`."
+                "\n(Messages you scheduled before I started keeping track"
+                " will show up here after you type"
+                f" `{slash} list` in their channel.)")
+        post_and_print_info_and_confirm_success(response_url, res)
+        return
+    lines = [LIST_ALL_HEADER]
+    for i, entry in enumerate(entries, start=first_number):
+        slack_datetime = convert_to_slack_datetime(timestamp=int(entry['post_at']))
+        lines.append(f"\n    *{i}) {slack_datetime}* in <#{entry['channel_id']}>")
+    lines.append(LIST_ALL_FOOTER)
+    if last_evaluated_key:
+        lines.append(f"\nTo see more, type `{slash} list all {page_number + 1}`.")
+    post_and_print_info_and_confirm_success(response_url, "".join(lines))
+
+
+def list_scheduled_messages(params, user=None):
     channel_id = params['channel_id'][0]
     user_id = params['user_id'][0]
     team_id = params['team_id'][0]
     response_url = params['response_url'][0]
     
-    user = User(user_id)
+    user = user or User(user_id)
     
     try:
         token = user.get_auth_token()
@@ -95,31 +242,38 @@ def list_scheduled_messages(params):
         return
     
     scheduled_messages = get_scheduled_messages(channel_id, token)
-    if scheduled_messages:
-        res = f"Here are the messages you have scheduled in this channel with `{slash}`:"
-        res += (
-            "\nTo cancel the first message"
-            f" (if it is sending in over {MIN_TIME_FOR_DELETION_STRING}),"
-            f" reply with `{slash} delete 1`.")
-        for i, message_info in enumerate(scheduled_messages):
-            slack_datetime = convert_to_slack_datetime(timestamp=message_info['post_at'])
-            message = message_info['text']
-            res += "\n\n"
-            res += f"    *{i+1}) {slack_datetime}:*"
-            res += f"\n{message}".replace("\n", "\n> ")
-    else:
+    if not scheduled_messages:
         res = f"You haven't scheduled any messages using `{slash}` in this channel."
-    post_and_print_info_and_confirm_success(response_url, res)
+        post_and_print_info_and_confirm_success(response_url, res)
+        reconcile_index(user_id, scheduled_messages, channel_id)
+        return
+    # Send each part as soon as it's written, so the first messages show
+    # up before the rest are formatted.
+    parts = split_scheduled_messages_list(
+        LIST_HEADER, scheduled_messages, LIST_RESPONSE_PART_LENGTH)
+    for part_number, (part, messages_left) in enumerate(parts, start=1):
+        if part_number == MAX_LIST_RESPONSE_PARTS and messages_left:
+            part += (
+                f"\n\n_...and {messages_left} more, which don't fit in"
+                " this reply._ Cancel some messages to see the rest, or"
+                f" type `{slash} list all` to see when they're all scheduled.")
+        post_and_print_info_and_confirm_success(
+            response_url, part, save_response=(part_number == 1))
+        if part_number == MAX_LIST_RESPONSE_PARTS:
+            break
+    # Slack's listing is already on its way to the user, so keeping the
+    # index in line with it can wait until now.
+    reconcile_index(user_id, scheduled_messages, channel_id)
 
 
-def delete_scheduled_message(params):
+def delete_scheduled_message(params, user=None):
     channel_id = params['channel_id'][0]
     user_id = params['user_id'][0]
     team_id = params['team_id'][0]
     response_url = params['response_url'][0]
     command_text = params['text'][0]
     
-    user = User(user_id)
+    user = user or User(user_id)
     
     try:
         token = user.get_auth_token()
@@ -165,10 +319,12 @@ def delete_scheduled_message(params):
         return
     
     try:
-        slack_client.chat_deleteScheduledMessage(
-            channel=channel_id,
-            scheduled_message_id=message_info['id']
-        )
+        with timer("Slack"):
+            slack_client.chat_deleteScheduledMessage(
+                channel=channel_id,
+                scheduled_message_id=message_info['id']
+            )
+        remove_from_index(user_id, message_info)
         slack_datetime = convert_to_slack_datetime(timestamp=message_info['post_at'])
         message = message_info['text']
         res = (
@@ -177,6 +333,7 @@ def delete_scheduled_message(params):
             f"\n{message}".replace("\n", "\n> "))
     except slack_errors.SlackApiError as err:
         if err.response['error'] == "invalid_scheduled_message_id":
+            remove_from_index(user_id, message_info)
             res = (
                 f"I cannot cancel message {message_number};"
                 " it already sent or will send within 60 seconds.")
@@ -188,15 +345,15 @@ def delete_scheduled_message(params):
     post_and_print_info_and_confirm_success(response_url, res)
 
 
-def respond_to_billing_request(params):
+def respond_to_billing_request(params, user=None, team=None):
     user_id = params['user_id'][0]
     team_id = params['team_id'][0]
     team_domain = params['team_domain'][0]
     response_url = params['response_url'][0]
     command_text = params['text'][0]
     
-    user = User(user_id)
-    team = Team(team_id)
+    user = user or User(user_id)
+    team = team or Team(team_id)
     
     try:
         user.get_auth_token()
@@ -211,26 +368,27 @@ def respond_to_billing_request(params):
     
     billing_info = (
         "your workspace's DelaySay subscription and billing information")
-    option, other_user_id, other_user = parse_option_and_user(command_text)
-    if option:
+    billing_token = None
+    option, other_user_id, other_user = parse_option_and_user(
+        command_text, team)
+    if option == "list":
+        res = write_billing_managers_message(team, billing_info)
+    elif option:
         res = write_message_and_add_or_remove_billing_role(
             option, user, user_id, other_user, other_user_id, billing_info)
     elif team.is_trialing():
         if team.get_time_payment_has_been_overdue() > PAYMENT_GRACE_PERIOD:
             res = (
                 "Your team's free trial has ended."
-                "\nTo continue using DelaySay, *please subscribe here:*"
-                f"\n{subscribe_url}/?team={team_id}"
-                "\nIf you have any questions, please reach out at"
-                f" {contact_page} or {support_email}"
-            )
+                "\nTo continue using DelaySay, *please subscribe here:*\n"
+                + get_subscribe_link(team_id) + CONTACT_US)
         else:
             res = (
                 "Your team is currently on a *free trial* with full access"
                 " to all DelaySay features."
                 "\nIf you're interested in starting your DelaySay subscription"
                 " early before your trial ends, please subscribe here:"
-                f"\n{subscribe_url}/?team={team_id}"
+                f"\n{get_subscribe_link(team_id)}"
                 "\nAfter you subscribe, check back here to manage"
                 f" {billing_info}."
                 # TODO: Add the trial expiration date
@@ -253,70 +411,25 @@ def respond_to_billing_request(params):
         # expiration date, but the team has no Stripe subscription yet.
         pass
     else:
+        billing_token = generate_billing_token(
+            user_id, team_id, team_domain, portal_session_prepared=True)
         res = write_billing_portal_message(
-            user_id, team_id, team_domain, response_url)
+            user_id, team_id, team_domain, billing_token)
     
     post_and_print_info_and_confirm_success(response_url, res)
-
-
-def build_help_text():
-    examples = [
-        "2 min say It's been :two: minutes.",
-        "1 hour say Hi, all! :wave:",
-        "9am PST say Good morning! :sunny:",
-        "12 noon say It's time for lunch :yum:",
-        "September 13, say It's International Chocolate Day! :chocolate_bar:",
-        "January 1, 2020, 12am EST, say Happy New Year! :tada:"
-    ]
-    two_examples = random_sample(examples, 2)
-    res = "Here is the command format:"
-    res += (
-        f"\n        `{slash} [time] say [message]`"
-        f"\n        `{slash} {two_examples[0]}`"
-        f"\n        `{slash} {two_examples[1]}`"
-        "\nI will send the message from your username at the specified date"
-        " and time, up to 120 days in the future. (Can't schedule messages to"
-        " send in the past yet, but we'll consider adding this feature"
-        " once time travel is possible!)"
-        "\n\nTo see your scheduled messages in this channel or cancel the next"
-        " scheduled message, type:"
-        f"\n        `{slash} list`        or        `{slash} delete 1`"
-        "\n\nIf you're an admin in this Slack workspace, you can view past"
-        " invoices, update your payment information, and more in your Stripe"
-        " customer portal:"
-        f"\n        `{slash} billing`"
-        "\nAdmins can also give another user access to your workspace's"
-        " billing portal by typing this:"
-        f"\n        `{slash} billing authorize @username`"
-        f"\n\nQuestions? Please reach out at {contact_page} or {support_email}")
-    return res
-
-
-def parse_and_schedule(params):
-    user_id = params['user_id'][0]
-    team_id = params['team_id'][0]
-    team_domain = params['team_domain'][0]
-    channel_id = params['channel_id'][0]
-    command_text = params['text'][0]
-    response_url = params['response_url'][0]
-    
-    user = User(user_id)
-    team = Team(team_id)
-    
-    try:
-        token = user.get_auth_token()
-    except UserAuthorizeError:
-        post_and_print_info_and_confirm_success(
-            response_url,
-            "Sorry, your text cannot be sent because you haven't"
-            " authorized DelaySay yet."
-            "\n*Please grant DelaySay permission* to schedule your messages,"
-            " then try again:"
-            f"\n{api_domain}/add/?team=" + team_id +
-            "\nIf you have any questions, please reach out at"
-            f" {contact_page} or {support_email}")
-        return
     
+    if billing_token:
+        # The user already has their link, so if this fails, the billing
+        # redirect will just create the portal session itself.
+        try:
+            prepare_billing_portal_session(billing_token, team)
+        except Exception:
+            print(
+                "Couldn't prepare the Stripe customer portal session:\r\r"
+                + format_exc().replace('\n', '\r'))
+
+
+def get_payment_status(team):
     if team.is_trialing():
         if team.get_time_payment_has_been_overdue() > PAYMENT_GRACE_PERIOD:
             payment_status = "red trial"
@@ -332,144 +445,516 @@ def parse_and_schedule(params):
             payment_status = "yellow"
         else:
             payment_status = "green"
-    
-    subscribe_url_with_team_id = f"{subscribe_url}/?team={team_id}"
-    
-    if payment_status.startswith("red"):
-        text = ("\nWe hope you've enjoyed DelaySay! Your *message cannot be"
-                " sent* because your workspace's")
-        if payment_status == "red trial":
-            text += (
-                " free trial has ended."
-                "\nTo continue using DelaySay, *please subscribe here:*"
-                "\n" + subscribe_url_with_team_id +
-                "\nIf you have any questions, please reach out at"
-                f" {contact_page} or {support_email}"
-            )
-        else:
-            text += " subscription has expired or the last payment failed."
-            # TODO: As of 2021-02-06, if the team's subscription was
-            # cancelled (not failed), the Stripe customer portal will
-            # show payment information but no current plan.
-            # And it will not have a way to add a plan.
-            # So don't offer to send them to the billing portal.
-            # Just have them make a new subscription or contact us.
-            if user.can_manage_billing():
-                url = generate_billing_url(user_id, team_id, team_domain)
-                text += (
-                    "\n\nTo see why, please *view your Stripe customer"
-                    " portal*:"
-                    f"\n{url}"
-                )
-            else:
-                text += (
-                    "\n\nTo see why, an admin in your Slack workspace can type"
-                    " this to *view your Stripe customer portal*:"
-                    f"\n        `{slash} billing`"
-                )
-            text += (
-                "\nIn your billing portal, you can add credit cards, view past"
-                " invoices, and manage your DelaySay subscription."
-                "\n\nOr if you prefer, you can start a new subscription:"
-                "\n" + subscribe_url_with_team_id +
-                "\n\nIf you have any questions or concerns, we'd be happy to"
-                f" chat with you at {contact_page} or {support_email}"
-            )
-        
-        post_and_print_info_and_confirm_success(response_url, text)
-        return
-    # fi payment_status.startswith("red")
-    
+    return payment_status
+
+
+def write_payment_required_message(payment_status, user, user_id,
+                                   team_id, team_domain):
+    billing_url = None
+    # TODO: As of 2021-02-06, if the team's subscription was
+    # cancelled (not failed), the Stripe customer portal will
+    # show payment information but no current plan.
+    # And it will not have a way to add a plan.
+    # So don't offer to send them to the billing portal.
+    # Just have them make a new subscription or contact us.
+    if payment_status != "red trial" and user.can_manage_billing():
+        billing_url = generate_billing_url(user_id, team_id, team_domain)
+    return write_payment_required_text(
+        payment_status, team_id, billing_url)
+
+
+def schedule_in_channels(slack_client, user_id, team_id, channel_ids,
+                         unix_timestamp, message, request_unix_timestamp,
+                         date, time):
+    # Schedule the same message in every channel at once and report
+    # which channels worked and which didn't, in one response.
+    jobs = [(channel_id, unix_timestamp, message) for channel_id in channel_ids]
+    scheduled_channels = []
+    messages_to_index = []
+    failures = []
+    for job, scheduled_message_id, error_code in BulkScheduler(
+            slack_client, team_id).schedule(jobs):
+        channel_id = job[0]
+        if scheduled_message_id:
+            scheduled_channels.append(channel_id)
+            messages_to_index.append(
+                (scheduled_message_id, channel_id, unix_timestamp, message))
+            continue
+        print(f"Couldn't schedule in {channel_id}: {error_code}")
+        error_text = describe_schedule_error(
+            error_code, message, unix_timestamp, request_unix_timestamp)
+        failures.append((channel_id, error_text or "There was an error."))
+    add_to_index(ScheduledMessageIndex(user_id), messages_to_index)
+    if scheduled_channels:
+        channels = ", ".join(
+            f"<#{channel_id}>" for channel_id in scheduled_channels)
+        text = (
+            f'At {time} on {date}, I will post in {channels} on your behalf:'
+            f'\n{message}'.replace("\n", "\n> "))
+    else:
+        text = "I couldn't schedule your message in any of those channels."
+    if failures:
+        text += "\n"
+        for channel_id, error_text in failures:
+            text += f"\n:warning: Not scheduled in <#{channel_id}>: {error_text}"
+    return text
+
+
+def parse_command(params, user):
+    # Returns (parser, channel_ids, None, None), or
+    # (None, None, error_text, error_blocks) if the command can't be
+    # scheduled as written. error_blocks is None unless the user can fix
+    # the command by picking a time.
+    command_text = params['text'][0]
     request_unix_timestamp = params['request_timestamp']
     
+    command_text, channel_ids = split_off_channels(command_text)
+    if len(channel_ids) > MAX_CHANNELS_PER_COMMAND:
+        return None, None, (
+            f"I can schedule a message in up to {MAX_CHANNELS_PER_COMMAND}"
+            f" channels at once, but you listed {len(channel_ids)}."), None
+    
     user_tz = user.get_timezone()
     try:
         parser = SlashCommandParser(
             command_text,
             datetime.fromtimestamp(request_unix_timestamp, tz=user_tz))
     except CommandParseError:
-        post_and_print_info_and_confirm_success(
-            response_url,
+        return None, None, (
             "*Sorry, I don't understand. Please try again.*\n"
-            + build_help_text())
-        return
+            + build_help_text()), None
     except TimeParseError as err:
-        post_and_print_info_and_confirm_success(
-            response_url,
+        error_text = (
             f'I don\'t understand the time "{err.time_text}".'
             f" *Please rephrase the time* or try `{slash} help`.")
-        return
+        if not err.scheduled_message:
+            return None, None, error_text, None
+        return None, None, error_text, write_time_picker_blocks(
+            f'I don\'t understand the time "{err.time_text}".'
+            " *Pick a date and time* to schedule your message,"
+            f" or try `{slash} help`.",
+            err.best_guess, err.scheduled_message, channel_ids)
+    
+    if not parser.get_message():
+        return None, None, "I can't schedule an empty message.", None
+    return parser, channel_ids, None, None
+
+
+def schedule_parsed_command(params, token, parser, channel_ids,
+                            payment_status, replace_original=False):
+    user_id = params['user_id'][0]
+    team_id = params['team_id'][0]
+    channel_id = params['channel_id'][0]
+    response_url = params['response_url'][0]
+    request_unix_timestamp = params['request_timestamp']
     
     date = parser.get_date_string_for_slack()
     time = parser.get_time_string_for_slack()
     unix_timestamp = datetime.timestamp(parser.get_time())
     message = parser.get_message()
-
-    if not message:
-        error_text = "I can't schedule an empty message."
-        post_and_print_info_and_confirm_success(response_url, error_text)
-        return
     
     slack_client = slack_WebClient(token=token)
+    if channel_ids:
+        text = schedule_in_channels(
+            slack_client, user_id, team_id, channel_ids, unix_timestamp,
+            message, request_unix_timestamp, date, time)
+        text += write_payment_warning(payment_status, team_id)
+        post_and_print_info_and_confirm_success(
+            response_url, text, replace_original=replace_original)
+        return
+    
     try:
-        slack_client.chat_scheduleMessage(
-            channel=channel_id,
-            post_at=unix_timestamp,
-            text=message
-        )
+        with timer("Slack"):
+            response = slack_client.chat_scheduleMessage(
+                channel=channel_id,
+                post_at=unix_timestamp,
+                text=message
+            )
     except slack_errors.SlackApiError as err:
-        error_code = err.response['error']
-        if error_code == "time_in_past":
-            if unix_timestamp < request_unix_timestamp:
-                error_text = "Slack can't schedule a message in the past."
-            else:
-                error_text = "Slack can't schedule in the extremely near future."
-        elif error_code == "time_too_far":
-            error_text = "Slack can't schedule too far into the future, typically 120 days."
-        elif error_code == "msg_too_long":
-            error_text = (
-                f"Slack can't schedule a message if it's too long; yours is {len(message)} characters.")
-        elif error_code == "restricted_too_many":
-            error_text = "Slack can't schedule too many messages too close together."
-        else:
+        error_text = describe_schedule_error(
+            err.response['error'], message, unix_timestamp,
+            request_unix_timestamp)
+        if not error_text:
             raise
-        post_and_print_info_and_confirm_success(response_url, error_text)
+        post_and_print_info_and_confirm_success(
+            response_url, error_text, replace_original=replace_original)
         return
+    add_to_index(
+        ScheduledMessageIndex(user_id),
+        [(response['scheduled_message_id'], channel_id, response['post_at'],
+          message)])
     
     text = (
         f'At {time} on {date}, I will post on your behalf:'
         f'\n{message}'.replace("\n", "\n> "))
-    if payment_status.startswith("yellow"):
-        text += "\n\nWe hope you're enjoying DelaySay! Your workspace's"
-        if payment_status == "yellow trial":
-            text += " free trial is almost over."
-        elif payment_status == "yellow":
-            text += " subscription is expiring."
-        text += ("\nTo continue using DelaySay, *please subscribe here:*"
-                 "\n" + subscribe_url_with_team_id +
-                 "\nIf you have any questions, please reach out at"
-                 f" {contact_page} or {support_email}")
-    post_and_print_info_and_confirm_success(response_url, text)
+    text += write_payment_warning(payment_status, team_id)
+    post_and_print_info_and_confirm_success(
+        response_url, text, replace_original=replace_original)
 
 
-def lambda_handler(event, context):
-    function = event.get("currentFunctionOfFunction")
+def parse_and_schedule(params, user=None, team=None):
+    user_id = params['user_id'][0]
+    team_id = params['team_id'][0]
+    team_domain = params['team_domain'][0]
+    response_url = params['response_url'][0]
+    
+    user = user or User(user_id)
+    team = team or Team(team_id)
+    
+    try:
+        token = user.get_auth_token()
+    except UserAuthorizeError:
+        post_and_print_info_and_confirm_success(
+            response_url,
+            "Sorry, your text cannot be sent because you haven't"
+            " authorized DelaySay yet."
+            "\n*Please grant DelaySay permission* to schedule your messages,"
+            " then try again:"
+            f"\n{api_domain}/add/?team=" + team_id +
+            "\nIf you have any questions, please reach out at"
+            f" {contact_page} or {support_email}")
+        return
+    
+    payment_status = get_payment_status(team)
+    
+    if payment_status.startswith("red"):
+        text = write_payment_required_message(
+            payment_status, user, user_id, team_id, team_domain)
+        
+        post_and_print_info_and_confirm_success(response_url, text)
+        return
+    # fi payment_status.startswith("red")
+    
+    parser, channel_ids, error_text, error_blocks = parse_command(
+        params, user)
+    if error_text:
+        post_and_print_info_and_confirm_success(
+            response_url, error_text, blocks=error_blocks)
+        return
+    schedule_parsed_command(
+        params, token, parser, channel_ids, payment_status)
+
+
+async def parse_and_schedule_async(params, user_load, team_load):
+    # Parses the command while the team's payment status is worked out
+    # (which can take a call to Stripe), and schedules the message as
+    # soon as both are done, instead of one after the other. Almost every
+    # team is paid up, so the parsing is rarely wasted. Anything else (no
+    # token, payment required, an error) goes through parse_and_schedule()
+    # in its usual order, so the user gets the same response as before.
+    async def load_and_parse():
+        user = await user_load
+        return user, await asyncio.to_thread(parse_command, params, user)
+    
+    async def load_and_check_payment():
+        team = await team_load
+        return team, await asyncio.to_thread(get_payment_status, team)
+    
+    parsed, checked = await asyncio.gather(
+        load_and_parse(), load_and_check_payment(), return_exceptions=True)
+    if isinstance(parsed, Exception) or isinstance(checked, Exception):
+        print("Scheduling in order, because loading or parsing failed")
+        user = None if isinstance(parsed, Exception) else parsed[0]
+        team = None if isinstance(checked, Exception) else checked[0]
+        return parse_and_schedule(params, user, team)
+    user, (parser, channel_ids, error_text, error_blocks) = parsed
+    team, payment_status = checked
+    if payment_status.startswith("red"):
+        return parse_and_schedule(params, user, team)
+    if error_text:
+        post_and_print_info_and_confirm_success(
+            params['response_url'][0], error_text, blocks=error_blocks)
+        return
+    schedule_parsed_command(
+        params, user.get_auth_token(), parser, channel_ids, payment_status)
+
+
+def schedule_without_parsing(params, read_time, user=None, team=None,
+                             replace_original=False):
+    # For a time the user picked in Slack instead of typing it, so
+    # nothing is parsed. read_time(user_tz) returns
+    # (scheduled_time, message, channel_ids).
+    user_id = params['user_id'][0]
+    team_id = params['team_id'][0]
+    team_domain = params['team_domain'][0]
+    response_url = params['response_url'][0]
+    
+    user = user or User(user_id)
+    team = team or Team(team_id)
+    
+    try:
+        token = user.get_auth_token()
+    except UserAuthorizeError:
+        post_and_print_info_and_confirm_success(
+            response_url,
+            "Sorry, your text cannot be sent because you haven't"
+            " authorized DelaySay yet."
+            "\n*Please grant DelaySay permission* to schedule your messages,"
+            " then try again:"
+            f"\n{api_domain}/add/?team=" + team_id + CONTACT_US,
+            replace_original=replace_original)
+        return
+    
+    payment_status = get_payment_status(team)
+    if payment_status.startswith("red"):
+        text = write_payment_required_message(
+            payment_status, user, user_id, team_id, team_domain)
+        post_and_print_info_and_confirm_success(
+            response_url, text, replace_original=replace_original)
+        return
+    
+    scheduled_time, message, channel_ids = read_time(user.get_timezone())
+    parser = SlashCommandParser.from_picked_time(scheduled_time, message)
+    schedule_parsed_command(
+        params, token, parser, channel_ids, payment_status,
+        replace_original=replace_original)
+
+
+def schedule_picked_time(params, user=None, team=None):
+    # The "Schedule" button under a time the parser didn't understand
+    # (see time_picker_util.py). Each response replaces the pickers, so
+    # the button can't be clicked twice.
+    def read_time(user_tz):
+        return read_picked_time(
+            params['text'][0], params['state_values'], user_tz)
+    schedule_without_parsing(
+        params, read_time, user, team, replace_original=True)
+
+
+def schedule_from_modal(params, user=None, team=None):
+    # The "Send later" shortcut's modal (see code-slack-interactivity),
+    # which already has the channel, the message and a Unix timestamp.
+    def read_time(user_tz):
+        return (
+            datetime.fromtimestamp(params['post_at'], tz=user_tz),
+            params['text'][0], [])
+    schedule_without_parsing(params, read_time, user, team)
+
+
+def send_import_report(slack_client, user_id, file_info, report_path,
+                       summary):
+    # The import can outlast the response_url, so send the report as a
+    # file in the user's direct message with themself. (files_upload_v2
+    # gets an upload URL, uploads to it, and then shares the file, since
+    # Slack retired files.upload.)
+    with timer("Slack"):
+        response = slack_client.conversations_open(users=user_id)
+    with timer("Slack"):
+        slack_client.files_upload_v2(
+            channel=response['channel']['id'],
+            file=report_path,
+            filename="delaysay-import-report-" + file_info['id'] + ".csv",
+            initial_comment=summary
+        )
+    os_remove(report_path)
+
+
+def import_scheduled_messages(params, context, user=None, team=None):
+    user_id = params['user_id'][0]
+    team_id = params['team_id'][0]
+    team_domain = params['team_domain'][0]
+    response_url = params['response_url'][0]
+    command_text = params['text'][0]
+    import_state = params.get('import_state')
+    
+    user = user or User(user_id)
+    team = team or Team(team_id)
+    
+    try:
+        token = user.get_auth_token()
+    except UserAuthorizeError:
+        post_and_print_info_and_confirm_success(
+            response_url,
+            "Sorry, I can't import your messages because you haven't"
+            " authorized DelaySay yet."
+            "\n*Please grant DelaySay permission* to schedule your messages:"
+            f"\n{api_domain}/add/?team=" + team_id)
+        return
+    
+    if not import_state:
+        # First part: check everything once, before reading any rows.
+        file_id = find_file_id(command_text)
+        if not file_id:
+            post_and_print_info_and_confirm_success(
+                response_url,
+                "To schedule many messages at once, upload a CSV or JSON file"
+                " with the columns *channel*, *time*, and *message* to Slack,"
+                " copy the link to the file, and type:"
+                f"\n        `{slash} import [link to file]`"
+                "\nUse channel IDs (like C012AB3CD) and any time you'd type"
+                f" after `{slash}`, like `9am PST` or `2 hours`.")
+            return
+        payment_status = get_payment_status(team)
+        if payment_status.startswith("red"):
+            text = write_payment_required_message(
+                payment_status, user, user_id, team_id, team_domain)
+            post_and_print_info_and_confirm_success(response_url, text)
+            return
+        try:
+            file_info = get_file_info(file_id, token)
+        except ImportFileError as err:
+            post_and_print_info_and_confirm_success(response_url, str(err))
+            return
+        post_and_print_info_and_confirm_success(
+            response_url,
+            f"I'm importing `{file_info['name']}`. I'll schedule the messages"
+            " a few at a time and send you a report in a direct message"
+            " when I'm done.")
+        import_state = {
+            'file_info': file_info,
+            'part': 1,
+            'rows_done': 0,
+            'scheduled': 0,
+            'failed': 0
+        }
+    file_info = import_state['file_info']
+    
+    initial_time = datetime.fromtimestamp(
+        params['request_timestamp'], tz=user.get_timezone())
+    report = ImportReport()
+    run = ScheduledMessageImport(
+        initial_time, report, import_state['rows_done'],
+        should_stop=lambda: (
+            context.get_remaining_time_in_millis() < IMPORT_TIME_RESERVE_IN_MS),
+        index=ScheduledMessageIndex(user_id))
+    first_row = import_state['rows_done'] + 1
+    error_text = None
+    slack_client = slack_WebClient(token=token)
+    response, rows = open_import_file(file_info, token)
+    try:
+        for job, scheduled_message_id, error_code in BulkScheduler(
+                slack_client, team_id).schedule(run.jobs(rows)):
+            run.add_result(job, scheduled_message_id, error_code)
+    except ImportFileError as err:
+        error_text = str(err)
+    finally:
+        run.flush_index()
+        response.close()
+        report_path = report.close()
+    
+    import_state['rows_done'] = run.rows_done
+    import_state['scheduled'] += report.scheduled
+    import_state['failed'] += report.failed
+    is_last_part = run.is_finished or bool(error_text)
+    
+    summary = f"Import of `{file_info['name']}`"
+    if import_state['part'] > 1 or not is_last_part:
+        summary += f", part {import_state['part']}"
+    summary += (
+        f" (rows {first_row}-{run.rows_done}): {report.scheduled} scheduled,"
+        f" {report.failed} not scheduled.")
+    if error_text:
+        summary += f"\n:warning: I stopped here: {error_text}"
+    if run.is_truncated:
+        summary += (
+            f"\n:warning: I only import the first {MAX_IMPORT_ROWS} rows of"
+            " a file.")
+    if is_last_part:
+        summary += (
+            f"\nAll done: {import_state['scheduled']} messages scheduled and"
+            f" {import_state['failed']} rows not scheduled."
+            f" To see what's scheduled in a channel, type `{slash} list` there.")
+    else:
+        summary += "\nI'll keep going with the rest of the file."
+    send_import_report(slack_client, user_id, file_info, report_path, summary)
+    
+    if not is_last_part:
+        # Out of time for this invocation; pick up where it left off.
+        import_state['part'] += 1
+        with timer("Lambda"):
+            get_client('lambda').invoke(
+                FunctionName=context.function_name,
+                InvocationType="Event",
+                Payload=json_dumps({**params, 'import_state': import_state})
+            )
+
+
+def load_user(user, with_timezone):
+    try:
+        user.get_auth_token()
+    except UserAuthorizeError:
+        # The command itself tells them to authorize DelaySay.
+        return user
+    if with_timezone:
+        user.get_timezone()
+    return user
+
+
+def start_prefetch(function, params):
+    # Starts loading what the command will need, each in its own thread.
+    # Returns the tasks by dispatch() keyword argument.
+    needs = PREFETCH_BY_FUNCTION.get(function, set())
+    loads = {}
+    if "token" in needs:
+        loads['user'] = asyncio.create_task(asyncio.to_thread(
+            load_user, User(params['user_id'][0]), "timezone" in needs))
+    if "team" in needs:
+        # Slack only sends enterprise_id for Enterprise Grid orgs.
+        loads['team'] = asyncio.create_task(asyncio.to_thread(
+            Team, params['team_id'][0], params.get('enterprise_id', [None])[0]))
+    return loads
+
+
+def dispatch(function, event, context, user=None, team=None):
     if function == "parse/schedule":
         print("~~~   PARSER / SCHEDULER   ~~~")
-        return parse_and_schedule(event)
+        return parse_and_schedule(event, user, team)
+    elif function == "schedule at":
+        print("~~~   SCHEDULER OF PICKED TIME   ~~~")
+        return schedule_picked_time(event, user, team)
+    elif function == "send later":
+        print("~~~   SCHEDULER OF SEND LATER MODAL   ~~~")
+        return schedule_from_modal(event, user, team)
     elif function == "list":
         print("~~~   LISTER OF SCHEDULED MESSAGES   ~~~")
-        return list_scheduled_messages(event)
+        return list_scheduled_messages(event, user)
+    elif function == "list all":
+        print("~~~   LISTER OF ALL SCHEDULED MESSAGES   ~~~")
+        return list_all_scheduled_messages(event)
     elif function == "delete":
         print("~~~   DELETER OF SCHEDULED MESSAGE   ~~~")
-        return delete_scheduled_message(event)
+        return delete_scheduled_message(event, user)
     elif function == "billing":
         print("~~~   BILLING / STRIPE CUSTOMER PORTAL   ~~~")
-        return respond_to_billing_request(event)
+        return respond_to_billing_request(event, user, team)
+    elif function == "import":
+        print("~~~   IMPORTER OF SCHEDULED MESSAGES   ~~~")
+        return import_scheduled_messages(event, context, user, team)
     else:
         raise Exception(f"Unhandled function: {function}")
 
 
+async def lambda_handler_async(event, context):
+    global current_request
+    current_request = IdempotencyRecord(event)
+    function = event.get("currentFunctionOfFunction")
+    # Claiming the request doesn't depend on loading the user and team,
+    # so do it all at once. (For a duplicate request, the loads are
+    # wasted, but duplicates are rare.)
+    loads = start_prefetch(function, event)
+    is_new_request, response = await asyncio.to_thread(
+        current_request.claim, context.get_remaining_time_in_millis())
+    if not is_new_request:
+        print("~~~   DUPLICATE REQUEST   ~~~")
+        current_request = None
+        await asyncio.gather(*loads.values(), return_exceptions=True)
+        if response:
+            post_and_print_info_and_confirm_success(
+                event['response_url'][0], response)
+        return
+    if function == "parse/schedule" and set(loads) == {'user', 'team'}:
+        print("~~~   PARSER / SCHEDULER   ~~~")
+        return await parse_and_schedule_async(
+            event, loads['user'], loads['team'])
+    loaded = dict(zip(loads, await asyncio.gather(*loads.values())))
+    return dispatch(function, event, context, **loaded)
+
+
+def lambda_handler(event, context):
+    return asyncio.run(lambda_handler_async(event, context))
+
+
+@record_invocation
 def lambda_handler_with_catch_all(event, context):
     support_message = (
         "\nIf the error persists, feel free to reach out at"
@@ -484,17 +969,23 @@ def lambda_handler_with_catch_all(event, context):
         if err.team_id:
             support_message = (
                 "\nTo continue using DelaySay, *please re-subscribe here:*"
-                f"\n{subscribe_url}/?team={err.team_id}"
+                f"\n{get_subscribe_link(err.team_id)}"
                 + support_message)
         response_url = event['response_url'][0]
         res = (
             "Sorry, you don't have a valid subscription."
             + support_message)
         post_and_print_info_and_confirm_success(response_url, res)
-    except Exception:
+    except Exception as err:
         # Maybe remove this, since it could print sensitive information,
         # like the message parsed by SlashCommandParser.
         print(format_exc().replace('\n', '\r'))
+        if (is_transient_error(err) and current_request
+                and not current_request.has_responded):
+            # Nothing was sent yet, so let Lambda retry the whole request.
+            print("Transient error; releasing the request for a retry")
+            current_request.release()
+            raise
         response_url = event['response_url'][0]
         res = (
             "Sorry, there was an error. Please try again later or rephrase"
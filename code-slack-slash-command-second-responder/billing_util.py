@@ -1,17 +1,24 @@
 import os
 from uuid import uuid4
 from User import User
-from BillingToken import BillingToken
+from BillingToken import BillingToken, generate_signed_token
+from BillingPortalSession import BillingPortalSession
 from datetime import datetime, timedelta, timezone
 
 slash = os.environ['SLASH_COMMAND']
 api_domain = os.environ['SLASH_COMMAND_LINKS_DOMAIN']
+redirect_url_after_portal = os.environ['REDIRECT_URL_AFTER_PORTAL']
+
+# "dynamodb" stores each billing token in the table; "signed" packs the
+# team, user and expiration into an HMAC-signed token instead, so neither
+# this function nor the billing redirect has to touch DynamoDB for it.
+billing_token_mode = os.environ.get('BILLING_TOKEN_MODE', "dynamodb")
 
 # When a user generates a billing URL, let them use it for this long.
 BILLING_TOKEN_PERIOD = timedelta(hours=1)
 
 
-def parse_option_and_user(command_text):
+def parse_option_and_user(command_text, team):
     try:
         command, option, user_info = command_text.split()
     except ValueError:
@@ -24,7 +31,10 @@ def parse_option_and_user(command_text):
     
     if command not in ["billing", "pay", "subscribe"]:
         option = None
-    if option not in ["authorize", "remove"]:
+    if option == "list":
+        user_id = None
+        user = None
+    elif option not in ["authorize", "remove"]:
         option = None
         user_id = None
         user = None
@@ -36,11 +46,28 @@ def parse_option_and_user(command_text):
         # According to: https://api.slack.com/changelog/2017-09-the-one-about-usernames
         user_id = user_info.lstrip("<@").split("|")[0]
         user = User(user_id)
-        if not user.is_in_dynamodb():
+        # Only users who authorized DelaySay in this same workspace
+        if not team.has_member(user_id):
             user = None
     return (option, user_id, user)
 
 
+def write_billing_managers_message(team, billing_info):
+    managers = team.get_members(billing_roles=["admin", "approved"])
+    admin_note = (
+        "\nWorkspace admins can always manage it by typing:"
+        f"\n        `{slash} billing`")
+    if not managers:
+        return f"No one has managed {billing_info} yet." + admin_note
+    res = f"These users can manage {billing_info}:"
+    for manager in sorted(managers, key=lambda manager: manager['user_id']):
+        if manager['billing_role'] == "admin":
+            res += f"\n•  <@{manager['user_id']}> (workspace admin)"
+        else:
+            res += f"\n•  <@{manager['user_id']}> (authorized by an admin)"
+    return res + admin_note
+
+
 def write_message_and_add_or_remove_billing_role(option, user, user_id,
                                                  other_user, other_user_id,
                                                  billing_info):
@@ -121,7 +148,18 @@ def write_message_and_add_or_remove_billing_role(option, user, user_id,
     return res
 
 
-def generate_billing_url(user_id, team_id, team_domain):
+def generate_billing_token(user_id, team_id, team_domain,
+                           portal_session_prepared=False):
+    # Pass portal_session_prepared=True if prepare_billing_portal_session()
+    # will be called with the token.
+    if billing_token_mode == "signed":
+        billing_token = generate_signed_token(
+            create_time=datetime.now(timezone.utc),
+            expiration_period=BILLING_TOKEN_PERIOD,
+            team_id=team_id,
+            user_id=user_id,
+            portal_session_prepared=portal_session_prepared)
+        return billing_token
     billing_token = BillingToken(token=uuid4().hex)
     billing_token.add_to_dynamodb(
         create_time=datetime.now(timezone.utc),
@@ -129,12 +167,31 @@ def generate_billing_url(user_id, team_id, team_domain):
         team_id=team_id,
         team_domain=team_domain,
         user_id=user_id)
+    return str(billing_token)
+
+
+def generate_billing_url(user_id, team_id, team_domain, billing_token=None):
+    if not billing_token:
+        billing_token = generate_billing_token(user_id, team_id, team_domain)
     url = f"{api_domain}/billing/?token={billing_token}"
     return url
 
 
-def write_billing_portal_message(user_id, team_id, team_domain, response_url):
-    url = generate_billing_url(user_id, team_id, team_domain)
+def prepare_billing_portal_session(billing_token, team):
+    # Create the Stripe customer portal session now, while the user is
+    # still reading the billing message, so the billing redirect can
+    # usually return the prepared URL instead of calling Stripe itself.
+    create_time = datetime.now(timezone.utc)
+    portal_session = BillingPortalSession(billing_token)
+    url = portal_session.create(
+        stripe_subscription=team.get_best_subscription(),
+        return_url=redirect_url_after_portal)
+    portal_session.add_to_dynamodb(url, create_time)
+
+
+def write_billing_portal_message(user_id, team_id, team_domain,
+                                 billing_token=None):
+    url = generate_billing_url(user_id, team_id, team_domain, billing_token)
     res = (
         "Here's your Stripe customer portal:"
         f"\n{url}"
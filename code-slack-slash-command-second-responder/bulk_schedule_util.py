@@ -0,0 +1,147 @@
+from re import compile as re_compile, sub as re_sub
+from traceback import format_exc
+from time import sleep
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from slack_sdk import errors as slack_errors
+from metrics import timer
+from RateLimiter import RateLimiter
+
+# chat.scheduleMessage is a Tier 3 Slack method (50+ calls per minute per
+# workspace, with short bursts allowed), so stay just under that.
+SCHEDULE_CALLS_PER_MINUTE = 50
+SCHEDULE_BURST = 20
+
+# How many chat.scheduleMessage calls can be in flight at once
+MAX_SCHEDULE_WORKERS = 8
+
+# If Slack still says "ratelimited" after the limiter, wait as long as it
+# asks (up to this long) and try again, this many times.
+MAX_RATE_LIMIT_RETRIES = 3
+MAX_RETRY_AFTER_IN_SECONDS = 30
+
+# One rate limiter per team for the whole container, so commands that
+# come soon after each other (or a long import's next part) share the
+# team's limit instead of each starting with a full burst
+rate_limiters = {}
+_rate_limiters_lock = Lock()
+
+# Don't let one command fan out to more channels than this.
+MAX_CHANNELS_PER_COMMAND = 50
+
+# Slack escapes channel mentions in slash commands as <#C123|name>
+# (or <#C123> if it doesn't send the name).
+CHANNEL_MENTION = re_compile(r"<#([CGD][A-Z0-9]+)(?:\|[^>]*)?>")
+# "in #a #b, and #c" or "to #a" in the time part of the command
+CHANNEL_LIST = re_compile(
+    r"(?:\b(?:in|to)\s+)?<#[^>]+>(?:(?:\s*,\s*|\s+)(?:and\s+)?<#[^>]+>)*")
+# "say" outside of any <...> escape, so a channel named #sayings
+# doesn't end the time part early
+ESCAPE_OR_SAY = re_compile(r"<[^>]*>|say")
+
+
+def split_off_channels(command_text):
+    # For "9am in <#C1|a> <#C2|b> say Hi", returns
+    # ("9am say Hi", ["C1", "C2"]). Only channels before "say" count;
+    # the message can mention channels as usual. If there are none,
+    # returns (command_text, []).
+    split_index = len(command_text)
+    for match in ESCAPE_OR_SAY.finditer(command_text):
+        if match.group() == "say":
+            split_index = match.start()
+            break
+    time_text = command_text[:split_index]
+    channel_ids = []
+    for channel_id in CHANNEL_MENTION.findall(time_text):
+        if channel_id not in channel_ids:
+            channel_ids.append(channel_id)
+    if not channel_ids:
+        return (command_text, [])
+    time_text = CHANNEL_LIST.sub(" ", time_text)
+    time_text = re_sub(r"\s+", " ", time_text).strip()
+    return (time_text + " " + command_text[split_index:], channel_ids)
+
+
+def describe_schedule_error(error_code, message, unix_timestamp,
+                            request_unix_timestamp):
+    # Returns what to tell the user about a chat.scheduleMessage error,
+    # or None if it's not one they can do anything about.
+    if error_code == "time_in_past":
+        if unix_timestamp < request_unix_timestamp:
+            return "Slack can't schedule a message in the past."
+        else:
+            return "Slack can't schedule in the extremely near future."
+    elif error_code == "time_too_far":
+        return "Slack can't schedule too far into the future, typically 120 days."
+    elif error_code == "msg_too_long":
+        return (
+            f"Slack can't schedule a message if it's too long; yours is {len(message)} characters.")
+    elif error_code == "restricted_too_many":
+        return "Slack can't schedule too many messages too close together."
+    elif error_code in ["channel_not_found", "not_in_channel"]:
+        return "You need to be a member of the channel to schedule messages there."
+    elif error_code == "is_archived":
+        return "Slack can't schedule messages in an archived channel."
+    return None
+
+
+def get_rate_limiter(team_id):
+    rate_limiter = rate_limiters.get(team_id)
+    if rate_limiter:
+        return rate_limiter
+    with _rate_limiters_lock:
+        if team_id not in rate_limiters:
+            rate_limiters[team_id] = RateLimiter(
+                SCHEDULE_CALLS_PER_MINUTE, SCHEDULE_BURST)
+    return rate_limiters[team_id]
+
+
+class BulkScheduler:
+    # Schedules many messages for one user with a bounded number of
+    # concurrent chat.scheduleMessage calls under the team's rate limit.
+    # schedule() yields one result per job, in the order given:
+    # (job, scheduled_message_id, None) or (job, None, error_code).
+    
+    def __init__(self, slack_client, team_id, rate_limiter=None,
+                 max_workers=MAX_SCHEDULE_WORKERS):
+        self.slack_client = slack_client
+        self.rate_limiter = rate_limiter or get_rate_limiter(team_id)
+        self.max_workers = max_workers
+    
+    def _schedule_one(self, job):
+        # Jobs can carry extra fields after these for the caller's use.
+        channel_id, unix_timestamp, message = job[:3]
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            self.rate_limiter.acquire()
+            try:
+                with timer("Slack"):
+                    response = self.slack_client.chat_scheduleMessage(
+                        channel=channel_id,
+                        post_at=unix_timestamp,
+                        text=message
+                    )
+                return (job, response['scheduled_message_id'], None)
+            except slack_errors.SlackApiError as err:
+                error_code = err.response.get('error') or "unknown_error"
+                if (error_code != "ratelimited"
+                        or attempt == MAX_RATE_LIMIT_RETRIES):
+                    return (job, None, error_code)
+                retry_after = int(err.response.headers.get('Retry-After', 1))
+                sleep(min(retry_after, MAX_RETRY_AFTER_IN_SECONDS))
+            except Exception:
+                print(
+                    f"Couldn't schedule a message in {channel_id}:\r\r"
+                    + format_exc().replace('\n', '\r'))
+                return (job, None, "unexpected_error")
+    
+    def schedule(self, jobs):
+        # jobs can be any iterable (even a long generator); only
+        # a window of max_workers * 2 jobs is in memory at once.
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            window = []
+            for job in jobs:
+                window.append(executor.submit(self._schedule_one, job))
+                if len(window) >= self.max_workers * 2:
+                    yield window.pop(0).result()
+            for future in window:
+                yield future.result()
@@ -0,0 +1,160 @@
+from hashlib import sha256
+from datetime import datetime, timedelta, timezone
+from botocore.exceptions import ClientError
+from requests.exceptions import (
+    ConnectionError as requests_ConnectionError, Timeout as requests_Timeout)
+from slack_sdk import errors as slack_errors
+from metrics import timer
+
+# The first responder invokes this function asynchronously, which Lambda
+# delivers at least once. Remember each request this long so duplicate
+# deliveries (and retries after a transient error) aren't run twice.
+IDEMPOTENCY_RECORD_PERIOD = timedelta(hours=1)
+
+# A delivery that's still "in progress" after the time its invocation
+# had left when it claimed the request (lease_until) timed out or crashed
+# without responding, so a later delivery takes the request over instead
+# of dropping it. The margin allows for clock differences between
+# containers.
+IN_PROGRESS_LEASE_MARGIN = timedelta(seconds=10)
+
+# The lease for records claimed before lease_until was saved: the
+# longest the function can run (Timeout in template.yaml)
+IN_PROGRESS_LEASE = timedelta(seconds=300) + IN_PROGRESS_LEASE_MARGIN
+
+# Slack API errors worth retrying instead of reporting to the user
+TRANSIENT_SLACK_ERRORS = [
+    "ratelimited", "internal_error", "fatal_error", "service_unavailable",
+    "request_timeout"]
+
+
+def compute_idempotency_key(params):
+    # Slack doesn't send a request ID with slash commands, but the same
+    # user sending the same text in the same channel at the same
+    # timestamp is the same request.
+    request_identity = "\n".join([
+        params.get('currentFunctionOfFunction', ""),
+        params['team_id'][0],
+        params['user_id'][0],
+        params['channel_id'][0],
+        params.get('text', [""])[0],
+        str(params['request_timestamp'])
+    ])
+    if 'import_state' in params:
+        # Each part of a long import is its own request.
+        request_identity += "\npart " + str(params['import_state']['part'])
+    return sha256(request_identity.encode()).hexdigest()
+
+
+def is_transient_error(err):
+    if isinstance(err, (requests_ConnectionError, requests_Timeout)):
+        return True
+    if isinstance(err, slack_errors.SlackApiError):
+        return (err.response.status_code == 429
+                or err.response.status_code >= 500
+                or err.response.get('error') in TRANSIENT_SLACK_ERRORS)
+    return False
+
+
+class IdempotencyRecord:
+
+    def __init__(self, params):
+        from dynamodb import dynamodb_table, DATETIME_FORMAT
+        self.table = dynamodb_table
+        self.datetime_format = DATETIME_FORMAT
+        self.key = {
+            'PK': "REQUEST#" + compute_idempotency_key(params),
+            'SK': "request"
+        }
+        self.has_responded = False
+    
+    def claim(self, remaining_time_in_millis):
+        # Returns (True, None) if this delivery should run the request:
+        # it's the first, or the one before it ran out of time. Otherwise
+        # returns (False, response), where response is what the first
+        # delivery told the user (or None if it's still running). Pass
+        # context.get_remaining_time_in_millis(), which is how long this
+        # delivery holds the request.
+        create_time = datetime.now(timezone.utc)
+        expiration = create_time + IDEMPOTENCY_RECORD_PERIOD
+        lease_until = (
+            create_time + timedelta(milliseconds=remaining_time_in_millis)
+            + IN_PROGRESS_LEASE_MARGIN)
+        try:
+            with timer("DynamoDB"):
+                self.table.put_item(
+                    Item={
+                        **self.key,
+                        'request_status': "in progress",
+                        'create_time': create_time.strftime(self.datetime_format),
+                        'lease_until': lease_until.strftime(self.datetime_format),
+                        'expiration_ttl': int(expiration.timestamp())
+                    },
+                    ConditionExpression="attribute_not_exists(PK)"
+                )
+        except ClientError as err:
+            if err.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+            with timer("DynamoDB"):
+                response = self.table.get_item(Key=self.key, ConsistentRead=True)
+            item = response.get('Item', {})
+            if self._is_lease_expired(item, create_time):
+                return (self._take_over(item, create_time, lease_until), None)
+            return (False, item.get('response_text'))
+        return (True, None)
+    
+    def _is_lease_expired(self, item, now):
+        if item.get('request_status') != "in progress":
+            return False
+        if 'lease_until' in item:
+            lease_until = datetime.strptime(
+                item['lease_until'], self.datetime_format)
+        else:
+            lease_until = datetime.strptime(
+                item['create_time'], self.datetime_format) + IN_PROGRESS_LEASE
+        return now > lease_until
+    
+    def _take_over(self, item, create_time, lease_until):
+        # Conditional on the old create_time, so if several deliveries
+        # find the same stale claim, only one of them runs the request.
+        try:
+            with timer("DynamoDB"):
+                self.table.update_item(
+                    Key=self.key,
+                    UpdateExpression=
+                        "SET create_time = :val, lease_until = :val2",
+                    ConditionExpression=
+                        "request_status = :in_progress"
+                        " AND create_time = :old_create_time",
+                    ExpressionAttributeValues={
+                        ":val": create_time.strftime(self.datetime_format),
+                        ":val2": lease_until.strftime(self.datetime_format),
+                        ":in_progress": "in progress",
+                        ":old_create_time": item['create_time']
+                    }
+                )
+        except ClientError as err:
+            if err.response['Error']['Code'] != "ConditionalCheckFailedException":
+                raise
+            return False
+        print("Took over a request whose earlier delivery ran out of time")
+        return True
+    
+    def save_response(self, text):
+        with timer("DynamoDB"):
+            self.table.update_item(
+                Key=self.key,
+                UpdateExpression=
+                    "SET request_status = :val,"
+                    " response_text = :val2",
+                ExpressionAttributeValues={
+                    ":val": "done",
+                    ":val2": text
+                }
+            )
+        self.has_responded = True
+    
+    def release(self):
+        # Forget the request so a retry can run it again from the start.
+        with timer("DynamoDB"):
+            self.table.delete_item(Key=self.key)
@@ -0,0 +1,273 @@
+import csv
+import requests
+from traceback import format_exc
+from io import TextIOWrapper
+from json import loads as json_loads, JSONDecoder, JSONDecodeError
+from re import compile as re_compile
+from datetime import datetime
+from tempfile import NamedTemporaryFile
+from SlashCommandParser import SlashCommandParser
+from DelaySayExceptions import CommandParseError, TimeParseError, ImportFileError
+from bulk_schedule_util import CHANNEL_MENTION, describe_schedule_error
+from metrics import timer
+
+# Slack file IDs look like F0123ABCDEF, whether the user pastes the ID
+# itself or a link like https://team.slack.com/files/U123/F0123ABCDEF/x.csv
+FILE_ID = re_compile(r"\b(F[A-Z0-9]{8,})\b")
+CHANNEL_ID = re_compile(r"^[CGD][A-Z0-9]+$")
+
+IMPORT_FILE_TYPES = ["csv", "json"]
+MAX_IMPORT_FILE_BYTES = 20 * 1024 * 1024
+MAX_IMPORT_ROWS = 20000
+
+# Stop taking new rows when the Lambda has this little time left, so the
+# rows already handed to Slack can finish and the next part can start.
+IMPORT_TIME_RESERVE_IN_MS = 60 * 1000
+
+# Read JSON files this much at a time; a single row can't be larger than
+# MAX_JSON_ROW_CHARS.
+JSON_CHUNK_CHARS = 64 * 1024
+MAX_JSON_ROW_CHARS = 256 * 1024
+
+REPORT_COLUMNS = ["row", "channel", "time", "result", "detail"]
+
+# Add scheduled messages to the index this many at a time (the most
+# BatchWriteItem takes).
+INDEX_BATCH_SIZE = 25
+
+
+def add_to_index(index, messages):
+    # The messages are already scheduled, so if the index can't be
+    # updated, just leave it for the next reconciliation to fix.
+    try:
+        index.add_many(messages)
+    except Exception:
+        print(
+            "Couldn't add scheduled messages to the index:\r\r"
+            + format_exc().replace('\n', '\r'))
+
+
+def find_file_id(command_text):
+    match = FILE_ID.search(command_text)
+    return match.group(1) if match else None
+
+
+def get_file_info(file_id, token):
+    with timer("Slack"):
+        r = requests.post(
+            url="https://slack.com/api/files.info",
+            data={
+                'file': file_id
+            },
+            headers={
+                'Content-Type': "application/x-www-form-urlencoded",
+                'Authorization': "Bearer " + token
+            }
+        )
+    if r.status_code != 200:
+        print(r.status_code, r.reason)
+        raise Exception("requests.post failed")
+    file_object = json_loads(r.content)
+    if not file_object['ok']:
+        raise ImportFileError(
+            "I couldn't open that file. Make sure you uploaded it to Slack"
+            " yourself, then try again.")
+    file_info = file_object['file']
+    filetype = file_info.get('filetype')
+    if filetype not in IMPORT_FILE_TYPES:
+        if file_info.get('name', "").lower().endswith(".json"):
+            filetype = "json"
+        elif file_info.get('name', "").lower().endswith(".csv"):
+            filetype = "csv"
+        else:
+            raise ImportFileError("I can only import CSV or JSON files.")
+    if file_info.get('size', 0) > MAX_IMPORT_FILE_BYTES:
+        raise ImportFileError(
+            "That file is too big to import; please split it into files"
+            f" under {MAX_IMPORT_FILE_BYTES // (1024 * 1024)} MB.")
+    return {
+        'id': file_info['id'],
+        'name': file_info.get('name', file_info['id']),
+        'filetype': filetype,
+        'url': file_info['url_private_download']
+    }
+
+
+def iter_csv_rows(text_file):
+    reader = csv.reader(text_file)
+    header = [column.strip().lower() for column in next(reader, [])]
+    missing = [column for column in ["channel", "time", "message"]
+               if column not in header]
+    if missing:
+        raise ImportFileError(
+            "The first row of the CSV file should name the columns:"
+            " channel, time, message. Missing: " + ", ".join(missing))
+    for values in reader:
+        if not any(values):
+            continue
+        yield dict(zip(header, values))
+
+
+def iter_json_rows(text_file):
+    # Accepts a JSON array of objects or one object per line (JSON Lines),
+    # decoding one object at a time instead of loading the whole file.
+    decoder = JSONDecoder()
+    buffer = ""
+    at_end_of_file = False
+    while True:
+        buffer = buffer.lstrip(" \t\r\n,[]")
+        if buffer:
+            try:
+                row, end = decoder.raw_decode(buffer)
+            except JSONDecodeError:
+                if at_end_of_file:
+                    raise ImportFileError("The JSON file isn't valid JSON.")
+                if len(buffer) > MAX_JSON_ROW_CHARS:
+                    raise ImportFileError("A row in the JSON file is too long.")
+            else:
+                if not isinstance(row, dict):
+                    raise ImportFileError(
+                        "Each row of the JSON file should be an object with"
+                        " channel, time, and message.")
+                yield {str(key).lower(): value for key, value in row.items()}
+                buffer = buffer[end:]
+                continue
+        elif at_end_of_file:
+            return
+        chunk = text_file.read(JSON_CHUNK_CHARS)
+        at_end_of_file = not chunk
+        buffer += chunk
+
+
+def open_import_file(file_info, token):
+    # Stream the file rather than downloading it all at once.
+    r = requests.get(
+        file_info['url'],
+        headers={
+            'Authorization': "Bearer " + token
+        },
+        stream=True
+    )
+    if r.status_code != 200:
+        print(r.status_code, r.reason)
+        raise Exception("requests.get failed")
+    r.raw.decode_content = True
+    # Otherwise urllib3 closes the stream once it's read to the end, and
+    # TextIOWrapper fails on its final read.
+    r.raw.auto_close = False
+    text_file = TextIOWrapper(r.raw, encoding="utf-8-sig", newline="")
+    if file_info['filetype'] == "csv":
+        return (r, iter_csv_rows(text_file))
+    return (r, iter_json_rows(text_file))
+
+
+class ImportReport:
+    # Per-row results, written to a temporary CSV file as they come in
+    # so a long import doesn't keep them in memory.
+    
+    def __init__(self):
+        self.file = NamedTemporaryFile(
+            "w", newline="", suffix=".csv", prefix="delaysay-import-",
+            delete=False)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(REPORT_COLUMNS)
+        self.scheduled = 0
+        self.failed = 0
+    
+    def add(self, row_number, channel, time_text, scheduled_message_id,
+            error_text):
+        if scheduled_message_id:
+            self.scheduled += 1
+            self.writer.writerow(
+                [row_number, channel, time_text, "scheduled",
+                 scheduled_message_id])
+        else:
+            self.failed += 1
+            self.writer.writerow(
+                [row_number, channel, time_text, "failed", error_text])
+    
+    def close(self):
+        self.file.close()
+        return self.file.name
+
+
+class ScheduledMessageImport:
+    # Turns rows into BulkScheduler jobs, skipping rows a previous part
+    # already handled and stopping when should_stop() says time is up.
+    # Rows that can't be scheduled go straight to the report.
+    
+    def __init__(self, initial_time, report, rows_done, should_stop,
+                 index=None):
+        assert isinstance(initial_time, datetime)
+        self.initial_time = initial_time
+        self.request_unix_timestamp = initial_time.timestamp()
+        self.report = report
+        self.rows_done = rows_done
+        self.first_row = rows_done + 1
+        self.should_stop = should_stop
+        self.is_finished = False
+        self.is_truncated = False
+        # Scheduled messages not yet written to the ScheduledMessageIndex
+        self.index = index
+        self.messages_to_index = []
+    
+    def _parse_row(self, row):
+        # Returns (channel_id, unix_timestamp, message) or raises
+        # ValueError with what to tell the user.
+        channel = str(row.get('channel') or "").strip()
+        time_text = str(row.get('time') or "").strip()
+        message = str(row.get('message') or "")
+        mention = CHANNEL_MENTION.fullmatch(channel)
+        channel_id = mention.group(1) if mention else channel
+        if not CHANNEL_ID.match(channel_id):
+            raise ValueError(
+                "Use the channel ID (like C012AB3CD), not the channel name.")
+        try:
+            parser = SlashCommandParser(
+                time_text + " say " + message, self.initial_time)
+        except (CommandParseError, TimeParseError):
+            raise ValueError(f'I don\'t understand the time "{time_text}".')
+        if not parser.get_message():
+            raise ValueError("I can't schedule an empty message.")
+        return (channel_id, parser.get_time().timestamp(), parser.get_message())
+    
+    def jobs(self, rows):
+        for row_number, row in enumerate(rows, start=1):
+            if row_number <= self.rows_done:
+                continue
+            if row_number > MAX_IMPORT_ROWS:
+                self.is_truncated = True
+                break
+            # Always take at least one row, so every part makes progress.
+            if row_number > self.first_row and self.should_stop():
+                return
+            self.rows_done = row_number
+            channel = str(row.get('channel') or "")
+            time_text = str(row.get('time') or "")
+            try:
+                channel_id, unix_timestamp, message = self._parse_row(row)
+            except ValueError as err:
+                self.report.add(row_number, channel, time_text, None, str(err))
+                continue
+            yield (channel_id, unix_timestamp, message, row_number, time_text)
+        self.is_finished = True
+    
+    def add_result(self, job, scheduled_message_id, error_code):
+        channel_id, unix_timestamp, message, row_number, time_text = job
+        error_text = None
+        if error_code:
+            error_text = describe_schedule_error(
+                error_code, message, unix_timestamp,
+                self.request_unix_timestamp) or error_code
+        self.report.add(
+            row_number, channel_id, time_text, scheduled_message_id, error_text)
+        if scheduled_message_id and self.index:
+            self.messages_to_index.append(
+                (scheduled_message_id, channel_id, unix_timestamp, message))
+            if len(self.messages_to_index) >= INDEX_BATCH_SIZE:
+                self.flush_index()
+    
+    def flush_index(self):
+        if self.messages_to_index:
+            add_to_index(self.index, self.messages_to_index)
+            self.messages_to_index = []
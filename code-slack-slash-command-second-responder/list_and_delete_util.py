@@ -2,9 +2,13 @@ import requests
 import json
 import os
 from datetime import datetime, timezone
+from metrics import timer
 
 slash = os.environ['SLASH_COMMAND']
 
+# Messages per chat.scheduledMessages.list call (Slack's default)
+SCHEDULED_MESSAGES_PAGE_SIZE = 100
+
 
 def convert_to_slack_datetime(timestamp):
     fallback_text = datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
@@ -15,25 +19,117 @@ def convert_to_slack_datetime(timestamp):
     return slack_datetime
 
 
+def cut_outside_formatting(text):
+    # The longest start of the text that doesn't end inside a *, ` or
+    # <...> (Slack's formatting doesn't carry over to the next line).
+    safe_length = 0
+    in_bold = in_code = in_link = False
+    for i, character in enumerate(text):
+        if not (in_bold or in_code or in_link):
+            safe_length = i
+        if in_link:
+            in_link = character != ">"
+        elif character == "`":
+            in_code = not in_code
+        elif in_code:
+            continue
+        elif character == "*":
+            in_bold = not in_bold
+        elif character == "<":
+            in_link = True
+    if not (in_bold or in_code or in_link):
+        safe_length = len(text)
+    return text[:safe_length].rstrip()
+
+
+def shorten_to_whole_lines(heading, quote, max_length):
+    # Cuts a quoted message short between two lines, so it can't leave a
+    # *, ` or <...> in the message text open. If even the first line is
+    # too long, it's cut before any formatting that wouldn't fit.
+    ellipsis = "\n> …"
+    length = len(heading) + len(ellipsis)
+    lines = []
+    for line in quote.split("\n")[1:]:
+        length += len(line) + 1
+        if length > max_length:
+            break
+        lines.append(line)
+    if not lines:
+        first_line = quote.split("\n")[1].removeprefix("> ")
+        room = max_length - len(heading) - len("\n> …")
+        return heading + "\n> " + cut_outside_formatting(first_line[:room]) + "…"
+    return heading + "".join("\n" + line for line in lines) + ellipsis
+
+
+def write_scheduled_message_entries(scheduled_messages, max_length=None):
+    # Yields each message's entry in a `list` response, formatted only
+    # when it's needed. Entries longer than max_length are cut short.
+    for i, message_info in enumerate(scheduled_messages, start=1):
+        slack_datetime = convert_to_slack_datetime(timestamp=message_info['post_at'])
+        heading = f"\n\n    *{i}) {slack_datetime}:*"
+        quote = f"\n{message_info['text']}".replace("\n", "\n> ")
+        if max_length and len(heading) + len(quote) > max_length:
+            yield shorten_to_whole_lines(heading, quote, max_length)
+        else:
+            yield heading + quote
+
+
+def write_scheduled_messages_list(header, scheduled_messages):
+    return header + "".join(write_scheduled_message_entries(scheduled_messages))
+
+
+def split_scheduled_messages_list(header, scheduled_messages, part_length):
+    # Yields (part, messages_left) for a `list` response split into parts
+    # of at most about part_length characters, each ending between two
+    # messages. Each part is joined once, when it's full.
+    pieces = [header]
+    length = len(header)
+    entries = write_scheduled_message_entries(scheduled_messages, part_length)
+    for i, entry in enumerate(entries):
+        if length + len(entry) > part_length and length:
+            yield "".join(pieces), len(scheduled_messages) - i
+            entry = entry.lstrip("\n")
+            pieces = []
+            length = 0
+        pieces.append(entry)
+        length += len(entry)
+    yield "".join(pieces), 0
+
+
 def get_scheduled_messages(channel_id, token):
-    r = requests.post(
-        url="https://slack.com/api/chat.scheduledMessages.list",
-        data={
-            'channel': channel_id
-        },
-        headers={
-            'Content-Type': "application/x-www-form-urlencoded",
-            'Authorization': "Bearer " + token
+    # Slack returns the channel's scheduled messages a page at a time,
+    # and callers need all of them (reconcile_index() removes whatever
+    # isn't listed).
+    scheduled_messages = []
+    cursor = ""
+    while True:
+        data = {
+            'channel': channel_id,
+            'limit': SCHEDULED_MESSAGES_PAGE_SIZE
         }
-    )
-    if r.status_code != 200:
-        print(r.status_code, r.reason)
-        raise Exception("requests.post failed")
-    messages_object = json.loads(r.content)
-    if not messages_object['ok']:
-        raise Exception(
-            "get_scheduled_messages() failed: " + messages_object['error'])
-    scheduled_messages = messages_object['scheduled_messages']
+        if cursor:
+            data['cursor'] = cursor
+        with timer("Slack"):
+            r = requests.post(
+                url="https://slack.com/api/chat.scheduledMessages.list",
+                data=data,
+                headers={
+                    'Content-Type': "application/x-www-form-urlencoded",
+                    'Authorization': "Bearer " + token
+                }
+            )
+        if r.status_code != 200:
+            print(r.status_code, r.reason)
+            raise Exception("requests.post failed")
+        messages_object = json.loads(r.content)
+        if not messages_object['ok']:
+            raise Exception(
+                "get_scheduled_messages() failed: " + messages_object['error'])
+        scheduled_messages.extend(messages_object['scheduled_messages'])
+        cursor = messages_object.get(
+            'response_metadata', {}).get('next_cursor')
+        if not cursor:
+            break
     scheduled_messages.sort(key=lambda message_info: message_info['post_at'])
     return scheduled_messages
 
@@ -0,0 +1,83 @@
+from json import dumps as json_dumps, loads as json_loads
+from datetime import datetime
+
+# When the time in a command can't be parsed, the response offers a date
+# picker and a time picker (set to the parser's best guess) and a
+# "Schedule" button. The button carries the message and channels, so
+# clicking it schedules the message without another dateparser run or
+# retyping the command. The interactivity function
+# (code-slack-interactivity) forwards the click here as "schedule at".
+
+PICKED_TIME_BLOCK_ID = "picked_time"
+DATE_PICKER_ACTION_ID = "picked_date"
+TIME_PICKER_ACTION_ID = "picked_time"
+SCHEDULE_BUTTON_ACTION_ID = "schedule_picked_time"
+
+# Slack's limit for a button's value
+MAX_BUTTON_VALUE_LENGTH = 2000
+
+
+def write_time_picker_blocks(text, best_guess, message, channel_ids):
+    # Returns the blocks for the response, or None if the message is too
+    # long to fit in the button (then the user just gets the text).
+    date = best_guess.strftime("%Y-%m-%d")
+    time = best_guess.strftime("%H:%M")
+    button_value = json_dumps({
+        'message': message,
+        'channel_ids': channel_ids,
+        'date': date,
+        'time': time
+    })
+    if len(button_value) > MAX_BUTTON_VALUE_LENGTH:
+        return None
+    return [
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": text
+            }
+        },
+        {
+            "type": "actions",
+            "block_id": PICKED_TIME_BLOCK_ID,
+            "elements": [
+                {
+                    "type": "datepicker",
+                    "action_id": DATE_PICKER_ACTION_ID,
+                    "initial_date": date
+                },
+                {
+                    "type": "timepicker",
+                    "action_id": TIME_PICKER_ACTION_ID,
+                    "initial_time": time
+                },
+                {
+                    "type": "button",
+                    "action_id": SCHEDULE_BUTTON_ACTION_ID,
+                    "style": "primary",
+                    "text": {
+                        "type": "plain_text",
+                        "text": "Schedule"
+                    },
+                    "value": button_value
+                }
+            ]
+        }
+    ]
+
+
+def read_picked_time(button_value, state_values, user_tz):
+    # Returns (scheduled_time, message, channel_ids) from a click on the
+    # "Schedule" button. Slack only sends a picker's value in the state
+    # if the user changed it, so otherwise use the best guess it started
+    # with.
+    picked = json_loads(button_value)
+    pickers = state_values.get(PICKED_TIME_BLOCK_ID, {})
+    date = (pickers.get(DATE_PICKER_ACTION_ID, {}).get('selected_date')
+            or picked['date'])
+    time = (pickers.get(TIME_PICKER_ACTION_ID, {}).get('selected_time')
+            or picked['time'])
+    scheduled_time = datetime.strptime(
+        f"{date} {time}", "%Y-%m-%d %H:%M").replace(tzinfo=user_tz)
+    return scheduled_time, picked['message'], picked['channel_ids']
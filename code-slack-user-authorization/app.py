@@ -5,25 +5,30 @@ https://github.com/awslabs/serverless-application-model/blob/master/examples/app
 
 import json
 import traceback
-import boto3
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
 from User import User
-from Team import Team
+from Team import add_new_team_to_dynamodb
+from Enterprise import Enterprise
+from metrics import timer, record_invocation
+from aws_clients import get_client
 from datetime import datetime, timedelta, timezone
 
-ssm = boto3.client('ssm')
+ssm = get_client('ssm')
 
-slack_client_id_parameter = ssm.get_parameter(
-    Name=os.environ['SLACK_CLIENT_ID_SSM_NAME'],
-    WithDecryption=True
-)
+with timer("SSM"):
+    slack_client_id_parameter = ssm.get_parameter(
+        Name=os.environ['SLACK_CLIENT_ID_SSM_NAME'],
+        WithDecryption=True
+    )
 CLIENT_ID = slack_client_id_parameter['Parameter']['Value']
 
-slack_client_secret_parameter = ssm.get_parameter(
-    Name=os.environ['SLACK_CLIENT_SECRET_SSM_NAME'],
-    WithDecryption=True
-)
+with timer("SSM"):
+    slack_client_secret_parameter = ssm.get_parameter(
+        Name=os.environ['SLACK_CLIENT_SECRET_SSM_NAME'],
+        WithDecryption=True
+    )
 CLIENT_SECRET = slack_client_secret_parameter['Parameter']['Value']
 
 INSTALL_SUCCESS_URL = os.environ['INSTALL_SUCCESS_URL']
@@ -34,6 +39,15 @@ INSTALL_FAIL_URL = os.environ['INSTALL_FAIL_URL']
 # Stop access to DelaySay this long after they authorize DelaySay.
 FREE_TRIAL_PERIOD = timedelta(days=14)
 
+# Workspaces per auth.teams.list page
+TEAMS_LIST_PAGE_SIZE = 1000
+
+# How many workspaces of an org-wide install are written at once. The
+# OAuth redirect has to answer within API Gateway's 29 seconds, and a big
+# org can have thousands of workspaces. (At most
+# aws_clients.MAX_POOL_CONNECTIONS.)
+MAX_TEAM_WRITE_WORKERS = 16
+
 
 def build_response(res, err=None):
     if err:
@@ -65,18 +79,79 @@ def build_response(res, err=None):
         }
 
 
+def list_enterprise_teams(bot_token):
+    # The workspaces in the org that DelaySay was installed in (the org
+    # admin picks them when installing), as dicts with id and name
+    teams = []
+    data = {
+        'limit': TEAMS_LIST_PAGE_SIZE
+    }
+    while True:
+        with timer("Slack"):
+            r = requests.post(
+                url="https://slack.com/api/auth.teams.list",
+                data=data,
+                headers={
+                    'Content-Type': "application/x-www-form-urlencoded",
+                    'Authorization': "Bearer " + bot_token
+                }
+            )
+        if r.status_code != 200:
+            print(r.status_code, r.reason)
+            raise Exception("requests.post failed")
+        content = json.loads(r.content)
+        if not content['ok']:
+            raise Exception(
+                "auth.teams.list failed: " + content['error'] +
+                "\nFor more information, see here:"
+                "\nhttps://api.slack.com/methods/auth.teams.list")
+        teams.extend(content['teams'])
+        cursor = content.get('response_metadata', {}).get('next_cursor')
+        if not cursor:
+            return teams
+        data['cursor'] = cursor
+
+
+def install_in_enterprise(content, create_time, trial_expiration):
+    # An org admin installed DelaySay for a whole Enterprise Grid org.
+    # Slack only gives a user token to whoever authorized, so everyone
+    # else still authorizes DelaySay for themselves, but the org and all
+    # of its workspaces are set up here at once. Each workspace is one
+    # conditional put (no read first), several at a time, and ones that
+    # were already installed keep their payment info.
+    enterprise_id = content['enterprise']['id']
+    user_id = content['authed_user']['id']
+    Enterprise(enterprise_id).add_to_dynamodb(
+        content['enterprise'].get('name'), user_id, create_time)
+    teams = list_enterprise_teams(content['access_token'])
+    def add_team(team):
+        return add_new_team_to_dynamodb(
+            team['id'], team['name'], enterprise_id, create_time,
+            trial_expiration)
+    with ThreadPoolExecutor(max_workers=MAX_TEAM_WRITE_WORKERS) as executor:
+        new_team_count = sum(
+            1 for item in executor.map(add_team, teams) if item)
+    print(
+        f"Org-wide install in {enterprise_id} by {user_id}:"
+        f" {new_team_count} new of {len(teams)} workspaces")
+    token = content['authed_user'].get('access_token')
+    if token:
+        User(user_id).add_token_to_dynamodb(token, enterprise_id, create_time)
+
+
 def lambda_handler(event, context):
     code = event['queryStringParameters']['code']
-    r = requests.post(
-        url="https://slack.com/api/oauth.v2.access",
-        data={
-            'code': code
-        },
-        headers={
-            'Content-Type': "application/x-www-form-urlencoded"
-        },
-        auth=(CLIENT_ID, CLIENT_SECRET)
-    )
+    with timer("Slack"):
+        r = requests.post(
+            url="https://slack.com/api/oauth.v2.access",
+            data={
+                'code': code
+            },
+            headers={
+                'Content-Type': "application/x-www-form-urlencoded"
+            },
+            auth=(CLIENT_ID, CLIENT_SECRET)
+        )
     if r.status_code != 200:
         print(r.status_code, r.reason)
         raise Exception("requests.post failed")
@@ -88,6 +163,12 @@ def lambda_handler(event, context):
             ' "Add to Slack" link in the project doc to see if it works there.'
             "\nAlso check here to find out what the error means:"
             "\nhttps://api.slack.com/methods/oauth.v2.access")
+    create_time = datetime.now(timezone.utc)
+    trial_expiration = create_time + FREE_TRIAL_PERIOD
+    if content.get('is_enterprise_install'):
+        # There's no content['team'] for these.
+        install_in_enterprise(content, create_time, trial_expiration)
+        return build_response("success")
     token = content['authed_user']['access_token']
     user_id = content['authed_user']['id']
     team_id = content['team']['id']
@@ -97,16 +178,15 @@ def lambda_handler(event, context):
         enterprise_id = enterprise['id']
     else:
         enterprise_id = None
-    create_time = datetime.now(timezone.utc)
-    trial_expiration = create_time + FREE_TRIAL_PERIOD
     
     user = User(user_id)
-    team = Team(team_id)
     user.add_to_dynamodb(token, team_id, team_name, enterprise_id, create_time)
-    team.add_to_dynamodb(team_name, enterprise_id, create_time, trial_expiration)
+    add_new_team_to_dynamodb(
+        team_id, team_name, enterprise_id, create_time, trial_expiration)
     return build_response("success")
 
 
+@record_invocation
 def lambda_handler_with_catch_all(event, context):
     try:
         if (event['queryStringParameters'].get('error') == "access_denied"):
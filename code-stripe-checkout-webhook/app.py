@@ -5,33 +5,53 @@ https://github.com/awslabs/serverless-application-model/blob/master/examples/app
 
 import json
 import traceback
-import boto3
 import os
 import hashlib
 import hmac
 import time
-from Team import Team
+from datetime import datetime, timedelta, timezone
+from Team import (
+    Team, add_subscription_team_to_dynamodb, get_subscription_team_id)
 from DelaySayExceptions import (
     NoTeamIdGivenError, SignaturesDoNotMatchError, TimeToleranceExceededError)
+from metrics import timer, record_invocation
+from aws_clients import get_client
 
-ssm = boto3.client('ssm')
+ssm = get_client('ssm')
 
-stripe_signing_secret_parameter = ssm.get_parameter(
-    Name=os.environ['STRIPE_CHECKOUT_SIGNING_SECRET_SSM_NAME'],
-    WithDecryption=True
-)
+with timer("SSM"):
+    stripe_signing_secret_parameter = ssm.get_parameter(
+        Name=os.environ['STRIPE_CHECKOUT_SIGNING_SECRET_SSM_NAME'],
+        WithDecryption=True
+    )
 ENDPOINT_SECRET = stripe_signing_secret_parameter['Parameter']['Value']
 
-stripe_test_signing_secret_parameter = ssm.get_parameter(
-    Name=os.environ['STRIPE_TESTING_CHECKOUT_SIGNING_SECRET_SSM_NAME'],
-    WithDecryption=True
-)
+with timer("SSM"):
+    stripe_test_signing_secret_parameter = ssm.get_parameter(
+        Name=os.environ['STRIPE_TESTING_CHECKOUT_SIGNING_SECRET_SSM_NAME'],
+        WithDecryption=True
+    )
 TEST_ENDPOINT_SECRET = stripe_test_signing_secret_parameter['Parameter']['Value']
 
 # If the timestamp is this old, reject the payload.
 # (https://stripe.com/docs/webhooks/signatures#replay-attacks)
 TIME_TOLERANCE_IN_SECONDS = 5 * 60
 
+# A checkout session shows that the team paid, but not until when. So
+# the team is recorded as paid (PAID_PLAN) for this long, and the
+# subscription's invoice.paid and customer.subscription.* events fill in
+# the real period end and plan. If they don't arrive in time,
+# Team._refresh() reads them from Stripe once it's overdue. Either way,
+# the team isn't warned to pay while it's provisional, since paid plans
+# are only warned once they're overdue (SUBSCRIPTION_WARNING_PERIOD).
+PROVISIONAL_PAYMENT_PERIOD = timedelta(days=1)
+
+# For checkouts, and for plans without a nickname in Stripe
+PAID_PLAN = "paid"
+
+SUBSCRIPTION_EVENTS = [
+    "customer.subscription.created", "customer.subscription.updated"]
+
 
 def find_timestamp_and_signature(stripe_signature):
     received_timestamp = None
@@ -81,6 +101,42 @@ def verify_stripe_signature(stripe_signature, payload, is_live):
             "\nTIME_TOLERANCE_IN_SECONDS: " + str(TIME_TOLERANCE_IN_SECONDS))
 
 
+def read_payment_info(checkout_session):
+    # Returns the provisional (payment_expiration, payment_plan) for a
+    # checkout session, or (None, None) if the payment hasn't gone
+    # through yet (like a bank debit that takes a few days); then the
+    # team keeps its trial.
+    if checkout_session.get('payment_status') != "paid":
+        return (None, None)
+    return (
+        datetime.now(timezone.utc) + PROVISIONAL_PAYMENT_PERIOD, PAID_PLAN)
+
+
+def read_invoice_payment_info(invoice):
+    # Returns (payment_expiration, payment_plan) from the invoice's
+    # latest line, which is the period it paid for.
+    line = max(
+        invoice['lines']['data'], key=lambda line: line['period']['end'])
+    payment_expiration = datetime.fromtimestamp(
+        line['period']['end'], timezone.utc)
+    plan = line.get('plan') or {}
+    return (payment_expiration, plan.get('nickname') or PAID_PLAN)
+
+
+def read_subscription_payment_info(subscription):
+    # Returns (payment_expiration, payment_plan), or (None, None) if the
+    # subscription isn't paid up (like when a renewal failed). Newer
+    # Stripe API versions only have current_period_end on the items.
+    if subscription['status'] != "active":
+        return (None, None)
+    subscription_item = subscription['items']['data'][0]
+    unix_timestamp = subscription.get(
+        'current_period_end', subscription_item.get('current_period_end'))
+    payment_expiration = datetime.fromtimestamp(unix_timestamp, timezone.utc)
+    plan = subscription_item['plan']
+    return (payment_expiration, plan.get('nickname') or PAID_PLAN)
+
+
 def build_response(res, err=None):
     if err:
         return {
@@ -100,23 +156,66 @@ def build_response(res, err=None):
         }
 
 
+def add_checkout_subscription(checkout_session):
+    team_id = checkout_session['client_reference_id']
+    if team_id == "no_team_id_provided":
+        raise NoTeamIdGivenError("No team ID provided")
+    
+    team = Team(team_id, load=False)
+    subscription_id = checkout_session['subscription']
+    # First, so the subscription's events that came before the checkout
+    # find the team when Stripe retries them.
+    add_subscription_team_to_dynamodb(subscription_id, team_id)
+    payment_expiration, payment_plan = read_payment_info(checkout_session)
+    if not team.add_subscription(
+            subscription_id, payment_expiration, payment_plan):
+        print(f"Already added {subscription_id} to {team_id}")
+
+
+def update_subscription_payment_info(subscription_id, payment_info,
+                                     is_new_subscription):
+    payment_expiration, payment_plan = payment_info
+    if not payment_expiration:
+        return
+    team_id = get_subscription_team_id(subscription_id)
+    if not team_id and is_new_subscription:
+        # Stripe doesn't send events in order, so the checkout is
+        # probably still on its way. Fail, and Stripe will retry.
+        raise Exception(f"No checkout for {subscription_id} yet")
+    if not team_id:
+        # Checked out before DelaySay kept track of subscriptions' teams,
+        # so Team._refresh() reads Stripe once the team is overdue.
+        print(f"No team for {subscription_id}")
+        return
+    if not Team(team_id, load=False).update_subscription_payment_info(
+            subscription_id, payment_expiration, payment_plan):
+        print(f"Kept {team_id}'s payment info instead of {subscription_id}'s")
+
+
 def lambda_handler(event, context):
     stripe_signature = event['headers']['Stripe-Signature']
     payload = event['body']
     payload_json = json.loads(payload)
     is_live = payload_json['livemode']
     verify_stripe_signature(stripe_signature, payload=payload, is_live=is_live)
+    event_type = payload_json['type']
     object = payload_json['data']['object']
-    team_id = object['client_reference_id']
-    if team_id == "no_team_id_provided":
-        raise NoTeamIdGivenError("No team ID provided")
-    
-    team = Team(team_id)
-    subscription_id = object['subscription']
-    team.add_subscription(subscription_id)
+    if event_type == "checkout.session.completed":
+        add_checkout_subscription(object)
+    elif event_type == "invoice.paid" and object.get('subscription'):
+        update_subscription_payment_info(
+            object['subscription'], read_invoice_payment_info(object),
+            object.get('billing_reason') == "subscription_create")
+    elif event_type in SUBSCRIPTION_EVENTS:
+        update_subscription_payment_info(
+            object['id'], read_subscription_payment_info(object),
+            event_type == "customer.subscription.created")
+    else:
+        print(f"Ignoring {event_type}")
     return build_response("success")
 
 
+@record_invocation
 def lambda_handler_with_catch_all(event, context):
     try:
         return lambda_handler(event, context)
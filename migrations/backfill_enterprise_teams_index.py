@@ -0,0 +1,96 @@
+#!/usr/bin/env python3.10
+
+# Adds GSI2PK and GSI2SK to "team" items in Enterprise Grid orgs that
+# were written before the enterprise teams index (GSI2) existed, so they
+# show up in Enterprise.get_team_ids(). Safe to run more than once; items
+# that already have them are skipped.
+#
+# Deploy the template with the index first, then run:
+#     python3.10 migrations/backfill_enterprise_teams_index.py \
+#         --table "$DELAYSAY_TABLE_NAME" --region "$DELAYSAY_REGION"
+
+import boto3
+from argparse import ArgumentParser
+from zlib import crc32
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+# Must match ENTERPRISE_TEAMS_INDEX_SHARDS and
+# get_enterprise_teams_index_key() in code-layer-dynamodb/dynamodb.py
+ENTERPRISE_TEAMS_INDEX_SHARDS = 8
+
+
+def get_enterprise_teams_index_key(enterprise_id, team_id):
+    shard = crc32(team_id.encode()) % ENTERPRISE_TEAMS_INDEX_SHARDS
+    return (f"ENTERPRISE#{enterprise_id}#{shard}", "TEAM#" + team_id)
+
+
+def backfill(table, dry_run=False):
+    counts = {
+        'updated': 0,
+        'deleted_meanwhile': 0
+    }
+    scan_arguments = {
+        'FilterExpression':
+            Attr('PK').begins_with("TEAM#") & Attr('SK').eq("team")
+            & Attr('enterprise_id').exists() & Attr('GSI2PK').not_exists(),
+        'ProjectionExpression': "PK, SK, enterprise_id"
+    }
+    while True:
+        response = table.scan(**scan_arguments)
+        for item in response['Items']:
+            if dry_run:
+                counts['updated'] += 1
+                continue
+            team_id = item['PK'][len("TEAM#"):]
+            partition_key, sort_key = get_enterprise_teams_index_key(
+                item['enterprise_id'], team_id)
+            try:
+                table.update_item(
+                    Key={
+                        'PK': item['PK'],
+                        'SK': item['SK']
+                    },
+                    UpdateExpression=
+                        "SET GSI2PK = :enterprise, GSI2SK = :team,"
+                        " team_id = if_not_exists(team_id, :team_id)",
+                    # Don't bring back a team that was deleted mid-scan
+                    ConditionExpression=Attr('PK').exists(),
+                    ExpressionAttributeValues={
+                        ":enterprise": partition_key,
+                        ":team": sort_key,
+                        ":team_id": team_id
+                    }
+                )
+            except ClientError as err:
+                if (err.response['Error']['Code']
+                        != "ConditionalCheckFailedException"):
+                    raise
+                counts['deleted_meanwhile'] += 1
+                continue
+            counts['updated'] += 1
+        if 'LastEvaluatedKey' not in response:
+            return counts
+        scan_arguments['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main():
+    parser = ArgumentParser(
+        description="Backfill the DelaySay enterprise teams index (GSI2)")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--region")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Only count the teams that would be updated")
+    args = parser.parse_args()
+    table = boto3.resource("dynamodb", region_name=args.region).Table(
+        args.table)
+    counts = backfill(table, dry_run=args.dry_run)
+    print(
+        f"{'Would update' if args.dry_run else 'Updated'}"
+        f" {counts['updated']} teams."
+        f"\nSkipped {counts['deleted_meanwhile']} deleted during the backfill.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3.10
+
+# Adds GSI1PK and GSI1SK to "user" items written before the team members
+# index (GSI1) existed, so they show up in Team.get_members() and
+# Team.has_member(). Safe to run more than once; items that already have
+# them are skipped.
+#
+# Deploy the template with the index first, then run:
+#     python3.10 migrations/backfill_team_members_index.py \
+#         --table "$DELAYSAY_TABLE_NAME" --region "$DELAYSAY_REGION"
+#
+# Users from an org-wide install with no team_id are listed under their
+# org (GSI1PK "ENTERPRISE#[enterprise_id]"), like User.add_token_to_dynamodb
+# does. Other users with no team_id (very old installs) can't be added to
+# the index; they're counted and will be added when they next authorize
+# DelaySay.
+# Users whose token was revoked (User.remove_token()) keep their team_id
+# but must stay out of the index, so only users with a token are added.
+
+import boto3
+from argparse import ArgumentParser
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+
+def backfill(table, dry_run=False):
+    counts = {
+        'updated': 0,
+        'missing_team_id': 0,
+        'deleted_meanwhile': 0
+    }
+    scan_arguments = {
+        'FilterExpression':
+            Attr('PK').begins_with("USER#") & Attr('SK').eq("user")
+            & Attr('GSI1PK').not_exists() & Attr('token').exists(),
+        'ProjectionExpression': "PK, SK, team_id, enterprise_id"
+    }
+    while True:
+        response = table.scan(**scan_arguments)
+        for item in response['Items']:
+            if item.get('team_id'):
+                index_key = "TEAM#" + item['team_id']
+            elif item.get('enterprise_id'):
+                index_key = "ENTERPRISE#" + item['enterprise_id']
+            else:
+                counts['missing_team_id'] += 1
+                continue
+            if dry_run:
+                counts['updated'] += 1
+                continue
+            user_id = item['PK'][len("USER#"):]
+            try:
+                table.update_item(
+                    Key={
+                        'PK': item['PK'],
+                        'SK': item['SK']
+                    },
+                    UpdateExpression=
+                        "SET GSI1PK = :team, GSI1SK = :user,"
+                        " user_id = if_not_exists(user_id, :user_id)",
+                    # Don't bring back a user who was deleted or
+                    # revoked mid-scan
+                    ConditionExpression=
+                        Attr('PK').exists() & Attr('token').exists(),
+                    ExpressionAttributeValues={
+                        ":team": index_key,
+                        ":user": "USER#" + user_id,
+                        ":user_id": user_id
+                    }
+                )
+            except ClientError as err:
+                if (err.response['Error']['Code']
+                        != "ConditionalCheckFailedException"):
+                    raise
+                counts['deleted_meanwhile'] += 1
+                continue
+            counts['updated'] += 1
+        if 'LastEvaluatedKey' not in response:
+            return counts
+        scan_arguments['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def main():
+    parser = ArgumentParser(
+        description="Backfill the DelaySay team members index (GSI1)")
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--region")
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="Only count the users that would be updated")
+    args = parser.parse_args()
+    table = boto3.resource("dynamodb", region_name=args.region).Table(
+        args.table)
+    counts = backfill(table, dry_run=args.dry_run)
+    print(
+        f"{'Would update' if args.dry_run else 'Updated'}"
+        f" {counts['updated']} users."
+        f"\nSkipped {counts['missing_team_id']} users with no team_id"
+        f" and {counts['deleted_meanwhile']} deleted or revoked during the"
+        " backfill.")
+
+
+if __name__ == '__main__':
+    main()
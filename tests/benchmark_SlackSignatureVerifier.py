@@ -0,0 +1,81 @@
+#!/usr/bin/env python3.10
+
+# Throughput of Slack request verification, in verifications per second,
+# for a range of request body sizes. Compares the current verifier with
+# the way verify_slack_signature used to build and compare the signature.
+#
+# Usage: python3.10 tests/benchmark_SlackSignatureVerifier.py [seconds]
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+from hmac import new as hmac_new
+from hashlib import sha256 as hashlib_sha256
+from time import time, perf_counter
+from SlackSignatureVerifier import SlackSignatureVerifier
+
+SECRET = "8f742231b10e8888abcd99yyyzzz85a5"
+BODY_SIZES = [256, 1024, 4096, 16384, 65536]
+
+
+def sign(timestamp, body):
+    basestring = "v0:" + timestamp + ":" + body
+    hash = hmac_new(SECRET.encode(), basestring.encode(), hashlib_sha256)
+    return "v0=" + hash.hexdigest()
+
+
+def verify_the_old_way(request_timestamp, received_signature, request_body):
+    basestring = "v0:" + request_timestamp + ":" + str(request_body)
+    hash = hmac_new(
+        key=SECRET.encode(),
+        msg=basestring.encode(),
+        digestmod=hashlib_sha256)
+    expected_signature = "v0=" + hash.hexdigest()
+    if received_signature != expected_signature:
+        raise Exception("Slack signatures do not match")
+    if float(time()) - float(request_timestamp) > 5 * 60:
+        raise Exception("Tolerance for timestamp difference was exceeded")
+
+
+def measure(verify, timestamp, signature, body, seconds):
+    count = 0
+    start = perf_counter()
+    while perf_counter() - start < seconds:
+        for _ in range(100):
+            verify(timestamp, signature, body)
+        count += 100
+    return count / (perf_counter() - start)
+
+
+def main(seconds):
+    timestamp = str(int(time()))
+    print(f"{'body bytes':>10} {'old/s':>12} {'new/s':>12} {'speedup':>8}")
+    for size in BODY_SIZES:
+        body = ("text=" + "x" * size)[:size]
+        signature = sign(timestamp, body)
+        # Replays would be rejected, so benchmark with the cache disabled
+        # by giving each run a fresh verifier and skipping the cache check.
+        verifier = SlackSignatureVerifier(SECRET)
+        verifier._check_for_replay = lambda received_signature: None
+        old_rate = measure(
+            verify_the_old_way, timestamp, signature, body, seconds)
+        new_rate = measure(verifier.verify, timestamp, signature, body, seconds)
+        print(
+            f"{size:>10} {old_rate:>12,.0f} {new_rate:>12,.0f}"
+            f" {new_rate / old_rate:>7.2f}x")
+    stale_timestamp = str(int(time()) - 60 * 60)
+    verifier = SlackSignatureVerifier(SECRET)
+    def reject_stale(timestamp, signature, body):
+        try:
+            verifier.verify(timestamp, signature, body)
+        except Exception:
+            pass
+    stale_rate = measure(
+        reject_stale, stale_timestamp, "v0=bogus", "x" * BODY_SIZES[-1], seconds)
+    print(f"Stale requests rejected: {stale_rate:,.0f}/s")
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3.10
+
+# Parse time for SlashCommandParser over a generated corpus of
+# /delaysay commands, broken down by the kind of time the user typed.
+# Also counts how often the parser has to call dateparser a second time
+# (the "in " fallback), since every dateparser call is most of the cost.
+#
+# Usage:
+#   python3.10 tests/benchmark_SlashCommandParser.py
+#       Print the results
+#   python3.10 tests/benchmark_SlashCommandParser.py --save-baseline
+#       Print the results and store them as the new baseline
+#   python3.10 tests/benchmark_SlashCommandParser.py --compare
+#       Exit nonzero if the results regressed from the stored baseline
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-slack-slash-command-second-responder')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+import argparse
+import json
+from random import Random
+from time import perf_counter
+from datetime import datetime, timezone, timedelta
+import dateparser
+from SlashCommandParser import SlashCommandParser
+from DelaySayExceptions import TimeParseError
+
+BASELINE_FILE = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)),
+    "benchmark_SlashCommandParser_baseline.json")
+
+# Tuesday morning in California, so some timezone-tagged times are
+# already in the past and need the "in " fallback.
+INITIAL_TIME = datetime(
+    2024, 3, 5, 10, 17, 5, tzinfo=timezone(timedelta(hours=-8)))
+
+MESSAGES = [
+    "Take a break",
+    "Hi, there!",
+    "Don't forget the standup",
+    "Reminder: the report is due today",
+    "'Quoted message'",
+    "Happy birthday!! :tada:",
+]
+
+RELATIVE_UNITS = [
+    "sec", "seconds", "s", "min", "mins", "minutes", "m", "h", "hr",
+    "hour", "hours", "day", "days", "d", "week", "weeks"]
+MONTHS = [
+    "January", "February", "March", "April", "May", "June", "July",
+    "August", "September", "October", "November", "December"]
+WEEKDAYS = [
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday",
+    "sunday"]
+TIMEZONES = ["PST", "PDT", "MST", "CST", "EST", "EDT", "UTC", "GMT", "CET", "IST"]
+
+
+def generate_relative(rng):
+    number = rng.randint(1, 90)
+    unit = rng.choice(RELATIVE_UNITS)
+    return rng.choice([
+        f"{number} {unit}",
+        f"{number}{unit}",
+        f"in {number} {unit}",
+        f"{number} {unit} from now",
+        f"{rng.randint(1, 5)} hours {rng.randint(1, 59)} min",
+    ])
+
+
+def generate_clock_time(rng):
+    hour = rng.randint(1, 12)
+    minute = rng.choice(["", ":00", ":15", ":30", ":45"])
+    meridiem = rng.choice(["am", "pm", " am", " pm", " a.m.", " p.m."])
+    return f"{hour}{minute}{meridiem}"
+
+
+def generate_absolute(rng):
+    return rng.choice([
+        generate_clock_time(rng),
+        f"{rng.choice(MONTHS)} {rng.randint(1, 28)},",
+        f"{rng.choice(MONTHS)} {rng.randint(1, 28)}, 2030, "
+        + generate_clock_time(rng),
+        f"2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        f" {rng.randint(0, 23):02d}:{rng.choice(['00', '30'])}",
+        f"{rng.choice(WEEKDAYS)} " + generate_clock_time(rng),
+        f"tomorrow {generate_clock_time(rng)}",
+        rng.choice(["noon", "12 noon", "midnight", "tomorrow"]),
+    ])
+
+
+def generate_timezone(rng):
+    return rng.choice([
+        f"{generate_clock_time(rng)} {rng.choice(TIMEZONES)}",
+        f"tomorrow {generate_clock_time(rng)} {rng.choice(TIMEZONES)}",
+        f"2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        f"T{rng.randint(0, 23):02d}:{rng.choice(['00', '30'])}:00Z",
+    ])
+
+
+def generate_multiline(rng):
+    # The time is on the first line; the message runs over several.
+    return rng.choice([generate_relative, generate_absolute])(rng)
+
+
+def generate_fallback(rng):
+    # Times dateparser puts in the past on the first try, which the
+    # parser retries with "in " in front
+    return rng.choice([
+        f"{rng.randint(1, 9)}am {rng.choice(['PST', 'EST'])}",
+        f"{rng.randint(1, 9)}:{rng.choice(['00', '15', '30'])}"
+        f" {rng.choice(['PST', 'EST'])}",
+        "now",
+    ])
+
+
+CATEGORIES = {
+    'relative': generate_relative,
+    'absolute': generate_absolute,
+    'timezone': generate_timezone,
+    'multiline': generate_multiline,
+    'fallback': generate_fallback,
+}
+
+
+def generate_corpus(per_category, seed):
+    rng = Random(seed)
+    corpus = {}
+    for category, generate_time in CATEGORIES.items():
+        commands = []
+        for _ in range(per_category):
+            message = rng.choice(MESSAGES)
+            if category == 'multiline':
+                message = "\n".join(
+                    rng.choice(MESSAGES) for _ in range(rng.randint(2, 6)))
+            commands.append(generate_time(rng) + " say " + message)
+        corpus[category] = commands
+    return corpus
+
+
+class DateparserCallCounter:
+    # SlashCommandParser imports dateparser.parse each time it parses,
+    # so swapping the module attribute is enough to see every call.
+
+    def __init__(self):
+        self.calls = 0
+        self.original_parse = dateparser.parse
+
+    def __enter__(self):
+        def counting_parse(*args, **kwargs):
+            self.calls += 1
+            return self.original_parse(*args, **kwargs)
+        dateparser.parse = counting_parse
+        return self
+
+    def __exit__(self, *exc_info):
+        dateparser.parse = self.original_parse
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+    return sorted_values[index]
+
+
+def measure_category(commands):
+    durations = []
+    double_parses = 0
+    errors = 0
+    with DateparserCallCounter() as counter:
+        for command in commands:
+            calls_before = counter.calls
+            start = perf_counter()
+            try:
+                SlashCommandParser(command, INITIAL_TIME)
+            except TimeParseError:
+                errors += 1
+            durations.append(perf_counter() - start)
+            if counter.calls - calls_before > 1:
+                double_parses += 1
+        total_calls = counter.calls
+    durations.sort()
+    return {
+        'commands': len(commands),
+        'mean_ms': round(1000 * sum(durations) / len(durations), 3),
+        'p50_ms': round(1000 * percentile(durations, 0.50), 3),
+        'p95_ms': round(1000 * percentile(durations, 0.95), 3),
+        'dateparser_calls_per_command': round(total_calls / len(commands), 4),
+        'double_parse_rate': round(double_parses / len(commands), 4),
+        'time_parse_errors': errors,
+    }
+
+
+def run(per_category, seed):
+    corpus = generate_corpus(per_category, seed)
+    # The first dateparser call loads its language data; time it on its
+    # own, since that's what a cold Lambda pays.
+    start = perf_counter()
+    SlashCommandParser("1 hour say warm up", INITIAL_TIME)
+    first_parse_ms = round(1000 * (perf_counter() - start), 3)
+    results = {
+        'per_category': per_category,
+        'seed': seed,
+        'first_parse_ms': first_parse_ms,
+        'categories': {
+            category: measure_category(commands)
+            for category, commands in corpus.items()},
+    }
+    return results
+
+
+def print_results(results):
+    print(f"First parse (cold): {results['first_parse_ms']:.1f} ms")
+    print(
+        f"{'category':<10} {'commands':>8} {'mean ms':>8} {'p50 ms':>8}"
+        f" {'p95 ms':>8} {'calls':>6} {'double':>7} {'errors':>6}")
+    for category, stats in results['categories'].items():
+        print(
+            f"{category:<10} {stats['commands']:>8} {stats['mean_ms']:>8.3f}"
+            f" {stats['p50_ms']:>8.3f} {stats['p95_ms']:>8.3f}"
+            f" {stats['dateparser_calls_per_command']:>6.3f}"
+            f" {stats['double_parse_rate']:>7.1%}"
+            f" {stats['time_parse_errors']:>6}")
+
+
+def compare(results, baseline, tolerance):
+    # Returns a list of regressions. Timing is allowed to drift by
+    # the tolerance (machines differ); call counts and errors must not
+    # go up at all, since they don't depend on the machine.
+    regressions = []
+    for category, stats in results['categories'].items():
+        if category not in baseline['categories']:
+            continue
+        base = baseline['categories'][category]
+        if stats['mean_ms'] > base['mean_ms'] * (1 + tolerance):
+            regressions.append(
+                f"{category}: mean {stats['mean_ms']:.3f} ms"
+                f" vs baseline {base['mean_ms']:.3f} ms")
+        for key in ['dateparser_calls_per_command', 'double_parse_rate',
+                    'time_parse_errors']:
+            if stats[key] > base[key]:
+                regressions.append(
+                    f"{category}: {key} {stats[key]} vs baseline {base[key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--per-category", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=2019)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.5,
+        help="allowed fractional increase in mean parse time (default 0.5)")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+        # Compare like with like, whatever was passed on the command line
+        args.per_category = baseline['per_category']
+        args.seed = baseline['seed']
+
+    results = run(args.per_category, args.seed)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print("Saved baseline to " + BASELINE_FILE)
+
+    if args.compare:
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions from baseline:")
+            for regression in regressions:
+                print("  " + regression)
+            sys.exit(1)
+        print("No regressions from baseline.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3.10
+
+# Cold start and DynamoDB latency with boto3's default client settings
+# ("before") and with the shared clients from aws_clients.py ("after"),
+# against a local stand-in for DynamoDB, so only the client side differs.
+#
+# Cold start is measured in a fresh interpreter: importing the dynamodb
+# layer and making the first GetItem call. Latency percentiles are for
+# GetItem calls from one thread and from many threads at once (like the
+# second responder's scheduling threads).
+#
+# Usage: python3.10 tests/benchmark_aws_clients.py [--calls 2000]
+#     [--threads 16] [--latency-ms 2] [--endpoint-url http://...]
+# Pass --endpoint-url to use DynamoDB Local (with a table named
+# "benchmark") instead of the built-in stand-in.
+
+import sys, os
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(1, os.path.join(ROOT, "code-layer-exceptions"))
+sys.path.insert(1, os.path.join(ROOT, "code-layer-dynamodb"))
+
+import json
+import subprocess
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from statistics import median, quantiles
+from threading import Thread
+from time import perf_counter, sleep
+
+COLD_START_RUNS = 5
+
+COLD_START_BEFORE = """
+from time import perf_counter
+start = perf_counter()
+from boto3 import resource as boto3_resource
+table = boto3_resource("dynamodb").Table("benchmark")
+table.get_item(Key={'PK': "USER#U1", 'SK': "user"})
+print((perf_counter() - start) * 1000)
+"""
+
+COLD_START_AFTER = """
+from time import perf_counter
+start = perf_counter()
+from dynamodb import dynamodb_table
+dynamodb_table.get_item(Key={'PK': "USER#U1", 'SK': "user"})
+print((perf_counter() - start) * 1000)
+"""
+
+
+class FakeDynamoDBHandler(BaseHTTPRequestHandler):
+    # Answers every GetItem with the same item, over keep-alive HTTP/1.1
+    # connections like the real endpoint.
+    protocol_version = "HTTP/1.1"
+    # Otherwise the headers and body go out as separate packets and
+    # every call waits on a delayed ACK.
+    disable_nagle_algorithm = True
+    latency_in_seconds = 0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.latency_in_seconds:
+            sleep(self.latency_in_seconds)
+        body = json.dumps({
+            'Item': {
+                'PK': {'S': "USER#U1"},
+                'SK': {'S': "user"},
+                'team_id': {'S': "T1"}
+            }
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', "application/x-amz-json-1.0")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_dynamodb(latency_in_seconds):
+    handler = type(
+        "BoundFakeDynamoDBHandler", (FakeDynamoDBHandler,),
+        {'latency_in_seconds': latency_in_seconds})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def measure_cold_start(code, environment):
+    times = []
+    for _ in range(COLD_START_RUNS):
+        output = subprocess.run(
+            [sys.executable, "-c", code], env=environment, check=True,
+            capture_output=True, text=True).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return median(times)
+
+
+def measure_latency(table, calls, threads):
+    def get_item(_):
+        start = perf_counter()
+        table.get_item(Key={'PK': "USER#U1", 'SK': "user"})
+        return (perf_counter() - start) * 1000
+    # Warm up the connections first.
+    for _ in range(threads):
+        get_item(None)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        latencies = list(executor.map(get_item, range(calls)))
+    percentiles = quantiles(latencies, n=100)
+    return (median(latencies), percentiles[94], percentiles[98])
+
+
+def main():
+    parser = ArgumentParser(description="AWS client settings benchmark")
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument(
+        "--latency-ms", type=float, default=2,
+        help="How long the built-in stand-in takes to answer")
+    parser.add_argument("--endpoint-url")
+    args = parser.parse_args()
+    server = None
+    endpoint_url = args.endpoint_url
+    if not endpoint_url:
+        server, endpoint_url = start_fake_dynamodb(args.latency_ms / 1000)
+    os.environ.update({
+        'AWS_ENDPOINT_URL_DYNAMODB': endpoint_url,
+        'AWS_DEFAULT_REGION': "us-east-1",
+        'AWS_ACCESS_KEY_ID': os.environ.get('AWS_ACCESS_KEY_ID', "testing"),
+        'AWS_SECRET_ACCESS_KEY':
+            os.environ.get('AWS_SECRET_ACCESS_KEY', "testing"),
+        'AUTH_TABLE_NAME': "benchmark"
+    })
+    environment = {
+        **os.environ,
+        'PYTHONPATH': os.pathsep.join([
+            os.path.join(ROOT, "code-layer-exceptions"),
+            os.path.join(ROOT, "code-layer-dynamodb")])
+    }
+    print(f"Endpoint: {endpoint_url}")
+    print(
+        f"Cold start (import + first GetItem, median of {COLD_START_RUNS}):"
+        f" before {measure_cold_start(COLD_START_BEFORE, environment):.1f} ms,"
+        f" after {measure_cold_start(COLD_START_AFTER, environment):.1f} ms")
+
+    from boto3 import resource as boto3_resource
+    from dynamodb import dynamodb_table
+    tables = {
+        'before': boto3_resource("dynamodb").Table("benchmark"),
+        'after': dynamodb_table
+    }
+    print(f"{'GetItem latency (ms)':<24} {'p50':>7} {'p95':>7} {'p99':>7}")
+    for threads in [1, args.threads]:
+        for name, table in tables.items():
+            p50, p95, p99 = measure_latency(table, args.calls, threads)
+            print(
+                f"{name + f', {threads} thread(s)':<24}"
+                f" {p50:>7.2f} {p95:>7.2f} {p99:>7.2f}")
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3.10
+
+# Time to build the `list` response for channels with many scheduled
+# messages: write_scheduled_messages_list() (pieces joined once) against
+# the way list_scheduled_messages used to build it (res += per message),
+# and the help text from message_catalog against rebuilding it with
+# f-strings every time.
+#
+# Usage: python3.10 tests/benchmark_list_response.py [--sizes 10,100,1000]
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-slack-slash-command-second-responder')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+os.environ.setdefault('SLASH_COMMAND', "/delaysay")
+os.environ.setdefault('CONTACT_PAGE', "https://delaysay.example/contact")
+os.environ.setdefault('SUPPORT_EMAIL', "support@delaysay.example")
+
+from argparse import ArgumentParser
+from random import sample as random_sample
+from statistics import median
+from time import perf_counter
+from list_and_delete_util import (
+    convert_to_slack_datetime, write_scheduled_messages_list)
+from message_catalog import build_help_text, HELP_EXAMPLES
+
+slash = os.environ['SLASH_COMMAND']
+contact_page = os.environ['CONTACT_PAGE']
+support_email = os.environ['SUPPORT_EMAIL']
+
+HEADER = f"Here are the messages you have scheduled in this channel with `{slash}`:"
+
+RUNS = 7
+
+
+def old_list_response(scheduled_messages):
+    res = HEADER
+    for i, message_info in enumerate(scheduled_messages):
+        slack_datetime = convert_to_slack_datetime(timestamp=message_info['post_at'])
+        message = message_info['text']
+        res += "\n\n"
+        res += f"    *{i+1}) {slack_datetime}:*"
+        res += f"\n{message}".replace("\n", "\n> ")
+    return res
+
+
+def old_help_text():
+    two_examples = random_sample(HELP_EXAMPLES, 2)
+    res = "Here is the command format:"
+    res += (
+        f"\n        `{slash} [time] say [message]`"
+        f"\n        `{slash} {two_examples[0]}`"
+        f"\n        `{slash} {two_examples[1]}`"
+        "\nI will send the message from your username at the specified date"
+        " and time, up to 120 days in the future. (Can't schedule messages to"
+        " send in the past yet, but we'll consider adding this feature"
+        " once time travel is possible!)"
+        "\n\nTo schedule the same message in several channels at once, list"
+        " them before `say`:"
+        f"\n        `{slash} 9am in #general #random say Good morning! :sunny:`"
+        "\nOr schedule messages from a CSV or JSON file you uploaded to"
+        f" Slack: `{slash} import [link to file]`"
+        "\n\nTo see your scheduled messages in this channel or cancel the next"
+        " scheduled message, type:"
+        f"\n        `{slash} list`        or        `{slash} delete 1`"
+        f"\nTo see your scheduled messages in every channel, type `{slash} list all`."
+        "\n\nIf you're an admin in this Slack workspace, you can view past"
+        " invoices, update your payment information, and more in your Stripe"
+        " customer portal:"
+        f"\n        `{slash} billing`"
+        "\nAdmins can also give another user access to your workspace's"
+        " billing portal by typing this:"
+        f"\n        `{slash} billing authorize @username`"
+        f"\nTo see who can manage billing, type `{slash} billing list`."
+        f"\n\nQuestions? Please reach out at {contact_page} or {support_email}")
+    return res
+
+
+def make_messages(total):
+    return [
+        {
+            'post_at': 1700000000 + 60 * i,
+            'text': f"Reminder {i}: the report is due today\nThanks! :wave:"
+        }
+        for i in range(total)]
+
+
+def time_per_call(function, *args, calls=1):
+    # Median over RUNS runs, in microseconds per call
+    times = []
+    for _ in range(RUNS):
+        start = perf_counter()
+        for _ in range(calls):
+            function(*args)
+        times.append((perf_counter() - start) / calls * 1e6)
+    return median(times)
+
+
+def main():
+    parser = ArgumentParser(description="List response building benchmark")
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    args = parser.parse_args()
+    print(f"{'list response':<22} {'before us':>12} {'after us':>12}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        messages = make_messages(size)
+        assert (old_list_response(messages)
+                == write_scheduled_messages_list(HEADER, messages))
+        calls = max(1, 10000 // size)
+        before = time_per_call(old_list_response, messages, calls=calls)
+        after = time_per_call(
+            write_scheduled_messages_list, HEADER, messages, calls=calls)
+        print(f"{str(size) + ' messages':<22} {before:>12.1f} {after:>12.1f}")
+    before = time_per_call(old_help_text, calls=10000)
+    after = time_per_call(build_help_text, calls=10000)
+    print(f"{'help text':<22} {before:>12.2f} {after:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
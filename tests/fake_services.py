@@ -0,0 +1,420 @@
+#!/usr/bin/env python3.10
+
+# Stand-ins for slack.com and the Stripe API, served over local HTTP so
+# DelaySay's Lambda functions can run in-process without touching the
+# real services. Used by tests/load_harness.py.
+
+import json
+from collections import Counter
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from time import time
+from urllib.parse import parse_qs, urlparse
+from uuid import uuid4
+
+# How long each fake call takes to answer, to roughly model network time
+FAKE_LATENCY_IN_SECONDS = 0
+
+
+class FakeServiceState:
+
+    def __init__(self):
+        self.lock = Lock()
+        self.calls = Counter()
+        # user_id -> {'tz_offset', 'tz', 'is_admin'}
+        self.users = {}
+        # (user_id, channel_id) -> list of scheduled message dicts
+        self.scheduled_messages = {}
+        # subscription_id -> Stripe subscription object
+        self.subscriptions = {}
+        # response_url id -> list of posted message texts
+        self.responses = {}
+        # response_url id -> list of everything posted (blocks and all)
+        self.response_payloads = {}
+        # OAuth codes handed out by the fake "Add to Slack" button
+        self.oauth_codes = {}
+        # file_id -> {'name', 'filetype', 'content'} uploaded by users
+        self.files = {}
+        # Files DelaySay uploaded and shared:
+        # {'channels', 'initial_comment', 'name', 'content'}
+        self.uploads = []
+        # file_id -> {'name', 'length', 'content'} not shared yet
+        self.pending_uploads = {}
+        # Views DelaySay opened: {'user_id', 'trigger_id', 'view'}
+        self.views = []
+        # enterprise_id -> workspaces in the org: [{'id', 'name'}]
+        self.enterprise_teams = {}
+
+    def add_user(self, user_id, team_id, team_name, is_admin=False,
+                 tz="America/Los_Angeles", tz_offset=-8 * 60 * 60,
+                 enterprise_id=None):
+        code = uuid4().hex
+        self.users[user_id] = {
+            'id': user_id,
+            'team_id': team_id,
+            'is_admin': is_admin,
+            'tz': tz,
+            'tz_offset': tz_offset
+        }
+        self.oauth_codes[code] = {
+            'ok': True,
+            'authed_user': {
+                'id': user_id,
+                'access_token': "xoxp-" + user_id
+            },
+            'team': {
+                'id': team_id,
+                'name': team_name
+            },
+            'enterprise': {'id': enterprise_id} if enterprise_id else None
+        }
+        return code
+
+    def add_enterprise_install(self, user_id, enterprise_id, teams):
+        # An org admin installing DelaySay for an Enterprise Grid org,
+        # with teams as (team_id, team_name) pairs
+        code = uuid4().hex
+        self.users[user_id] = {
+            'id': user_id,
+            'team_id': teams[0][0],
+            'is_admin': True,
+            'tz': "America/Los_Angeles",
+            'tz_offset': -8 * 60 * 60
+        }
+        self.enterprise_teams[enterprise_id] = [
+            {'id': team_id, 'name': team_name} for team_id, team_name in teams]
+        self.oauth_codes[code] = {
+            'ok': True,
+            'access_token': "xoxb-" + enterprise_id,
+            'is_enterprise_install': True,
+            'authed_user': {
+                'id': user_id,
+                'access_token': "xoxp-" + user_id
+            },
+            'team': None,
+            'enterprise': {
+                'id': enterprise_id,
+                'name': f"Load Test Org {enterprise_id}"
+            }
+        }
+        return code
+
+    def add_subscription(self, subscription_id, customer_id,
+                         plan_nickname="recurring-1month-loadtest"):
+        self.subscriptions[subscription_id] = {
+            'id': subscription_id,
+            'object': "subscription",
+            'status': "active",
+            'customer': customer_id,
+            'items': {
+                'object': "list",
+                'data': [
+                    {
+                        'id': "si_" + uuid4().hex[:14],
+                        'object': "subscription_item",
+                        'current_period_end': int(time()) + 30 * 24 * 60 * 60,
+                        'plan': {
+                            'id': "plan_loadtest",
+                            'object': "plan",
+                            'nickname': plan_nickname
+                        }
+                    }
+                ]
+            }
+        }
+
+    def add_file(self, name, filetype, content):
+        file_id = "F" + uuid4().hex[:10].upper()
+        self.files[file_id] = {
+            'name': name,
+            'filetype': filetype,
+            'content': content.encode()
+        }
+        return file_id
+
+    def pop_responses(self, response_id):
+        with self.lock:
+            return self.responses.pop(response_id, [])
+
+    def pop_response_payloads(self, response_id):
+        with self.lock:
+            return self.response_payloads.pop(response_id, [])
+
+
+class FakeServiceRequestHandler(BaseHTTPRequestHandler):
+
+    # Set on the subclass created by start_fake_services()
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_params(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        content_type = self.headers.get('Content-Type', "")
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser().parsebytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+            return {
+                part.get_param('name', header='content-disposition'):
+                    part.get_payload(decode=True).decode()
+                for part in message.get_payload()}
+        body = body.decode()
+        if content_type.startswith("application/json"):
+            return json.loads(body) if body else {}
+        return {
+            key: values[0] for key, values in parse_qs(body).items()}
+
+    def _user_id_from_token(self):
+        authorization = self.headers.get('Authorization', "")
+        return authorization.rpartition("xoxp-")[2]
+
+    def _send_json(self, content, status=200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def _handle(self, method):
+        if FAKE_LATENCY_IN_SECONDS:
+            from time import sleep
+            sleep(FAKE_LATENCY_IN_SECONDS)
+        path = urlparse(self.path).path
+        state = self.state
+        if path.startswith("/upload/"):
+            # The file itself, sent to the URL from files.getUploadURLExternal
+            file_id = path[len("/upload/"):]
+            length = int(self.headers.get('Content-Length', 0))
+            content = self.rfile.read(length).decode()
+            with state.lock:
+                state.calls["slack upload"] += 1
+                pending = state.pending_uploads.get(file_id)
+                if pending:
+                    pending['content'] = content
+            if not pending:
+                return self._send_json({'ok': False}, 404)
+            return self._send_json({'ok': True})
+        params = self._read_params() if method == "POST" else {}
+        if path.startswith("/api/"):
+            api_method = path[len("/api/"):]
+            with state.lock:
+                state.calls["slack " + api_method] += 1
+            handler = getattr(self, "_slack_" + api_method.replace(".", "_"), None)
+            if not handler:
+                return self._send_json({'ok': False, 'error': "unknown_method"})
+            return self._send_json(handler(params))
+        if path.startswith("/files/"):
+            file_id = path[len("/files/"):]
+            with state.lock:
+                state.calls["slack file download"] += 1
+            body = state.files[file_id]['content']
+            self.send_response(200)
+            self.send_header('Content-Type', "application/octet-stream")
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if path.startswith("/response/"):
+            response_id = path[len("/response/"):]
+            with state.lock:
+                state.calls["slack response_url"] += 1
+                state.responses.setdefault(response_id, []).append(
+                    params.get('text'))
+                state.response_payloads.setdefault(response_id, []).append(
+                    params)
+            return self._send_json({'ok': True})
+        if path.startswith("/v1/subscriptions/"):
+            subscription_id = path[len("/v1/subscriptions/"):]
+            with state.lock:
+                state.calls["stripe subscriptions.retrieve"] += 1
+            subscription = state.subscriptions.get(subscription_id)
+            if not subscription:
+                return self._send_json(
+                    {'error': {'type': "invalid_request_error",
+                               'message': "No such subscription"}}, 404)
+            return self._send_json(subscription)
+        if path == "/v1/billing_portal/sessions":
+            with state.lock:
+                state.calls["stripe billing_portal.sessions.create"] += 1
+            session_id = "bps_" + uuid4().hex[:14]
+            return self._send_json({
+                'id': session_id,
+                'object': "billing_portal.session",
+                'customer': params.get('customer'),
+                'url': "https://billing.stripe.test/session/" + session_id
+            })
+        self._send_json({'error': "not found: " + path}, 404)
+
+    def _slack_oauth_v2_access(self, params):
+        content = self.state.oauth_codes.get(params.get('code'))
+        return content or {'ok': False, 'error': "invalid_code"}
+
+    def _slack_auth_teams_list(self, params):
+        authorization = self.headers.get('Authorization', "")
+        teams = self.state.enterprise_teams.get(
+            authorization.rpartition("xoxb-")[2], [])
+        # The cursor is just the offset of the next page.
+        start = int(params.get('cursor') or 0)
+        end = start + int(params.get('limit') or 100)
+        return {
+            'ok': True,
+            'teams': teams[start:end],
+            'response_metadata': {
+                'next_cursor': str(end) if end < len(teams) else ""}
+        }
+
+    def _slack_users_info(self, params):
+        user = self.state.users.get(params.get('user'))
+        if not user:
+            return {'ok': False, 'error': "user_not_found"}
+        return {'ok': True, 'user': user}
+
+    def _slack_files_info(self, params):
+        file = self.state.files.get(params.get('file'))
+        if not file:
+            return {'ok': False, 'error': "file_not_found"}
+        host = self.headers.get('Host')
+        return {
+            'ok': True,
+            'file': {
+                'id': params['file'],
+                'name': file['name'],
+                'filetype': file['filetype'],
+                'size': len(file['content']),
+                'url_private_download': f"http://{host}/files/{params['file']}"
+            }
+        }
+
+    def _slack_conversations_open(self, params):
+        return {'ok': True, 'channel': {'id': "D" + params['users']}}
+
+    def _slack_views_open(self, params):
+        view = params['view']
+        if isinstance(view, str):
+            view = json.loads(view)
+        for block in view.get('blocks', []):
+            # Slack's limit for a plain_text_input's initial_value
+            if len(block.get('element', {}).get('initial_value', "")) > 3000:
+                return {'ok': False, 'error': "invalid_arguments"}
+        with self.state.lock:
+            self.state.views.append({
+                'user_id': self._user_id_from_token(),
+                'trigger_id': params['trigger_id'],
+                'view': view
+            })
+        return {'ok': True, 'view': {**view, 'id': "V" + uuid4().hex[:10].upper()}}
+
+    def _slack_files_getUploadURLExternal(self, params):
+        # Like files.upload, which Slack retired, DelaySay's upload isn't
+        # shared until files.completeUploadExternal.
+        file_id = "F" + uuid4().hex[:10].upper()
+        with self.state.lock:
+            self.state.pending_uploads[file_id] = {
+                'name': params.get('filename'),
+                'length': int(params.get('length') or 0),
+                'content': None
+            }
+        host = self.headers.get('Host')
+        return {
+            'ok': True,
+            'file_id': file_id,
+            'upload_url': f"http://{host}/upload/{file_id}"
+        }
+
+    def _slack_files_completeUploadExternal(self, params):
+        files = json.loads(params.get('files') or "[]")
+        completed = []
+        with self.state.lock:
+            for file in files:
+                pending = self.state.pending_uploads.pop(file['id'], None)
+                if not pending or pending['content'] is None:
+                    return {'ok': False, 'error': "file_not_found"}
+                self.state.uploads.append({
+                    'channels': params.get('channel_id'),
+                    'initial_comment': params.get('initial_comment'),
+                    'name': pending['name'],
+                    'content': pending['content']
+                })
+                completed.append({'id': file['id'], 'title': file.get('title')})
+        return {'ok': True, 'files': completed}
+
+    def _slack_chat_scheduleMessage(self, params):
+        user_id = self._user_id_from_token()
+        channel_id = params['channel']
+        post_at = int(float(params['post_at']))
+        if post_at <= time():
+            return {'ok': False, 'error': "time_in_past"}
+        message = {
+            'id': "Q" + uuid4().hex[:10].upper(),
+            'channel_id': channel_id,
+            'post_at': post_at,
+            'date_created': int(time()),
+            'text': params['text']
+        }
+        with self.state.lock:
+            self.state.scheduled_messages.setdefault(
+                (user_id, channel_id), []).append(message)
+        return {
+            'ok': True,
+            'channel': channel_id,
+            'scheduled_message_id': message['id'],
+            'post_at': post_at
+        }
+
+    def _slack_chat_scheduledMessages_list(self, params):
+        user_id = self._user_id_from_token()
+        channel_id = params.get('channel')
+        with self.state.lock:
+            if channel_id:
+                messages = list(self.state.scheduled_messages.get(
+                    (user_id, channel_id), []))
+            else:
+                messages = [
+                    message
+                    for (owner, _), owner_messages
+                    in self.state.scheduled_messages.items()
+                    if owner == user_id
+                    for message in owner_messages]
+        # The cursor is just the offset of the next page.
+        start = int(params.get('cursor') or 0)
+        end = start + int(params.get('limit') or 100)
+        return {
+            'ok': True,
+            'scheduled_messages': messages[start:end],
+            'response_metadata': {
+                'next_cursor': str(end) if end < len(messages) else ""}
+        }
+
+    def _slack_chat_deleteScheduledMessage(self, params):
+        user_id = self._user_id_from_token()
+        key = (user_id, params['channel'])
+        with self.state.lock:
+            messages = self.state.scheduled_messages.get(key, [])
+            for message in messages:
+                if message['id'] == params['scheduled_message_id']:
+                    messages.remove(message)
+                    return {'ok': True}
+        return {'ok': False, 'error': "invalid_scheduled_message_id"}
+
+
+def start_fake_services():
+    # Returns (base_url, state, server). Call server.shutdown() when done.
+    state = FakeServiceState()
+    handler = type(
+        "BoundFakeServiceRequestHandler", (FakeServiceRequestHandler,),
+        {'state': state})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return (f"http://{host}:{port}", state, server)
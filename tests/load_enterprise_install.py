@@ -0,0 +1,149 @@
+#!/usr/bin/env python3.10
+
+# Load test of an Enterprise Grid org installing DelaySay in every
+# workspace at once: many concurrent add_new_team_to_dynamodb() calls
+# (the team part of each OAuth callback) for one org. Then the org's
+# workspaces are listed from the enterprise teams index (GSI2), and a
+# workspace's entitlement is read along with the org's.
+#
+# Usage: python3.10 tests/load_enterprise_install.py [--workspaces 500]
+#     [--threads 50] [--endpoint-url http://localhost:8000]
+# Pass --endpoint-url to run against DynamoDB Local (the table is created
+# there first); otherwise DynamoDB is faked in-process with moto. Neither
+# throttles hot partitions like DynamoDB does, so the report also shows
+# how evenly the org's index entries are spread over its shards.
+
+import sys, os
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.realpath(__file__)))
+for directory in ["code-layer-exceptions", "code-layer-dynamodb",
+                  "code-layer-team"]:
+    sys.path.insert(1, os.path.join(ROOT, directory))
+
+from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from statistics import median, quantiles
+from time import perf_counter
+from uuid import uuid4
+
+TABLE_NAME = "DelaySayEnterpriseLoadTest"
+
+
+def install_burst(enterprise_id, team_ids, threads):
+    # Returns each install's latency in milliseconds and the errors.
+    from Team import add_new_team_to_dynamodb
+    create_time = datetime.now(timezone.utc)
+    trial_expiration = create_time + timedelta(days=14)
+    def install(team_id):
+        start = perf_counter()
+        add_new_team_to_dynamodb(
+            team_id, f"Workspace {team_id}", enterprise_id, create_time,
+            trial_expiration)
+        return (perf_counter() - start) * 1000
+    latencies = []
+    errors = Counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(install, team_id) for team_id in team_ids]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception as err:
+                errors[type(err).__name__] += 1
+    return latencies, errors
+
+
+def count_dynamodb_calls(function):
+    import metrics
+    metrics.counts.clear()
+    function()
+    return metrics.counts.get("DynamoDB", 0)
+
+
+def run(workspaces, threads):
+    from Team import Team
+    from Enterprise import Enterprise
+    from dynamodb import dynamodb_table
+    enterprise_id = "E" + uuid4().hex[:8].upper()
+    team_ids = [f"T{enterprise_id}{i:05d}" for i in range(workspaces)]
+
+    start = perf_counter()
+    latencies, errors = install_burst(enterprise_id, team_ids, threads)
+    elapsed = perf_counter() - start
+    percentiles = quantiles(latencies, n=100)
+    print(
+        f"Installed {len(latencies)} workspaces in {elapsed:.2f} s"
+        f" ({len(latencies) / elapsed:.0f}/s) with {threads} threads;"
+        f" errors: {dict(errors) or 'none'}")
+    print(
+        f"Install latency (ms): p50 {median(latencies):.1f},"
+        f" p95 {percentiles[94]:.1f}, p99 {percentiles[98]:.1f}")
+
+    shards = Counter()
+    for team_id in team_ids:
+        item = dynamodb_table.get_item(
+            Key={'PK': "TEAM#" + team_id, 'SK': "team"})['Item']
+        shards[item['GSI2PK']] += 1
+    print(
+        f"Index entries per shard: {sorted(shards.values())}"
+        f" (one partition key would have had {workspaces})")
+
+    start = perf_counter()
+    listed = Enterprise(enterprise_id).get_team_ids()
+    print(
+        f"Listed {len(listed)} workspaces from the index in"
+        f" {(perf_counter() - start) * 1000:.1f} ms")
+    assert sorted(listed) == sorted(team_ids)
+
+    # The whole org pays, so every workspace is covered.
+    dynamodb_table.put_item(Item={
+        'PK': "ENTERPRISE#" + enterprise_id,
+        'SK': "enterprise",
+        'payment_expiration': (
+            datetime.now(timezone.utc) + timedelta(days=365)).strftime(
+                "%Y-%m-%dT%H:%M:%S%z"),
+        'payment_plan': "enterprise-annual"
+    })
+    for label, enterprise_id_known in [
+            ("org known from the request", enterprise_id),
+            ("org read from the team item", None)]:
+        calls = count_dynamodb_calls(
+            lambda: Team(team_ids[0], enterprise_id_known).is_trialing())
+        team = Team(team_ids[0], enterprise_id_known)
+        print(
+            f"Entitlement, {label}: {calls} DynamoDB call(s),"
+            f" plan {team.payment_plan}, trialing: {team.is_trialing()}")
+
+
+def main():
+    parser = ArgumentParser(description="Enterprise Grid install load test")
+    parser.add_argument("--workspaces", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--endpoint-url")
+    args = parser.parse_args()
+    os.environ['AWS_DEFAULT_REGION'] = "us-east-1"
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', "testing")
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "testing")
+    os.environ['AUTH_TABLE_NAME'] = TABLE_NAME
+    os.environ['DELAYSAY_METRICS'] = "true"
+    if args.endpoint_url:
+        os.environ['AWS_ENDPOINT_URL_DYNAMODB'] = args.endpoint_url
+        mock = nullcontext()
+    else:
+        from moto import mock_aws
+        mock = mock_aws()
+    print(f"DynamoDB: {args.endpoint_url or 'moto (in-process)'}")
+    with mock:
+        from load_harness import create_table
+        import boto3
+        try:
+            create_table(TABLE_NAME)
+        except boto3.client('dynamodb').exceptions.ResourceInUseException:
+            pass
+        run(args.workspaces, args.threads)
+
+
+if __name__ == '__main__':
+    main()
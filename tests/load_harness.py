@@ -0,0 +1,731 @@
+#!/usr/bin/env python3.10
+
+# End-to-end load test for DelaySay, run entirely on this machine.
+#
+# Both slash command responders, the interactivity function, the OAuth
+# handler, the Stripe checkout webhook and the billing portal redirect
+# run in-process. DynamoDB, SSM
+# and KMS are faked with moto. slack.com and the Stripe API are faked by
+# the local HTTP server in tests/fake_services.py. The harness installs
+# DelaySay for some fake teams, subscribes some of them through the Stripe
+# webhook, and then replays a mix of slash commands. It reports latency
+# percentiles and remote-call counts for each command type.
+#
+# Usage:
+#     python3.10 tests/load_harness.py --requests 500 \
+#         --mix schedule=60,list=20,delete=10,billing=10 --json results.json
+#
+# Command types for --mix: schedule, multichannel, import, list, delete,
+# billing
+#
+# Everything answers almost instantly here, so concurrency in the
+# functions barely shows. --latency-ms adds that much time to every call
+# to the fake services and to AWS, more like the real thing. Compare with
+# --no-prefetch to see what the second responder's prefetching saves.
+#
+# Requires the packages in code-*/requirements.txt, plus moto.
+
+import sys, os
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(1, os.path.dirname(os.path.realpath(__file__)))
+for directory in sorted(os.listdir(ROOT)):
+    if directory.startswith("code-layer-"):
+        sys.path.insert(1, os.path.join(ROOT, directory))
+
+import json
+import re
+from contextlib import contextmanager, redirect_stdout, nullcontext
+from io import StringIO
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from functools import partial
+from hashlib import sha256
+from hmac import new as hmac_new
+from importlib.util import spec_from_file_location, module_from_spec
+from random import Random
+from statistics import quantiles, mean
+from threading import Thread
+from time import time, perf_counter
+from urllib.parse import urlencode
+from uuid import uuid4
+
+from fake_services import start_fake_services
+
+SLACK_SIGNING_SECRET = "load-test-slack-signing-secret"
+STRIPE_SIGNING_SECRET = "load-test-stripe-signing-secret"
+LINKS_DOMAIN = "https://api.delaysay.test"
+INSTALL_SUCCESS_URL = "https://delaysay.test/add-success/"
+BILLING_PORTAL_FAIL_URL = "https://delaysay.test/invalid-billing-url/"
+DEFAULT_MIX = "schedule=60,list=20,delete=10,billing=10"
+IMPORT_FILE_ROWS = 20
+ERROR_TEXT = "Sorry, there was an error"
+
+
+class FakeContext:
+
+    def __init__(self, function_name, remaining_time_in_millis=300 * 1000):
+        self.function_name = function_name
+        self.remaining_time_in_millis = remaining_time_in_millis
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_time_in_millis
+
+
+class FakeLambdaClient:
+    # Stands in for aws_clients.get_client('lambda'). The first responder
+    # invokes the second responder asynchronously; here it's called
+    # directly, so its time counts toward the command. (In its own thread,
+    # like its own Lambda container: the second responder runs an event
+    # loop and can invoke itself.)
+
+    def __init__(self):
+        # Function name -> handler
+        self.handlers = {}
+
+    def invoke(self, FunctionName, InvocationType, Payload, **kwargs):
+        invocation = Thread(
+            target=self.handlers[FunctionName],
+            args=(json.loads(Payload), FakeContext(FunctionName)))
+        invocation.start()
+        invocation.join()
+        return {'StatusCode': 202}
+
+
+def create_table(table_name):
+    # The same keys and indexes as DelaySayTable in template.yaml
+    import boto3
+    boto3.client('dynamodb').create_table(
+        TableName=table_name,
+        KeySchema=[
+            {'AttributeName': "PK", 'KeyType': "HASH"},
+            {'AttributeName': "SK", 'KeyType': "RANGE"}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': "PK", 'AttributeType': "S"},
+            {'AttributeName': "SK", 'AttributeType': "S"},
+            {'AttributeName': "GSI1PK", 'AttributeType': "S"},
+            {'AttributeName': "GSI1SK", 'AttributeType': "S"},
+            {'AttributeName': "GSI2PK", 'AttributeType': "S"},
+            {'AttributeName': "GSI2SK", 'AttributeType': "S"}
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': "GSI1",
+                'KeySchema': [
+                    {'AttributeName': "GSI1PK", 'KeyType': "HASH"},
+                    {'AttributeName': "GSI1SK", 'KeyType': "RANGE"}
+                ],
+                'Projection': {
+                    'ProjectionType': "INCLUDE",
+                    'NonKeyAttributes': ["user_id", "billing_role"]
+                }
+            },
+            {
+                'IndexName': "GSI2",
+                'KeySchema': [
+                    {'AttributeName': "GSI2PK", 'KeyType': "HASH"},
+                    {'AttributeName': "GSI2SK", 'KeyType': "RANGE"}
+                ],
+                'Projection': {
+                    'ProjectionType': "INCLUDE",
+                    'NonKeyAttributes': ["team_id"]
+                }
+            }
+        ],
+        BillingMode="PAY_PER_REQUEST"
+    )
+
+
+def set_up_aws():
+    # Must run inside moto's mock_aws(). Returns the environment variables
+    # that the Lambda functions read when they're imported.
+    import boto3
+    table_name = "DelaySayLoadTest"
+    create_table(table_name)
+    ssm = boto3.client('ssm')
+    parameters = {
+        '/delaysay/slack/signing-secret': SLACK_SIGNING_SECRET,
+        '/delaysay/slack/client-id': "load-test-client-id",
+        '/delaysay/slack/client-secret': "load-test-client-secret",
+        '/delaysay/stripe/checkout-signing-secret': STRIPE_SIGNING_SECRET,
+        '/delaysay/stripe/testing-checkout-signing-secret': STRIPE_SIGNING_SECRET,
+        '/delaysay/stripe/api-key': "sk_live_loadtest",
+        '/delaysay/stripe/testing-api-key': "sk_test_loadtest",
+        '/delaysay/billing/token-signing-secret': "load-test-billing-secret"
+    }
+    for name, value in parameters.items():
+        ssm.put_parameter(Name=name, Value=value, Type="SecureString")
+    key = boto3.client('kms').create_key(Description="DelaySay load test")
+    return {
+        'AUTH_TABLE_NAME': table_name,
+        'KMS_MASTER_KEY_ARN': key['KeyMetadata']['Arn'],
+        'SLACK_SIGNING_SECRET_SSM_NAME': "/delaysay/slack/signing-secret",
+        'SLACK_CLIENT_ID_SSM_NAME': "/delaysay/slack/client-id",
+        'SLACK_CLIENT_SECRET_SSM_NAME': "/delaysay/slack/client-secret",
+        'STRIPE_CHECKOUT_SIGNING_SECRET_SSM_NAME':
+            "/delaysay/stripe/checkout-signing-secret",
+        'STRIPE_TESTING_CHECKOUT_SIGNING_SECRET_SSM_NAME':
+            "/delaysay/stripe/testing-checkout-signing-secret",
+        'STRIPE_API_KEY_SSM_NAME': "/delaysay/stripe/api-key",
+        'STRIPE_TESTING_API_KEY_SSM_NAME': "/delaysay/stripe/testing-api-key",
+        'BILLING_TOKEN_SIGNING_SECRET_SSM_NAME':
+            "/delaysay/billing/token-signing-secret",
+        'SECOND_RESPONDER_FUNCTION': "DelaySaySecondResponderFunction",
+        'SLASH_COMMAND': "/delay",
+        'SLASH_COMMAND_LINKS_DOMAIN': LINKS_DOMAIN,
+        'CONTACT_PAGE': "https://delaysay.test/contact/",
+        'SUPPORT_EMAIL': "team@delaysay.test",
+        'SUBSCRIBE_URL': "https://delaysay.test/subscribe",
+        'REDIRECT_URL_AFTER_PORTAL': "https://delaysay.test/",
+        'BILLING_PORTAL_FAIL_URL': BILLING_PORTAL_FAIL_URL,
+        'INSTALL_SUCCESS_URL': INSTALL_SUCCESS_URL,
+        'INSTALL_CANCEL_URL': "https://delaysay.test/add-canceled/",
+        'INSTALL_FAIL_URL': "https://delaysay.test/add-failed/",
+        'SLACK_OAUTH_URL': "https://slack.com/oauth/v2/authorize?client_id=x"
+    }
+
+
+def redirect_requests_to(base_url):
+    # Every function calls slack.com through requests, so send those
+    # calls to the fake services instead.
+    import requests
+    original_request = requests.sessions.Session.request
+    def request(self, method, url, *args, **kwargs):
+        for prefix in ["https://slack.com", "https://www.slack.com"]:
+            if url.startswith(prefix):
+                url = base_url + url[len(prefix):]
+        return original_request(self, method, url, *args, **kwargs)
+    requests.sessions.Session.request = request
+
+
+def forget_delaysay_modules():
+    # The layers read their settings (table name, KMS key) when they're
+    # first imported, so a new harness needs fresh copies of them.
+    for name, module in list(sys.modules.items()):
+        path = os.path.realpath(getattr(module, "__file__", None) or "")
+        if path.startswith(os.path.join(ROOT, "code-")):
+            del sys.modules[name]
+
+
+def load_function(directory):
+    # Each function's handler is in its own app.py, so import each one
+    # under a name of its own.
+    path = os.path.join(ROOT, directory)
+    sys.path.insert(1, path)
+    spec = spec_from_file_location(
+        directory.replace("-", "_") + "_app", os.path.join(path, "app.py"))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class RemoteCallCounter:
+    # Takes the place of metrics.emit_metrics(), so the totals from each
+    # invocation are added up here instead of being printed.
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.counts = Counter()
+
+    def __call__(self, function_name, invocation_duration):
+        self.counts.update(self.metrics.counts)
+        self.metrics.durations.clear()
+        self.metrics.counts.clear()
+        self.metrics.is_cold_start = False
+
+    def take(self):
+        counts = self.counts
+        self.counts = Counter()
+        return counts
+
+
+class LoadHarness:
+
+    def __init__(self, base_url, state, seed):
+        forget_delaysay_modules()
+        import stripe
+        import metrics
+        stripe.api_base = base_url
+        redirect_requests_to(base_url)
+        self.base_url = base_url
+        self.state = state
+        self.random = Random(seed)
+        self.request_timestamp = int(time())
+        self.remote_calls = RemoteCallCounter(metrics)
+        metrics.emit_metrics = self.remote_calls
+        import aws_clients
+        lambda_client = FakeLambdaClient()
+        for config in [aws_clients.CONFIG, aws_clients.HOT_PATH_CONFIG]:
+            aws_clients.clients[('lambda', config)] = lambda_client
+        self.second_responder = load_function(
+            "code-slack-slash-command-second-responder")
+        from slack_sdk import WebClient as slack_WebClient
+        self.second_responder.slack_WebClient = partial(
+            slack_WebClient, base_url=base_url + "/api/")
+        self.first_responder = load_function(
+            "code-slack-slash-command-first-responder")
+        # Also how long imports invoke the second responder to continue
+        lambda_client.handlers["DelaySaySecondResponderFunction"] = (
+            self.second_responder.lambda_handler_with_catch_all)
+        self.user_authorization = load_function("code-slack-user-authorization")
+        self.stripe_webhook = load_function("code-stripe-checkout-webhook")
+        self.billing_redirect = load_function(
+            "code-redirect-stripe-customer-portal")
+        self.reconciler = load_function("code-scheduled-message-reconciler")
+        self.slack_events = load_function("code-slack-events")
+        self.interactivity = load_function("code-slack-interactivity")
+        lambda_client.handlers["DelaySayScheduledMessageReconcilerFunction"] = (
+            self.reconciler.lambda_handler)
+        self.users = []
+        # Everything posted to the last command's response_url, blocks
+        # and all
+        self.last_response_payloads = []
+        self.latencies = defaultdict(list)
+        self.calls = defaultdict(Counter)
+        self.errors = Counter()
+
+    def _record(self, command_type, start):
+        self.latencies[command_type].append((perf_counter() - start) * 1000)
+        self.calls[command_type].update(self.remote_calls.take())
+
+    def install(self, teams, users_per_team, paid_fraction,
+                enterprise_id=None):
+        # With an enterprise_id, every team is a workspace in that
+        # Enterprise Grid org.
+        for t in range(teams):
+            team_id = f"T{t:06d}"
+            for u in range(users_per_team):
+                user_id = f"U{t:06d}{u:03d}"
+                code = self.state.add_user(
+                    user_id, team_id, f"Load Test Team {t}", is_admin=(u == 0),
+                    enterprise_id=enterprise_id)
+                start = perf_counter()
+                response = self.user_authorization.lambda_handler_with_catch_all(
+                    {'queryStringParameters': {'code': code}},
+                    FakeContext("DelaySayUserAuthorizationFunction"))
+                self._record("oauth", start)
+                if response['headers']['Location'] != INSTALL_SUCCESS_URL:
+                    self.errors["oauth"] += 1
+                self.users.append((team_id, user_id))
+            if self.random.random() < paid_fraction:
+                self.subscribe(team_id)
+    
+    def install_org(self, enterprise_id, teams, user_id="UORGADMIN"):
+        # An org admin installs DelaySay for the org's first `teams`
+        # workspaces at once (the same team ids install() uses).
+        code = self.state.add_enterprise_install(
+            user_id, enterprise_id,
+            [(f"T{t:06d}", f"Load Test Team {t}") for t in range(teams)])
+        start = perf_counter()
+        response = self.user_authorization.lambda_handler_with_catch_all(
+            {'queryStringParameters': {'code': code}},
+            FakeContext("DelaySayUserAuthorizationFunction"))
+        self._record("oauth org", start)
+        if response['headers']['Location'] != INSTALL_SUCCESS_URL:
+            self.errors["oauth org"] += 1
+        return response['headers']['Location'] == INSTALL_SUCCESS_URL
+    
+    def reconcile(self):
+        # What the hourly schedule does: one invocation per segment
+        start = perf_counter()
+        self.reconciler.lambda_handler(
+            {}, FakeContext("DelaySayScheduledMessageReconcilerFunction"))
+        self._record("reconcile", start)
+
+    def subscribe(self, team_id, subscription_id=None,
+                  subscription_event=True):
+        # Pass a subscription_id again to resend its checkout event, like
+        # Stripe does when it retries. Stripe follows the checkout with
+        # the subscription's own events; pass subscription_event=False to
+        # leave those out.
+        if not subscription_id:
+            subscription_id = "sub_" + uuid4().hex[:14]
+            self.state.add_subscription(subscription_id, "cus_" + team_id)
+        self.send_stripe_event("checkout.session.completed", {
+            'object': "checkout.session",
+            'created': int(time()),
+            'payment_status': "paid",
+            'client_reference_id': team_id,
+            'subscription': subscription_id
+        })
+        if subscription_event:
+            self.send_stripe_event(
+                "customer.subscription.created",
+                self.state.subscriptions[subscription_id])
+        return subscription_id
+
+    def send_stripe_event(self, event_type, stripe_object):
+        payload = json.dumps({
+            'livemode': True,
+            'type': event_type,
+            'data': {
+                'object': stripe_object
+            }
+        })
+        timestamp = str(int(time()))
+        signature = hmac_new(
+            STRIPE_SIGNING_SECRET.encode(),
+            (timestamp + "." + payload).encode(), sha256).hexdigest()
+        start = perf_counter()
+        response = self.stripe_webhook.lambda_handler_with_catch_all(
+            {
+                'headers': {'Stripe-Signature': f"t={timestamp},v1={signature}"},
+                'body': payload
+            },
+            FakeContext("DelaySayStripeCheckoutWebhookFunction"))
+        self._record("stripe webhook", start)
+        if response['statusCode'] != "200":
+            self.errors["stripe webhook"] += 1
+        return response
+
+    def slash_command(self, command_type, team_id, user_id, channel_id, text,
+                      enterprise_id=None):
+        # Every request gets its own timestamp, like real Slack requests
+        # would, so the replay cache and idempotency records don't treat
+        # two identical commands as one.
+        self.request_timestamp += 1
+        timestamp = str(self.request_timestamp)
+        response_id = uuid4().hex
+        enterprise = {'enterprise_id': enterprise_id} if enterprise_id else {}
+        body = urlencode({
+            'token': "deprecated",
+            'team_id': team_id,
+            'team_domain': "loadtest-" + team_id.lower(),
+            'channel_id': channel_id,
+            'channel_name': "general",
+            'user_id': user_id,
+            'user_name': "user-" + user_id.lower(),
+            'command': "/delay",
+            'text': text,
+            'response_url': f"{self.base_url}/response/{response_id}",
+            'trigger_id': uuid4().hex,
+            **enterprise
+        })
+        signature = "v0=" + hmac_new(
+            SLACK_SIGNING_SECRET.encode(),
+            f"v0:{timestamp}:{body}".encode(), sha256).hexdigest()
+        start = perf_counter()
+        self.first_responder.lambda_handler_with_catch_all(
+            {
+                'body': body,
+                'headers': {
+                    'X-Slack-Request-Timestamp': timestamp,
+                    'X-Slack-Signature': signature
+                },
+                'multiValueHeaders': {
+                    'X-Slack-Request-Timestamp': [timestamp]
+                }
+            },
+            FakeContext("DelaySayFirstResponderFunction"))
+        self._record(command_type, start)
+        responses = self.state.pop_responses(response_id)
+        self.last_response_payloads = self.state.pop_response_payloads(
+            response_id)
+        if not responses or any(ERROR_TEXT in text for text in responses):
+            self.errors[command_type] += 1
+        return responses
+
+    def _interact(self, interaction_type, team_id, user_id, payload):
+        # Sends an interactivity request, signed like Slack would. Returns
+        # the function's response and what was posted to the request's
+        # response_url.
+        self.request_timestamp += 1
+        timestamp = str(self.request_timestamp)
+        response_id = uuid4().hex
+        body = urlencode({
+            'payload': json.dumps({
+                'type': interaction_type,
+                'team': {
+                    'id': team_id,
+                    'domain': "loadtest-" + team_id.lower()
+                },
+                'user': {'id': user_id},
+                'response_url': f"{self.base_url}/response/{response_id}",
+                'trigger_id': uuid4().hex,
+                **payload
+            })
+        })
+        signature = "v0=" + hmac_new(
+            SLACK_SIGNING_SECRET.encode(),
+            f"v0:{timestamp}:{body}".encode(), sha256).hexdigest()
+        start = perf_counter()
+        response = self.interactivity.lambda_handler_with_catch_all(
+            {
+                'body': body,
+                'headers': {
+                    'X-Slack-Request-Timestamp': timestamp,
+                    'X-Slack-Signature': signature
+                }
+            },
+            FakeContext("DelaySayInteractivityFunction"))
+        self._record(interaction_type, start)
+        if response['statusCode'] != "200":
+            self.errors[interaction_type] += 1
+        self.last_response_payloads = self.state.pop_response_payloads(
+            response_id)
+        return response, self.state.pop_responses(response_id)
+
+    def block_action(self, team_id, user_id, channel_id, action,
+                     state_values=None):
+        # Like a button click on one of DelaySay's responses. Returns what
+        # was posted to its response_url.
+        _, responses = self._interact("block_actions", team_id, user_id, {
+            'channel': {'id': channel_id},
+            'actions': [action],
+            'state': {'values': state_values or {}}
+        })
+        return responses
+
+    def shortcut(self, team_id, user_id, callback_id, channel_id=None,
+                 message_text=None):
+        # The global shortcut, or with a channel and message, the message
+        # shortcut. Returns the view it opened, if any.
+        if channel_id:
+            payload = {
+                'callback_id': callback_id,
+                'channel': {'id': channel_id},
+                'message': {'type': "message", 'text': message_text}
+            }
+            self._interact("message_action", team_id, user_id, payload)
+        else:
+            self._interact(
+                "shortcut", team_id, user_id, {'callback_id': callback_id})
+        views = [view for view in self.state.views
+                 if view['user_id'] == user_id]
+        return views[-1]['view'] if views else None
+
+    def view_submission(self, team_id, user_id, view, state_values,
+                        channel_id):
+        # Submits a modal. Returns the function's response body and what
+        # was posted to the response_url for the picked channel.
+        response_id = uuid4().hex
+        response, _ = self._interact("view_submission", team_id, user_id, {
+            'view': {**view, 'state': {'values': state_values}},
+            'response_urls': [{
+                'block_id': "channel",
+                'action_id': "channel",
+                'channel_id': channel_id,
+                'response_url': f"{self.base_url}/response/{response_id}"
+            }]
+        })
+        self.last_response_payloads = self.state.pop_response_payloads(
+            response_id)
+        return response['body'], self.state.pop_responses(response_id)
+
+    def slack_event(self, team_id, event, enterprise_id=None):
+        # Sends an Events API event_callback, signed like Slack would.
+        # Pass team_id=None with an enterprise_id for an event about an
+        # org-wide install.
+        timestamp = str(int(time()))
+        body = json.dumps({
+            'type': "event_callback",
+            'team_id': team_id,
+            'enterprise_id': enterprise_id,
+            'is_enterprise_install': bool(enterprise_id and not team_id),
+            'event_id': "Ev" + uuid4().hex,
+            'event': event
+        })
+        signature = "v0=" + hmac_new(
+            SLACK_SIGNING_SECRET.encode(),
+            f"v0:{timestamp}:{body}".encode(), sha256).hexdigest()
+        return self.slack_events.lambda_handler_with_catch_all(
+            {
+                'body': body,
+                'headers': {
+                    'X-Slack-Request-Timestamp': timestamp,
+                    'X-Slack-Signature': signature
+                }
+            },
+            FakeContext("DelaySaySlackEventsFunction"))
+
+    def upload_import_file(self, user_id, i, rows=IMPORT_FILE_ROWS):
+        # Returns a link to a CSV file of messages, as if the user had
+        # uploaded it to Slack.
+        content = "channel,time,message\n" + "".join(
+            f"C{row % 3},{self.random.randrange(1, 48)} hours,"
+            f"\"Load test import {i}, row {row}\"\n"
+            for row in range(rows))
+        file_id = self.state.add_file(f"import-{i}.csv", "csv", content)
+        return f"<https://loadtest.slack.com/files/{user_id}/{file_id}/import-{i}.csv>"
+
+    def billing_redirect_for(self, responses):
+        match = None
+        for text in responses:
+            match = re.search(re.escape(LINKS_DOMAIN) + r"/billing/\?token=(\S+)", text)
+            if match:
+                break
+        if not match:
+            return
+        start = perf_counter()
+        response = self.billing_redirect.lambda_handler_with_catch_all(
+            {'queryStringParameters': {'token': match.group(1)}},
+            FakeContext("DelaySayBillingRedirectFunction"))
+        self._record("billing redirect", start)
+        if response['headers']['Location'] == BILLING_PORTAL_FAIL_URL:
+            self.errors["billing redirect"] += 1
+
+    def replay(self, total_requests, mix):
+        command_types = list(mix)
+        weights = [mix[command_type] for command_type in command_types]
+        for i in range(total_requests):
+            command_type = self.random.choices(command_types, weights)[0]
+            team_id, user_id = self.random.choice(self.users)
+            channel_id = "C" + str(self.random.randrange(3))
+            if command_type == "schedule":
+                text = (
+                    f"{self.random.randrange(1, 48)} hours say"
+                    f" Load test message {i} :wave:")
+            elif command_type == "multichannel":
+                text = (
+                    f"{self.random.randrange(1, 48)} hours in"
+                    " <#C0|general> <#C1|random> <#C2|ops> say"
+                    f" Load test notice {i} :mega:")
+            elif command_type == "import":
+                text = "import " + self.upload_import_file(user_id, i)
+            elif command_type == "list":
+                text = "list"
+            elif command_type == "delete":
+                text = "delete 1"
+            elif command_type == "billing":
+                text = "billing"
+            else:
+                raise Exception(f"Unknown command type: {command_type}")
+            responses = self.slash_command(
+                command_type, team_id, user_id, channel_id, text)
+            if command_type == "billing":
+                self.billing_redirect_for(responses)
+
+    def report(self):
+        results = {}
+        for command_type, latencies in self.latencies.items():
+            if len(latencies) > 1:
+                percentiles = quantiles(latencies, n=100, method="inclusive")
+                p50, p95, p99 = percentiles[49], percentiles[94], percentiles[98]
+            else:
+                p50 = p95 = p99 = latencies[0]
+            count = len(latencies)
+            results[command_type] = {
+                'count': count,
+                'errors': self.errors[command_type],
+                'mean_ms': round(mean(latencies), 3),
+                'p50_ms': round(p50, 3),
+                'p95_ms': round(p95, 3),
+                'p99_ms': round(p99, 3),
+                'remote_calls_per_request': {
+                    dependency: round(calls / count, 3)
+                    for dependency, calls
+                    in sorted(self.calls[command_type].items())}
+            }
+        return {
+            'commands': results,
+            'fake_service_calls': dict(sorted(self.state.calls.items()))
+        }
+
+
+def print_report(report):
+    print(
+        f"{'command':<18} {'count':>6} {'errors':>6}"
+        f" {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  remote calls/request")
+    for command_type, result in report['commands'].items():
+        calls = ", ".join(
+            f"{dependency} {calls:g}"
+            for dependency, calls
+            in result['remote_calls_per_request'].items())
+        print(
+            f"{command_type:<18} {result['count']:>6} {result['errors']:>6}"
+            f" {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f}"
+            f" {result['p99_ms']:>9.2f}  {calls}")
+
+
+def parse_mix(mix):
+    weights = {}
+    for entry in mix.split(","):
+        command_type, weight = entry.split("=")
+        weights[command_type.strip()] = float(weight)
+    return weights
+
+
+@contextmanager
+def added_latency(latency_ms):
+    # Makes every fake service and AWS call take at least latency_ms.
+    import fake_services
+    from botocore.client import BaseClient
+    from time import sleep
+    make_api_call = BaseClient._make_api_call
+    def slow_make_api_call(self, *args, **kwargs):
+        sleep(latency_ms / 1000)
+        return make_api_call(self, *args, **kwargs)
+    fake_services.FAKE_LATENCY_IN_SECONDS = latency_ms / 1000
+    BaseClient._make_api_call = slow_make_api_call
+    try:
+        yield
+    finally:
+        BaseClient._make_api_call = make_api_call
+        fake_services.FAKE_LATENCY_IN_SECONDS = 0
+
+
+@contextmanager
+def running_harness(seed=0, verbose=False):
+    os.environ['AWS_DEFAULT_REGION'] = "us-east-1"
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', "testing")
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "testing")
+    os.environ['DELAYSAY_METRICS'] = "true"
+    from moto import mock_aws
+    base_url, state, server = start_fake_services()
+    # The functions print a banner (and any errors) for every request.
+    output = nullcontext() if verbose else redirect_stdout(StringIO())
+    try:
+        with mock_aws(), output:
+            os.environ.update(set_up_aws())
+            yield LoadHarness(base_url, state, seed)
+    finally:
+        server.shutdown()
+
+
+def run(total_requests=200, mix=DEFAULT_MIX, teams=5, users_per_team=4,
+        paid_fraction=0.5, seed=0, verbose=False, latency_ms=0,
+        prefetch=True):
+    with running_harness(seed, verbose) as harness:
+        harness.install(teams, users_per_team, paid_fraction)
+        if not prefetch:
+            harness.second_responder.PREFETCH_BY_FUNCTION = {}
+        with added_latency(latency_ms):
+            harness.replay(total_requests, parse_mix(mix))
+        return harness.report()
+
+
+def main():
+    parser = ArgumentParser(description="DelaySay local load test")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--teams", type=int, default=5)
+    parser.add_argument("--users-per-team", type=int, default=4)
+    parser.add_argument("--paid-fraction", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--latency-ms", type=float, default=0,
+        help="Add this much latency to every fake service and AWS call")
+    parser.add_argument(
+        "--no-prefetch", action="store_true",
+        help="Have the second responder load everything one at a time")
+    parser.add_argument(
+        "--json", help="Also write the results to this file as JSON")
+    parser.add_argument(
+        "--verbose", action="store_true",
+        help="Show what the Lambda functions print")
+    args = parser.parse_args()
+    report = run(
+        total_requests=args.requests, mix=args.mix, teams=args.teams,
+        users_per_team=args.users_per_team, paid_fraction=args.paid_fraction,
+        seed=args.seed, verbose=args.verbose, latency_ms=args.latency_ms,
+        prefetch=not args.no_prefetch)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if any(result['errors'] for result in report['commands'].values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
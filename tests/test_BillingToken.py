@@ -0,0 +1,162 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-billing-token')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-dynamodb')
+
+import unittest
+from importlib.util import find_spec
+from datetime import datetime, timedelta, timezone
+from DelaySayExceptions import BillingTokenInvalidError
+
+@unittest.skipUnless(find_spec("moto"), "these tests need moto")
+class BillingTokenTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from moto import mock_aws
+        os.environ['AWS_DEFAULT_REGION'] = "us-east-1"
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', "testing")
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "testing")
+        os.environ['AUTH_TABLE_NAME'] = "delaysay-test"
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        boto3.client("dynamodb").create_table(
+            TableName="delaysay-test",
+            KeySchema=[
+                {'AttributeName': "PK", 'KeyType': "HASH"},
+                {'AttributeName': "SK", 'KeyType': "RANGE"}],
+            AttributeDefinitions=[
+                {'AttributeName': "PK", 'AttributeType': "S"},
+                {'AttributeName': "SK", 'AttributeType': "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        sys.modules.pop("dynamodb", None)
+        import BillingToken
+        self.module = BillingToken
+        # Instead of reading the signing secret from SSM
+        BillingToken.BillingToken.SETUP_DONE = True
+        BillingToken.BillingToken.SIGNING_KEY = b"test signing secret"
+        self.now = datetime.now(timezone.utc)
+        self.token = BillingToken.generate_signed_token(
+            self.now, timedelta(minutes=30), "T1", "U1")
+
+    def tearDown(self):
+        self.mock.stop()
+        os.environ.pop('BILLING_TOKEN_SINGLE_USE', None)
+        self.module.BillingToken.SETUP_DONE = False
+        self.module.BillingToken.SIGNING_KEY = None
+        # So other tests import dynamodb with their own table name
+        sys.modules.pop("dynamodb", None)
+
+    def sign(self, payload_text):
+        # A payload with a valid signature, as if the secret had leaked
+        payload = self.module._encode(payload_text.encode())
+        signature = self.module._encode(self.module._sign(payload))
+        return payload + "." + signature
+
+    def assertInvalid(self, token):
+        with self.assertRaises(BillingTokenInvalidError):
+            billing_token = self.module.BillingToken(token)
+            # Tokens without a signature are looked up in DynamoDB.
+            billing_token.has_expired()
+
+    def test_round_trip(self):
+        billing_token = self.module.BillingToken(self.token)
+        self.assertTrue(billing_token.is_signed())
+        self.assertEqual(billing_token.get_team_id(), "T1")
+        self.assertEqual(billing_token.table_entry['user_id'], "U1")
+        self.assertFalse(billing_token.has_expired())
+        self.assertEqual(len(billing_token.nonce), 16)
+        # Two tokens for the same user at once are still different.
+        self.assertNotEqual(
+            self.token,
+            self.module.generate_signed_token(
+                self.now, timedelta(minutes=30), "T1", "U1"))
+
+    def test_portal_session_flag(self):
+        self.assertFalse(
+            self.module.BillingToken(self.token)
+            .may_have_prepared_portal_session())
+        prepared_token = self.module.generate_signed_token(
+            self.now, timedelta(minutes=30), "T1", "U1",
+            portal_session_prepared=True)
+        self.assertTrue(
+            self.module.BillingToken(prepared_token)
+            .may_have_prepared_portal_session())
+        # Tokens from before the flag still work, and might have one.
+        expiration = int((self.now + timedelta(minutes=30)).timestamp())
+        older_token = self.sign(f"T1:U1:{expiration}:0123456789abcdef")
+        billing_token = self.module.BillingToken(older_token)
+        self.assertEqual(billing_token.get_team_id(), "T1")
+        self.assertTrue(billing_token.may_have_prepared_portal_session())
+
+    def test_tampered_payload(self):
+        payload, _, signature = self.token.partition(".")
+        team_id, user_id, expiration, nonce, prepared = (
+            self.module._decode(payload).decode().split(":"))
+        tampered_payload = self.module._encode(
+            f"T2:{user_id}:{expiration}:{nonce}:{prepared}".encode())
+        self.assertInvalid(tampered_payload + "." + signature)
+        later_payload = self.module._encode(
+            f"{team_id}:{user_id}:{int(expiration) + 86400}:{nonce}"
+            f":{prepared}".encode())
+        self.assertInvalid(later_payload + "." + signature)
+
+    def test_tampered_signature(self):
+        payload, _, signature = self.token.partition(".")
+        flipped = ("A" if signature[0] != "A" else "B") + signature[1:]
+        self.assertInvalid(payload + "." + flipped)
+        self.assertInvalid(payload + "." + signature[:-2])
+        self.assertInvalid(payload + ".")
+        # Signed with another secret
+        self.module.BillingToken.SIGNING_KEY = b"another secret"
+        self.assertInvalid(self.token)
+
+    def test_expired_token(self):
+        token = self.module.generate_signed_token(
+            self.now - timedelta(hours=1), timedelta(minutes=30), "T1", "U1")
+        self.assertTrue(self.module.BillingToken(token).has_expired())
+
+    def test_malformed_tokens(self):
+        # No dot, so it's looked up as an older token that doesn't exist
+        self.assertInvalid(self.token.replace(".", ""))
+        self.assertInvalid("")
+        # Not base64
+        self.assertInvalid("%%%." + self.token.partition(".")[2])
+        self.assertInvalid(self.token.partition(".")[0] + ".a")
+        # Signed, but the payload isn't base64
+        self.assertInvalid(
+            "a." + self.module._encode(self.module._sign("a")))
+        # Wrong number of fields, or an expiration that isn't a number
+        self.assertInvalid(self.sign("T1:U1:12345"))
+        self.assertInvalid(self.sign("T1:U1:12345:nonce:1:extra"))
+        self.assertInvalid(self.sign("T1:U1:12345:nonce:maybe"))
+        self.assertInvalid(self.sign("T1:U1:soon:nonce:0"))
+        # Not UTF-8
+        payload = self.module._encode(b"\xff\xfe")
+        self.assertInvalid(
+            payload + "." + self.module._encode(self.module._sign(payload)))
+
+    def test_single_use(self):
+        os.environ['BILLING_TOKEN_SINGLE_USE'] = "true"
+        self.module.BillingToken(self.token).mark_as_used()
+        with self.assertRaises(BillingTokenInvalidError):
+            self.module.BillingToken(self.token).mark_as_used()
+        # Another token for the same user still works once.
+        other_token = self.module.generate_signed_token(
+            self.now, timedelta(minutes=30), "T1", "U1")
+        self.module.BillingToken(other_token).mark_as_used()
+
+    def test_reusable_unless_single_use(self):
+        for i in range(2):
+            self.module.BillingToken(self.token).mark_as_used()
+
+if __name__ == '__main__':
+    unittest.main()
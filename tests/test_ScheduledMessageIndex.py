@@ -0,0 +1,87 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-user')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-dynamodb')
+
+import unittest
+from importlib.util import find_spec
+from time import time
+
+@unittest.skipUnless(find_spec("moto"), "these tests need moto")
+class ScheduledMessageIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from moto import mock_aws
+        os.environ['AWS_DEFAULT_REGION'] = "us-east-1"
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', "testing")
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "testing")
+        os.environ['AUTH_TABLE_NAME'] = "delaysay-test"
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        boto3.client("dynamodb").create_table(
+            TableName="delaysay-test",
+            KeySchema=[
+                {'AttributeName': "PK", 'KeyType': "HASH"},
+                {'AttributeName': "SK", 'KeyType': "RANGE"}],
+            AttributeDefinitions=[
+                {'AttributeName': "PK", 'AttributeType': "S"},
+                {'AttributeName': "SK", 'AttributeType': "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        sys.modules.pop("dynamodb", None)
+        from ScheduledMessageIndex import ScheduledMessageIndex
+        self.index = ScheduledMessageIndex("U1")
+        self.now = int(time())
+
+    def tearDown(self):
+        self.mock.stop()
+        # So other tests import dynamodb with their own table name
+        sys.modules.pop("dynamodb", None)
+        sys.modules.pop("ScheduledMessageIndex", None)
+
+    def test_pages_are_sorted_by_post_at(self):
+        self.index.add_many([
+            (f"Q{i}", f"C{i % 2}", self.now + 1000 - i, "Hi") for i in range(5)])
+        # Already sent, so not listed
+        self.index.add("QOLD", "C0", self.now - 60, "Hi")
+        entries, last_evaluated_key = self.index.get_page(3)
+        self.assertEqual(
+            [entry['scheduled_message_id'] for entry in entries],
+            ["Q4", "Q3", "Q2"])
+        entries, last_evaluated_key = self.index.get_page(3, last_evaluated_key)
+        self.assertEqual(
+            [entry['scheduled_message_id'] for entry in entries], ["Q1", "Q0"])
+        self.assertIsNone(last_evaluated_key)
+        self.assertEqual(
+            [entry['scheduled_message_id'] for entry in self.index.get_all("C1")],
+            ["Q3", "Q1"])
+
+    def test_reconcile(self):
+        self.index.add("Q1", "C1", self.now + 100, "Kept")
+        self.index.add("Q2", "C1", self.now + 200, "Gone")
+        self.index.add("Q3", "C1", self.now + 300, "Old text")
+        self.index.add("Q9", "C9", self.now + 300, "Other channel")
+        added, removed = self.index.reconcile([
+            {'id': "Q1", 'channel_id': "C1", 'post_at': self.now + 100, 'text': "Kept"},
+            {'id': "Q3", 'channel_id': "C1", 'post_at': self.now + 400, 'text': "New text"},
+            {'id': "Q4", 'channel_id': "C1", 'post_at': self.now + 50, 'text': "New"},
+        ], "C1")
+        self.assertEqual((added, removed), (2, 1))
+        self.assertEqual(
+            [(entry['scheduled_message_id'], entry['post_at'])
+             for entry in self.index.get_all()],
+            [("Q4", self.now + 50), ("Q1", self.now + 100),
+             ("Q9", self.now + 300), ("Q3", self.now + 400)])
+        self.index.remove("Q3", self.now + 400)
+        self.assertEqual(len(self.index.get_all()), 3)
+
+if __name__ == '__main__':
+    unittest.main()
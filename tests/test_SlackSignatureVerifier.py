@@ -0,0 +1,74 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+import unittest
+from hmac import new as hmac_new
+from hashlib import sha256 as hashlib_sha256
+from time import time
+from SlackSignatureVerifier import SlackSignatureVerifier
+from DelaySayExceptions import (
+    SlackSignaturesDoNotMatchError, SlackSignatureTimeToleranceExceededError,
+    SlackSignatureReplayedError)
+
+def sign(secret, timestamp, body):
+    basestring = "v0:" + timestamp + ":" + body
+    hash = hmac_new(secret.encode(), basestring.encode(), hashlib_sha256)
+    return "v0=" + hash.hexdigest()
+
+class SlackSignatureVerifierTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.secret = "8f742231b10e8888abcd99yyyzzz85a5"
+        self.verifier = SlackSignatureVerifier(self.secret)
+        self.body = "token=abc&team_id=T1&user_id=U1&command=%2Fdelay&text=list"
+
+    def test_valid_signature(self):
+        timestamp = str(int(time()))
+        signature = sign(self.secret, timestamp, self.body)
+        self.verifier.verify(timestamp, signature, self.body)
+        # The raw bytes of the body give the same result.
+        timestamp = str(int(time()) - 1)
+        signature = sign(self.secret, timestamp, self.body)
+        self.verifier.verify(timestamp, signature, self.body.encode())
+
+    def test_invalid_signature(self):
+        timestamp = str(int(time()))
+        signature = sign("wrong secret", timestamp, self.body)
+        with self.assertRaises(SlackSignaturesDoNotMatchError):
+            self.verifier.verify(timestamp, signature, self.body)
+        with self.assertRaises(SlackSignaturesDoNotMatchError):
+            self.verifier.verify(timestamp, None, self.body)
+
+    def test_stale_timestamp(self):
+        timestamp = str(int(time()) - 60 * 60)
+        signature = sign(self.secret, timestamp, self.body)
+        with self.assertRaises(SlackSignatureTimeToleranceExceededError):
+            self.verifier.verify(timestamp, signature, self.body)
+        # Stale requests are rejected before the signature is checked.
+        with self.assertRaises(SlackSignatureTimeToleranceExceededError):
+            self.verifier.verify(timestamp, "v0=bogus", self.body)
+
+    def test_replayed_signature(self):
+        timestamp = str(int(time()))
+        signature = sign(self.secret, timestamp, self.body)
+        self.verifier.verify(timestamp, signature, self.body)
+        with self.assertRaises(SlackSignatureReplayedError):
+            self.verifier.verify(timestamp, signature, self.body)
+
+    def test_replay_cache_is_bounded(self):
+        verifier = SlackSignatureVerifier(self.secret, replay_cache_size=2)
+        timestamp = str(int(time()))
+        bodies = ["text=1", "text=2", "text=3"]
+        for body in bodies:
+            verifier.verify(timestamp, sign(self.secret, timestamp, body), body)
+        self.assertEqual(len(verifier.seen_signatures), 2)
+        # The oldest signature was forgotten, so it's accepted again.
+        verifier.verify(
+            timestamp, sign(self.secret, timestamp, bodies[0]), bodies[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ sys.path.insert(
 
 import unittest
 from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
 from SlashCommandParser import SlashCommandParser
 from DelaySayExceptions import CommandParseError, TimeParseError
 
@@ -287,6 +288,48 @@ class SlashCommandParserTestCase(unittest.TestCase):
         p = SlashCommandParser("2019-09-01T14:35:30Z say Humbug", initial_time)
         self.assertEqual(p.get_time(), final_datetime)
 
+    def test_daylight_saving_time(self):
+        # Users' IANA time zones, unlike fixed offsets, follow the clocks.
+        new_york = ZoneInfo("America/New_York")
+        # Saturday, November 2, 2019, 10am EDT (UTC-4)
+        initial_time = datetime(2019, 11, 2, 10, 0, 0, tzinfo=new_york)
+
+        # After the clocks go back, 9am is EST (UTC-5)
+        final_datetime = datetime(2019, 11, 4, 14, 0, 0, tzinfo=timezone.utc)
+        p = SlashCommandParser("2019-11-04 9:00 say Humbug", initial_time)
+        self.assertEqual(p.get_time(), final_datetime)
+        self.assertEqual(p.get_time_string().lower(), "9:00 am")
+
+        p = SlashCommandParser("monday 9am say Humbug", initial_time)
+        self.assertEqual(p.get_time(), final_datetime)
+
+    def test_best_guess_for_unparsed_time(self):
+        initial_time = datetime(2019, 8, 19, 10, 17, 5, tzinfo=self.pst)
+
+        # Part of the time makes sense
+        with self.assertRaises(TimeParseError) as context:
+            SlashCommandParser(
+                "tomorrow around 9ish say 'Lunch?'", initial_time)
+        self.assertEqual(context.exception.scheduled_message, "Lunch?")
+        self.assertEqual(
+            context.exception.best_guess.date(), datetime(2019, 8, 20).date())
+        self.assertEqual(context.exception.best_guess.utcoffset(),
+                         timedelta(hours=-8))
+
+        # None of it does, so the next whole hour
+        with self.assertRaises(TimeParseError) as context:
+            SlashCommandParser("flurb say Blah", initial_time)
+        self.assertEqual(
+            context.exception.best_guess,
+            datetime(2019, 8, 19, 11, 0, 0, tzinfo=self.pst))
+
+        # A picked time isn't parsed at all
+        picked_time = datetime(2019, 8, 20, 9, 30, 0, tzinfo=self.pst)
+        p = SlashCommandParser.from_picked_time(picked_time, "Lunch?")
+        self.assertEqual(p.get_time(), picked_time)
+        self.assertEqual(p.get_message(), "Lunch?")
+        self.assertEqual(p.get_time_string().lower(), "9:30 am")
+
     def test_date_and_time_strings(self):
         initial_time = datetime(2019, 8, 19, 3, 17, 59, tzinfo=self.est)
 
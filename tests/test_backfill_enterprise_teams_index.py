@@ -0,0 +1,86 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../migrations')
+
+import unittest
+from importlib.util import find_spec
+
+@unittest.skipUnless(find_spec("moto"), "these tests need moto")
+class BackfillEnterpriseTeamsIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from moto import mock_aws
+        os.environ['AWS_DEFAULT_REGION'] = "us-east-1"
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', "testing")
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "testing")
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        boto3.client("dynamodb").create_table(
+            TableName="delaysay-test",
+            KeySchema=[
+                {'AttributeName': "PK", 'KeyType': "HASH"},
+                {'AttributeName': "SK", 'KeyType': "RANGE"}],
+            AttributeDefinitions=[
+                {'AttributeName': "PK", 'AttributeType': "S"},
+                {'AttributeName': "SK", 'AttributeType': "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        self.table = boto3.resource("dynamodb").Table("delaysay-test")
+        self.table.put_item(Item={
+            'PK': "TEAM#T1", 'SK': "team", 'team_id': "T1",
+            'enterprise_id': "E1"})
+        self.table.put_item(Item={
+            'PK': "TEAM#T2", 'SK': "team", 'enterprise_id': "E1"})
+        self.table.put_item(Item={
+            'PK': "TEAM#T3", 'SK': "team", 'team_id': "T3",
+            'enterprise_id': "E1", 'GSI2PK': "ENTERPRISE#E1#0",
+            'GSI2SK': "TEAM#T3"})
+        # Not in an org, or not a team
+        self.table.put_item(Item={'PK': "TEAM#T4", 'SK': "team", 'team_id': "T4"})
+        self.table.put_item(Item={
+            'PK': "USER#U1", 'SK': "user", 'team_id': "T1",
+            'enterprise_id': "E1"})
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_backfill(self):
+        from backfill_enterprise_teams_index import backfill
+        self.assertEqual(
+            backfill(self.table, dry_run=True),
+            {'updated': 2, 'deleted_meanwhile': 0})
+        self.assertEqual(
+            backfill(self.table), {'updated': 2, 'deleted_meanwhile': 0})
+        item = self.table.get_item(Key={'PK': "TEAM#T2", 'SK': "team"})['Item']
+        self.assertRegex(item['GSI2PK'], r"^ENTERPRISE#E1#[0-7]$")
+        self.assertEqual((item['GSI2SK'], item['team_id']), ("TEAM#T2", "T2"))
+        # Already done
+        self.assertEqual(backfill(self.table)['updated'], 0)
+        for key in [{'PK': "TEAM#T4", 'SK': "team"},
+                    {'PK': "USER#U1", 'SK': "user"}]:
+            self.assertNotIn('GSI2PK', self.table.get_item(Key=key)['Item'])
+
+    def test_same_shards_as_the_dynamodb_layer(self):
+        import backfill_enterprise_teams_index as migration
+        sys.path.insert(
+            1, os.path.dirname(
+                os.path.realpath(__file__)) + '/../code-layer-exceptions')
+        sys.path.insert(
+            1, os.path.dirname(
+                os.path.realpath(__file__)) + '/../code-layer-dynamodb')
+        os.environ.setdefault('AUTH_TABLE_NAME', "delaysay-test")
+        import dynamodb
+        self.assertEqual(
+            migration.ENTERPRISE_TEAMS_INDEX_SHARDS,
+            dynamodb.ENTERPRISE_TEAMS_INDEX_SHARDS)
+        for team_id in ["T1", "T012AB3CD", "T999999"]:
+            self.assertEqual(
+                migration.get_enterprise_teams_index_key("E1", team_id),
+                tuple(dynamodb.get_enterprise_teams_index_key(
+                    "E1", team_id).values()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../migrations')
+
+import unittest
+from importlib.util import find_spec
+
+@unittest.skipUnless(find_spec("moto"), "these tests need moto")
+class BackfillTeamMembersIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from moto import mock_aws
+        os.environ['AWS_DEFAULT_REGION'] = "us-east-1"
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', "testing")
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "testing")
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        boto3.client("dynamodb").create_table(
+            TableName="delaysay-test",
+            KeySchema=[
+                {'AttributeName': "PK", 'KeyType': "HASH"},
+                {'AttributeName': "SK", 'KeyType': "RANGE"}],
+            AttributeDefinitions=[
+                {'AttributeName': "PK", 'AttributeType': "S"},
+                {'AttributeName': "SK", 'AttributeType': "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        self.table = boto3.resource("dynamodb").Table("delaysay-test")
+        self.table.put_item(Item={
+            'PK': "USER#U1", 'SK': "user", 'user_id': "U1", 'team_id': "T1",
+            'billing_role': "approved", 'token': b"encrypted"})
+        self.table.put_item(Item={
+            'PK': "USER#U2", 'SK': "user", 'team_id': "T1", 'token': b"encrypted"})
+        self.table.put_item(Item={'PK': "USER#U3", 'SK': "user", 'token': b"encrypted"})
+        self.table.put_item(Item={
+            'PK': "USER#U4", 'SK': "user", 'team_id': "T2", 'token': b"encrypted",
+            'GSI1PK': "TEAM#T2", 'GSI1SK': "USER#U4"})
+        # Revoked: User.remove_token() keeps the team_id
+        self.table.put_item(Item={
+            'PK': "USER#U5", 'SK': "user", 'user_id': "U5", 'team_id': "T1"})
+        # From an org-wide install
+        self.table.put_item(Item={
+            'PK': "USER#U6", 'SK': "user", 'enterprise_id': "E1",
+            'token': b"encrypted"})
+        # Not users
+        self.table.put_item(Item={'PK': "TEAM#T1", 'SK': "team", 'team_id': "T1"})
+        self.table.put_item(Item={
+            'PK': "USER#U1", 'SK': "SCHEDULED#0000000001#Q1", 'post_at': 1})
+
+    def tearDown(self):
+        self.mock.stop()
+
+    def test_backfill(self):
+        from backfill_team_members_index import backfill
+        self.assertEqual(
+            backfill(self.table, dry_run=True),
+            {'updated': 3, 'missing_team_id': 1, 'deleted_meanwhile': 0})
+        self.assertNotIn(
+            'GSI1PK', self.table.get_item(Key={'PK': "USER#U1", 'SK': "user"})['Item'])
+        self.assertEqual(
+            backfill(self.table),
+            {'updated': 3, 'missing_team_id': 1, 'deleted_meanwhile': 0})
+        item = self.table.get_item(Key={'PK': "USER#U2", 'SK': "user"})['Item']
+        self.assertEqual(
+            (item['GSI1PK'], item['GSI1SK'], item['user_id']),
+            ("TEAM#T1", "USER#U2", "U2"))
+        item = self.table.get_item(Key={'PK': "USER#U6", 'SK': "user"})['Item']
+        self.assertEqual(
+            (item['GSI1PK'], item['GSI1SK']), ("ENTERPRISE#E1", "USER#U6"))
+        # Already done
+        self.assertEqual(backfill(self.table)['updated'], 0)
+        self.assertNotIn(
+            'GSI1PK', self.table.get_item(Key={'PK': "TEAM#T1", 'SK': "team"})['Item'])
+        self.assertNotIn(
+            'GSI1PK', self.table.get_item(Key={'PK': "USER#U5", 'SK': "user"})['Item'])
+
+    def test_user_revoked_during_the_backfill_stays_out(self):
+        import backfill_team_members_index
+        table = self.table
+        class RevokingTable:
+            # Revokes U2 between the scan and its update
+            def scan(self, **scan_arguments):
+                response = table.scan(**scan_arguments)
+                table.update_item(
+                    Key={'PK': "USER#U2", 'SK': "user"},
+                    UpdateExpression="REMOVE #t",
+                    ExpressionAttributeNames={"#t": "token"})
+                return response
+            def update_item(self, **update_arguments):
+                return table.update_item(**update_arguments)
+        self.assertEqual(
+            backfill_team_members_index.backfill(RevokingTable()),
+            {'updated': 2, 'missing_team_id': 1, 'deleted_meanwhile': 1})
+        self.assertNotIn(
+            'GSI1PK', self.table.get_item(Key={'PK': "USER#U2", 'SK': "user"})['Item'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-slack-slash-command-second-responder')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+import unittest
+from threading import Lock
+from slack_sdk.errors import SlackApiError
+from bulk_schedule_util import split_off_channels, BulkScheduler
+
+class FakeResponse(dict):
+
+    def __init__(self, content, headers=None):
+        super().__init__(content)
+        self.headers = headers or {}
+
+class FakeSlackClient:
+
+    def __init__(self, errors=None):
+        # channel_id -> list of error codes to raise before succeeding
+        self.errors = errors or {}
+        self.calls = []
+        self.lock = Lock()
+
+    def chat_scheduleMessage(self, channel, post_at, text):
+        with self.lock:
+            self.calls.append(channel)
+            errors = self.errors.get(channel, [])
+            error_code = errors.pop(0) if errors else None
+        if error_code:
+            raise SlackApiError(
+                error_code,
+                FakeResponse(
+                    {'ok': False, 'error': error_code},
+                    {'Retry-After': "0"}))
+        return FakeResponse({'ok': True, 'scheduled_message_id': "Q" + channel})
+
+class UnlimitedRateLimiter:
+
+    def acquire(self):
+        pass
+
+class SplitOffChannelsTestCase(unittest.TestCase):
+
+    def test_no_channels(self):
+        self.assertEqual(
+            split_off_channels("9am say Hi"), ("9am say Hi", []))
+
+    def test_channels_before_say(self):
+        self.assertEqual(
+            split_off_channels("9am in <#C1|a> <#C2|b> <#C3> say Hi"),
+            ("9am say Hi", ["C1", "C2", "C3"]))
+        self.assertEqual(
+            split_off_channels("tomorrow 9am PST in <#C1|a>, <#C2|b>, and <#C1|a> say Hi"),
+            ("tomorrow 9am PST say Hi", ["C1", "C2"]))
+
+    def test_channel_named_like_say(self):
+        self.assertEqual(
+            split_off_channels("1 hour to <#C1|sayings> say Hi"),
+            ("1 hour say Hi", ["C1"]))
+
+    def test_channels_in_message_are_left_alone(self):
+        self.assertEqual(
+            split_off_channels("9am say See <#C9|general>"),
+            ("9am say See <#C9|general>", []))
+
+class BulkSchedulerTestCase(unittest.TestCase):
+
+    def test_results_in_order_with_failures(self):
+        slack_client = FakeSlackClient(errors={
+            'C2': ["not_in_channel"],
+            'C3': ["ratelimited"],
+        })
+        scheduler = BulkScheduler(slack_client, "T1", UnlimitedRateLimiter())
+        jobs = [(f"C{i}", 1900000000, "Hi") for i in range(1, 30)]
+        results = list(scheduler.schedule(jobs))
+        self.assertEqual([job for job, _, _ in results], jobs)
+        self.assertEqual(results[1][1:], (None, "not_in_channel"))
+        # Rate-limited calls are retried
+        self.assertEqual(results[2][1:], ("QC3", None))
+        self.assertEqual(slack_client.calls.count("C3"), 2)
+        self.assertEqual(
+            sum(1 for _, message_id, _ in results if message_id), 28)
+
+    def test_team_keeps_its_rate_limiter(self):
+        first = BulkScheduler(FakeSlackClient(), "T1")
+        second = BulkScheduler(FakeSlackClient(), "T1")
+        other_team = BulkScheduler(FakeSlackClient(), "T2")
+        self.assertIs(first.rate_limiter, second.rate_limiter)
+        self.assertIsNot(first.rate_limiter, other_team.rate_limiter)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-slack-slash-command-second-responder')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-dynamodb')
+
+import unittest
+from importlib.util import find_spec
+from datetime import datetime, timedelta, timezone
+
+# What context.get_remaining_time_in_millis() returns when the first
+# delivery claims the request
+REMAINING_TIME = 60000
+
+@unittest.skipUnless(find_spec("moto"), "these tests need moto")
+class IdempotencyRecordTestCase(unittest.TestCase):
+
+    def setUp(self):
+        from moto import mock_aws
+        os.environ['AWS_DEFAULT_REGION'] = "us-east-1"
+        os.environ.setdefault('AWS_ACCESS_KEY_ID', "testing")
+        os.environ.setdefault('AWS_SECRET_ACCESS_KEY', "testing")
+        os.environ['AUTH_TABLE_NAME'] = "delaysay-test"
+        self.mock = mock_aws()
+        self.mock.start()
+        import boto3
+        boto3.client("dynamodb").create_table(
+            TableName="delaysay-test",
+            KeySchema=[
+                {'AttributeName': "PK", 'KeyType': "HASH"},
+                {'AttributeName': "SK", 'KeyType': "RANGE"}],
+            AttributeDefinitions=[
+                {'AttributeName': "PK", 'AttributeType': "S"},
+                {'AttributeName': "SK", 'AttributeType': "S"}],
+            BillingMode="PAY_PER_REQUEST")
+        sys.modules.pop("dynamodb", None)
+        from idempotency_util import IdempotencyRecord
+        self.params = {
+            'team_id': ["T1"],
+            'user_id': ["U1"],
+            'channel_id': ["C1"],
+            'text': ["1 hour say Hi"],
+            'request_timestamp': 1700000000
+        }
+        self.record = IdempotencyRecord(self.params)
+        self.delivery = lambda: IdempotencyRecord(self.params)
+
+    def tearDown(self):
+        self.mock.stop()
+        # So other tests import dynamodb with their own table name
+        sys.modules.pop("dynamodb", None)
+
+    def set_lease_left(self, time_left):
+        from dynamodb import DATETIME_FORMAT
+        lease_until = datetime.now(timezone.utc) + time_left
+        self.record.table.update_item(
+            Key=self.record.key,
+            UpdateExpression="SET lease_until = :val",
+            ExpressionAttributeValues={
+                ":val": lease_until.strftime(DATETIME_FORMAT)})
+
+    def test_duplicate_waits_for_the_first_delivery(self):
+        self.assertEqual(self.record.claim(REMAINING_TIME), (True, None))
+        self.assertEqual(self.delivery().claim(REMAINING_TIME), (False, None))
+        self.record.save_response("Scheduled")
+        self.assertEqual(
+            self.delivery().claim(REMAINING_TIME), (False, "Scheduled"))
+
+    def test_lease_is_the_claiming_invocations_remaining_time(self):
+        from idempotency_util import IN_PROGRESS_LEASE_MARGIN
+        from dynamodb import DATETIME_FORMAT
+        before = datetime.now(timezone.utc).replace(microsecond=0)
+        self.record.claim(REMAINING_TIME)
+        item = self.record.table.get_item(Key=self.record.key)['Item']
+        lease_until = datetime.strptime(item['lease_until'], DATETIME_FORMAT)
+        lease = timedelta(milliseconds=REMAINING_TIME) + IN_PROGRESS_LEASE_MARGIN
+        self.assertGreaterEqual(lease_until, before + lease)
+        self.assertLessEqual(lease_until, before + lease + timedelta(seconds=2))
+
+    def test_stale_claim_is_taken_over_once(self):
+        self.record.claim(REMAINING_TIME)
+        # The first delivery still has time left.
+        self.set_lease_left(timedelta(seconds=30))
+        self.assertEqual(self.delivery().claim(REMAINING_TIME), (False, None))
+        # The first delivery timed out without responding.
+        self.set_lease_left(-timedelta(seconds=30))
+        self.assertEqual(self.delivery().claim(REMAINING_TIME), (True, None))
+        # The takeover starts a new lease.
+        self.assertEqual(self.delivery().claim(REMAINING_TIME), (False, None))
+
+    def test_stale_claim_goes_to_one_of_two_deliveries(self):
+        self.record.claim(REMAINING_TIME)
+        self.set_lease_left(-timedelta(seconds=30))
+        stale_item = self.record.table.get_item(Key=self.record.key)['Item']
+        # Takeovers come after the lease, so never in the same second as
+        # the claim
+        now = datetime.now(timezone.utc) + timedelta(minutes=1)
+        lease_until = now + timedelta(milliseconds=REMAINING_TIME)
+        first, second = self.delivery(), self.delivery()
+        self.assertTrue(first._take_over(stale_item, now, lease_until))
+        self.assertFalse(second._take_over(stale_item, now, lease_until))
+
+    def test_claim_without_lease_until_uses_the_function_timeout(self):
+        from idempotency_util import IN_PROGRESS_LEASE
+        from dynamodb import DATETIME_FORMAT
+        self.record.claim(REMAINING_TIME)
+        def set_claim_age(age):
+            claim_time = datetime.now(timezone.utc) - age
+            self.record.table.update_item(
+                Key=self.record.key,
+                UpdateExpression="SET create_time = :val REMOVE lease_until",
+                ExpressionAttributeValues={
+                    ":val": claim_time.strftime(DATETIME_FORMAT)})
+        set_claim_age(IN_PROGRESS_LEASE - timedelta(seconds=30))
+        self.assertEqual(self.delivery().claim(REMAINING_TIME), (False, None))
+        set_claim_age(IN_PROGRESS_LEASE + timedelta(seconds=30))
+        self.assertEqual(self.delivery().claim(REMAINING_TIME), (True, None))
+
+    def test_finished_request_is_not_taken_over(self):
+        self.record.claim(REMAINING_TIME)
+        self.record.save_response("Scheduled")
+        self.set_lease_left(-timedelta(minutes=5))
+        self.assertEqual(
+            self.delivery().claim(REMAINING_TIME), (False, "Scheduled"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-slack-slash-command-second-responder')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+import csv
+import unittest
+from io import StringIO
+from datetime import datetime, timezone, timedelta
+import import_util
+from import_util import (
+    find_file_id, iter_csv_rows, iter_json_rows, ImportReport,
+    ScheduledMessageImport)
+from DelaySayExceptions import ImportFileError
+
+INITIAL_TIME = datetime(2030, 8, 19, 5, 17, 5, tzinfo=timezone(timedelta(hours=-8)))
+
+class ImportFileTestCase(unittest.TestCase):
+
+    def test_find_file_id(self):
+        self.assertEqual(
+            find_file_id("import <https://team.slack.com/files/U1234/F0123ABCDEF/notices.csv>"),
+            "F0123ABCDEF")
+        self.assertEqual(find_file_id("import F0123ABCDEF"), "F0123ABCDEF")
+        self.assertIsNone(find_file_id("import"))
+
+    def test_csv_rows(self):
+        text_file = StringIO(
+            "Channel, Time ,Message\r\n"
+            "C1,9am,Hi\r\n"
+            "\r\n"
+            'C2,2 hours,"Two\nlines, and a comma"\r\n')
+        self.assertEqual(list(iter_csv_rows(text_file)), [
+            {'channel': "C1", 'time': "9am", 'message': "Hi"},
+            {'channel': "C2", 'time': "2 hours", 'message': "Two\nlines, and a comma"},
+        ])
+
+    def test_csv_without_header(self):
+        with self.assertRaises(ImportFileError):
+            list(iter_csv_rows(StringIO("C1,9am,Hi\n")))
+
+    def test_json_array_and_lines_across_chunks(self):
+        old_chunk_chars = import_util.JSON_CHUNK_CHARS
+        import_util.JSON_CHUNK_CHARS = 7
+        try:
+            rows = [{'channel': f"C{i}", 'time': "1 hour", 'message': "{[,]}"}
+                    for i in range(5)]
+            as_array = "[\n" + ",\n".join(
+                f'{{"channel": "C{i}", "Time": "1 hour", "message": "{{[,]}}"}}'
+                for i in range(5)) + "\n]\n"
+            self.assertEqual(list(iter_json_rows(StringIO(as_array))), rows)
+            as_lines = "".join(
+                f'{{"channel": "C{i}", "time": "1 hour", "message": "{{[,]}}"}}\n'
+                for i in range(5))
+            self.assertEqual(list(iter_json_rows(StringIO(as_lines))), rows)
+        finally:
+            import_util.JSON_CHUNK_CHARS = old_chunk_chars
+
+    def test_invalid_json(self):
+        with self.assertRaises(ImportFileError):
+            list(iter_json_rows(StringIO('[{"channel": "C1"')))
+        with self.assertRaises(ImportFileError):
+            list(iter_json_rows(StringIO('["C1", "9am", "Hi"]')))
+
+class ScheduledMessageImportTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [
+            {'channel': "C1", 'time': "1 hour", 'message': "One"},
+            {'channel': "general", 'time': "1 hour", 'message': "Two"},
+            {'channel': "<#C3|ops>", 'time': "bogus", 'message': "Three"},
+            {'channel': "C4", 'time': "9am", 'message': ""},
+            {'channel': "<#C5|ops>", 'time': "9am", 'message': "Five"},
+        ]
+
+    def read_report(self, report):
+        with open(report.close()) as f:
+            rows = list(csv.DictReader(f))
+        os.remove(report.file.name)
+        return rows
+
+    def test_bad_rows_go_to_the_report(self):
+        report = ImportReport()
+        run = ScheduledMessageImport(INITIAL_TIME, report, 0, lambda: False)
+        jobs = list(run.jobs(self.rows))
+        self.assertTrue(run.is_finished)
+        self.assertEqual([job[0] for job in jobs], ["C1", "C5"])
+        self.assertEqual(jobs[0][1], (INITIAL_TIME + timedelta(hours=1)).replace(second=0).timestamp())
+        for job in jobs:
+            run.add_result(job, "Q" + job[0], None)
+        self.assertEqual((report.scheduled, report.failed), (2, 3))
+        results = {row['row']: row['result'] for row in self.read_report(report)}
+        self.assertEqual(results, {
+            "1": "scheduled", "2": "failed", "3": "failed", "4": "failed",
+            "5": "scheduled"})
+
+    def test_stops_and_resumes(self):
+        report = ImportReport()
+        run = ScheduledMessageImport(INITIAL_TIME, report, 0, lambda: True)
+        jobs = list(run.jobs(self.rows))
+        # Always takes one row, even when out of time
+        self.assertEqual(run.rows_done, 1)
+        self.assertFalse(run.is_finished)
+        self.assertEqual(len(jobs), 1)
+        self.read_report(report)
+
+        report = ImportReport()
+        run = ScheduledMessageImport(INITIAL_TIME, report, 4, lambda: False)
+        jobs = list(run.jobs(self.rows))
+        self.assertEqual([job[3] for job in jobs], [5])
+        self.assertTrue(run.is_finished)
+        self.read_report(report)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-slack-slash-command-second-responder')
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+os.environ.setdefault('SLASH_COMMAND', "/delaysay")
+
+import unittest
+from list_and_delete_util import (
+    write_scheduled_messages_list, split_scheduled_messages_list,
+    shorten_to_whole_lines)
+
+# The same as LIST_RESPONSE_PART_LENGTH and MAX_LIST_RESPONSE_PARTS in
+# the second responder's app.py
+PART_LENGTH = 3500
+MAX_PARTS = 5
+
+HEADER = "Here are the messages you have scheduled in this channel with `/delaysay`:"
+
+FORMATTED_LINE = "*Reminder:* run `make deploy` and read <https://example.com/notes|the notes>"
+
+def scheduled_messages(texts):
+    return [
+        {'post_at': 1900000000 + 60 * i, 'text': text}
+        for i, text in enumerate(texts)]
+
+class SplitScheduledMessagesListTestCase(unittest.TestCase):
+
+    def assertFormattingClosed(self, part):
+        for line in part.split("\n"):
+            line = line.removeprefix("> ")
+            self.assertEqual(line.count("*") % 2, 0, line)
+            self.assertEqual(line.count("`") % 2, 0, line)
+            self.assertEqual(line.count("<"), line.count(">"), line)
+
+    def test_short_list_is_one_part(self):
+        messages = scheduled_messages(["hello", "see you\nat noon"])
+        parts = list(split_scheduled_messages_list(HEADER, messages, PART_LENGTH))
+        self.assertEqual(
+            parts, [(write_scheduled_messages_list(HEADER, messages), 0)])
+
+    def test_long_list_splits_between_messages(self):
+        messages = scheduled_messages([FORMATTED_LINE] * 200)
+        parts = list(split_scheduled_messages_list(HEADER, messages, PART_LENGTH))
+        self.assertGreater(len(parts), MAX_PARTS)
+        for part, messages_left in parts:
+            self.assertLessEqual(len(part), PART_LENGTH)
+            self.assertFormattingClosed(part)
+        self.assertTrue(parts[1][0].startswith("    *"))
+        # Each part says how many messages come after it
+        messages_left = [messages_left for part, messages_left in parts]
+        self.assertEqual(messages_left, sorted(messages_left, reverse=True))
+        self.assertEqual(messages_left[-1], 0)
+        self.assertGreater(messages_left[MAX_PARTS - 1], 0)
+        shown = sum(part.count(") <!date^") for part, _ in parts[:MAX_PARTS])
+        self.assertEqual(shown + messages_left[MAX_PARTS - 1], 200)
+        # Nothing is lost between parts
+        self.assertEqual(
+            "\n\n".join(part for part, _ in parts),
+            write_scheduled_messages_list(HEADER, messages))
+
+    def test_long_message_is_cut_between_lines(self):
+        long_text = "\n".join(f"{n}. {FORMATTED_LINE}" for n in range(100))
+        messages = scheduled_messages(["short", long_text, "after"])
+        parts = list(split_scheduled_messages_list(HEADER, messages, PART_LENGTH))
+        self.assertEqual(len(parts), 3)
+        part, messages_left = parts[1]
+        self.assertEqual(messages_left, 1)
+        self.assertLessEqual(len(part), PART_LENGTH)
+        self.assertFormattingClosed(part)
+        self.assertTrue(part.startswith("    *2) <!date^1900000060^"))
+        self.assertTrue(part.endswith("\n> …"))
+        quoted_lines = part.split("\n")[1:-1]
+        self.assertGreater(len(quoted_lines), 10)
+        self.assertEqual(
+            quoted_lines,
+            [f"> {n}. {FORMATTED_LINE}" for n in range(len(quoted_lines))])
+        self.assertTrue(parts[2][0].startswith("    *3) "))
+
+    def test_long_single_line_is_cut_outside_formatting(self):
+        long_line = " ".join([FORMATTED_LINE] * 60)
+        messages = scheduled_messages([long_line])
+        # Cut to fill a whole part, so it goes after the header's part
+        parts = list(split_scheduled_messages_list(HEADER, messages, PART_LENGTH))
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0], (HEADER, 1))
+        part, messages_left = parts[1]
+        self.assertEqual(messages_left, 0)
+        self.assertLessEqual(len(part), PART_LENGTH)
+        self.assertGreater(len(part), PART_LENGTH - len(FORMATTED_LINE))
+        self.assertFormattingClosed(part)
+        self.assertTrue(part.startswith("    *1) <!date^"))
+        self.assertIn(":*\n> *Reminder:* run `make deploy`", part)
+        self.assertTrue(part.endswith("…"))
+        self.assertTrue(long_line.startswith(
+            part.split("\n> ", 1)[1].removesuffix("…")))
+
+    def test_cut_never_ends_inside_formatting(self):
+        quote = "\n> " + FORMATTED_LINE
+        heading = "\n\n    *1) today:*"
+        for max_length in range(len(heading) + 4, len(heading) + len(quote)):
+            shortened = shorten_to_whole_lines(heading, quote, max_length)
+            self.assertLessEqual(len(shortened), max_length)
+            self.assertFormattingClosed(shortened.removeprefix(heading))
+            self.assertTrue(shortened.endswith("…"))
+
+if __name__ == '__main__':
+    unittest.main()
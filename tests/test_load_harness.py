@@ -0,0 +1,725 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(os.path.realpath(__file__)))
+
+import unittest
+from importlib.util import find_spec
+from time import time
+
+@unittest.skipUnless(find_spec("moto"), "the load harness needs moto")
+class LoadHarnessTestCase(unittest.TestCase):
+
+    def test_every_command_type_succeeds(self):
+        from load_harness import run
+        report = run(
+            total_requests=40, teams=2, users_per_team=2, paid_fraction=1.0)
+        commands = report['commands']
+        for command_type in [
+                "oauth", "stripe webhook", "schedule", "list", "delete",
+                "billing", "billing redirect"]:
+            self.assertIn(command_type, commands)
+            self.assertEqual(commands[command_type]['errors'], 0)
+        # A scheduled message takes one chat.scheduleMessage call.
+        self.assertGreaterEqual(
+            report['fake_service_calls']["slack chat.scheduleMessage"],
+            commands["schedule"]['count'])
+
+    def test_import_continues_in_parts(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            link = harness.upload_import_file(user_id, 0, rows=3)
+            # Pretend each invocation runs out of time after one row.
+            harness.second_responder.IMPORT_TIME_RESERVE_IN_MS = 10 ** 9
+            harness.slash_command(
+                "import", team_id, user_id, "C0", "import " + link)
+            uploads = harness.state.uploads
+        self.assertEqual(len(uploads), 3)
+        self.assertIn("part 3 (rows 3-3): 1 scheduled", uploads[2]['initial_comment'])
+        self.assertIn("All done: 3 messages scheduled", uploads[2]['initial_comment'])
+        self.assertEqual(
+            harness.state.calls["slack chat.scheduleMessage"], 3)
+
+    def test_import_report_reaches_the_user(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            link = harness.upload_import_file(user_id, 0, rows=2)
+            harness.slash_command(
+                "import", team_id, user_id, "C0", "import " + link)
+            uploads = harness.state.uploads
+            pending_uploads = harness.state.pending_uploads
+        self.assertEqual(len(uploads), 1)
+        # Shared in the user's direct message with themself
+        self.assertEqual(uploads[0]['channels'], "D" + user_id)
+        self.assertTrue(uploads[0]['name'].startswith("delaysay-import-report-"))
+        self.assertIn("All done: 2 messages scheduled", uploads[0]['initial_comment'])
+        report_rows = uploads[0]['content'].splitlines()
+        self.assertEqual(report_rows[0], "row,channel,time,result,detail")
+        self.assertEqual(len(report_rows), 3)
+        self.assertEqual(pending_uploads, {})
+        self.assertEqual(harness.state.calls["slack files.upload"], 0)
+        self.assertEqual(harness.state.calls["slack upload"], 1)
+
+    def test_reconciler_updates_the_index(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=2, paid_fraction=1.0)
+            harness.reconciler.LIST_CALLS_PER_MINUTE = 60 * 1000
+            harness.reconciler.LIST_PAGE_SIZE = 2
+            team_id, user_id = harness.users[0]
+            for i in range(3):
+                harness.slash_command(
+                    "schedule", team_id, user_id, "C0", f"1 hour say {i}")
+            # Sent or deleted without DelaySay's knowledge
+            messages = harness.state.scheduled_messages[(user_id, "C0")]
+            messages.pop(0)
+            # Scheduled with DelaySay's token, but never indexed
+            messages.append({
+                'id': "QOUTSIDE", 'channel_id': "C0",
+                'post_at': int(time()) + 7200, 'text': "Outside"})
+            harness.reconcile()
+            from ScheduledMessageIndex import ScheduledMessageIndex
+            entries = ScheduledMessageIndex(user_id).get_all()
+            progress = harness.reconciler.ReconcileProgress(0, 4).load()
+        self.assertCountEqual(
+            [entry['scheduled_message_id'] for entry in entries],
+            [message['id'] for message in messages])
+        # Finished a full pass, so the next run starts over
+        self.assertIsNone(progress)
+
+    def test_list_reads_every_page_before_reconciling(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            # More than one page of chat.scheduledMessages.list
+            now = int(time())
+            messages = [
+                {'id': f"Q{i:04d}", 'channel_id': "C0",
+                 'post_at': now + 3600 + i, 'text': f"Message {i}"}
+                for i in range(130)]
+            harness.state.scheduled_messages[(user_id, "C0")] = messages
+            from ScheduledMessageIndex import ScheduledMessageIndex
+            ScheduledMessageIndex(user_id).add_many(
+                (message['id'], "C0", message['post_at'], message['text'])
+                for message in messages)
+            listed = harness.slash_command(
+                "list", team_id, user_id, "C0", "list")
+            entries = ScheduledMessageIndex(user_id).get_all()
+        self.assertEqual(len(entries), 130)
+        self.assertIn("*130) ", "".join(listed))
+
+    def test_reconciler_reads_only_authorized_users(self):
+        from load_harness import running_harness, FakeContext
+        with running_harness() as harness:
+            harness.install(teams=2, users_per_team=3, paid_fraction=1.0)
+            harness.reconciler.LIST_CALLS_PER_MINUTE = 60 * 1000
+            harness.reconciler.SCAN_PAGE_SIZE = 1
+            for team_id, user_id in harness.users:
+                harness.slash_command(
+                    "schedule", team_id, user_id, "C0", "1 hour say Hi")
+            revoked_user_id = harness.users[0][1]
+            harness.second_responder.User(revoked_user_id).remove_token()
+            # Left by a run that scanned the table rather than the index
+            from dynamodb import dynamodb_table
+            for segment in range(4):
+                dynamodb_table.put_item(Item={
+                    'PK': f"RECONCILE#{segment}", 'SK': "reconcile",
+                    'total_segments': 4,
+                    'exclusive_start_key': {
+                        'PK': "USER#" + harness.users[1][1], 'SK': "user"}})
+            totals = [
+                harness.reconciler.reconcile_segment(
+                    segment, 4,
+                    FakeContext("DelaySayScheduledMessageReconcilerFunction"))
+                for segment in range(4)]
+            progress = [
+                harness.reconciler.ReconcileProgress(segment, 4).load()
+                for segment in range(4)]
+        self.assertEqual(sum(total['users'] for total in totals), 5)
+        self.assertEqual(sum(total['skipped'] for total in totals), 0)
+        self.assertEqual(sum(total['failed'] for total in totals), 0)
+        self.assertTrue(all(total['finished_pass'] for total in totals))
+        self.assertEqual(progress, [None] * 4)
+
+    def test_reconciler_includes_org_install_users(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install_org("E1", teams=1)
+            harness.reconciler.LIST_CALLS_PER_MINUTE = 60 * 1000
+            harness.slash_command(
+                "schedule", "T000000", "UORGADMIN", "C0", "1 hour say Hi",
+                enterprise_id="E1")
+            messages = harness.state.scheduled_messages[("UORGADMIN", "C0")]
+            messages.append({
+                'id': "QOUTSIDE", 'channel_id': "C0",
+                'post_at': int(time()) + 7200, 'text': "Outside"})
+            harness.reconcile()
+            from ScheduledMessageIndex import ScheduledMessageIndex
+            entries = ScheduledMessageIndex("UORGADMIN").get_all()
+        self.assertEqual(len(messages), 2)
+        self.assertCountEqual(
+            [entry['scheduled_message_id'] for entry in entries],
+            [message['id'] for message in messages])
+
+    def test_billing_list_and_team_membership(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=2, users_per_team=2, paid_fraction=1.0)
+            (team_id, admin_id), (_, user_id), (_, other_admin_id), _ = (
+                harness.users)
+            # Records the admin's billing role
+            harness.slash_command("billing", team_id, admin_id, "C0", "billing")
+            authorized = harness.slash_command(
+                "billing", team_id, admin_id, "C0",
+                f"billing authorize <@{user_id}|someone>")
+            # Users from another workspace can't be authorized here.
+            other_team = harness.slash_command(
+                "billing", team_id, admin_id, "C0",
+                f"billing authorize <@{other_admin_id}|someone>")
+            listed = harness.slash_command(
+                "billing", team_id, user_id, "C0", "billing list")
+        self.assertIn("is now authorized", authorized[0])
+        self.assertIn("is not an authorized DelaySay user", other_team[0])
+        self.assertIn(f"<@{admin_id}> (workspace admin)", listed[0])
+        self.assertIn(f"<@{user_id}> (authorized by an admin)", listed[0])
+        self.assertNotIn(other_admin_id, listed[0])
+
+    def test_schedule_responses_when_parsing_and_payment_overlap(self):
+        from load_harness import running_harness
+        from datetime import datetime, timedelta, timezone
+        with running_harness() as harness:
+            harness.install(teams=2, users_per_team=1, paid_fraction=0.0)
+            (team_id, user_id), (expired_team_id, expired_user_id) = (
+                harness.users)
+            from dynamodb import dynamodb_table, DATETIME_FORMAT
+            expired = datetime.now(timezone.utc) - timedelta(days=30)
+            dynamodb_table.update_item(
+                Key={'PK': "TEAM#" + expired_team_id, 'SK': "team"},
+                UpdateExpression="SET payment_expiration = :val",
+                ExpressionAttributeValues={
+                    ":val": expired.strftime(DATETIME_FORMAT)})
+            scheduled = harness.slash_command(
+                "schedule", team_id, user_id, "C0", "1 hour say Hello")
+            not_understood = harness.slash_command(
+                "schedule", team_id, user_id, "C0", "1 hour hello")
+            # Payment required comes first, even if the command is unclear
+            payment_required = harness.slash_command(
+                "schedule", expired_team_id, expired_user_id, "C0",
+                "1 hour hello")
+        self.assertIn("I will post on your behalf", scheduled[0])
+        self.assertIn("Sorry, I don't understand", not_understood[0])
+        self.assertIn("free trial has ended", payment_required[0])
+        self.assertEqual(
+            harness.state.calls["slack chat.scheduleMessage"], 1)
+
+    def test_timezone_is_saved_with_the_user(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            for i in range(3):
+                responses = harness.slash_command(
+                    "schedule", team_id, user_id, "C0", f"1 hour say {i}")
+                self.assertIn("I will post on your behalf", responses[0])
+            from dynamodb import dynamodb_table
+            item = dynamodb_table.get_item(
+                Key={'PK': "USER#" + user_id, 'SK': "user"})['Item']
+        self.assertEqual(item['tz'], "America/Los_Angeles")
+        self.assertEqual(harness.state.calls["slack users.info"], 1)
+
+    def test_slack_events_update_users(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=2, users_per_team=2, paid_fraction=1.0)
+            (team_id, admin_id), (_, user_id), (other_team_id, _), _ = (
+                harness.users)
+            from dynamodb import dynamodb_table
+            def get_user(user_id):
+                return dynamodb_table.get_item(
+                    Key={'PK': "USER#" + user_id, 'SK': "user"})['Item']
+            changed = harness.slack_event(team_id, {
+                'type': "user_change",
+                'user': {'id': user_id, 'tz': "Asia/Kolkata", 'is_admin': True}
+            })
+            changed_user = get_user(user_id)
+            revoked = harness.slack_event(team_id, {
+                'type': "tokens_revoked",
+                'tokens': {'oauth': [admin_id], 'bot': []}
+            })
+            revoked_user = get_user(admin_id)
+            not_authorized = harness.slash_command(
+                "schedule", team_id, admin_id, "C0", "1 hour say Hi")
+            uninstalled = harness.slack_event(
+                other_team_id, {'type': "app_uninstalled"})
+            other_team = harness.slash_command(
+                "billing", other_team_id, harness.users[2][1], "C0",
+                "billing list")
+            members = harness.second_responder.Team(other_team_id).get_members()
+        for response in [changed, revoked, uninstalled]:
+            self.assertEqual(response['statusCode'], "200")
+        self.assertEqual(changed_user['tz'], "Asia/Kolkata")
+        self.assertEqual(changed_user['billing_role'], "admin")
+        self.assertTrue(changed_user['is_admin'])
+        self.assertNotIn('token', revoked_user)
+        self.assertNotIn('GSI1PK', revoked_user)
+        self.assertIn("haven't authorized DelaySay", not_authorized[0])
+        self.assertIn("haven't authorized DelaySay", other_team[0])
+        self.assertEqual(members, [])
+
+    def test_admin_status_is_saved(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            calls_before = harness.state.calls["slack users.info"]
+            for i in range(3):
+                harness.slash_command(
+                    "billing", team_id, user_id, "C0", "billing")
+            calls = harness.state.calls["slack users.info"] - calls_before
+        self.assertEqual(calls, 1)
+
+    def test_org_uninstall_removes_org_and_workspace_tokens(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(
+                teams=1, users_per_team=1, paid_fraction=0.0,
+                enterprise_id="E1")
+            _, workspace_user_id = harness.users[0]
+            harness.install_org("E1", teams=2)
+            from Enterprise import Enterprise
+            org_members = Enterprise("E1").get_members()
+            uninstalled = harness.slack_event(
+                None, {'type': "app_uninstalled"}, enterprise_id="E1")
+            from dynamodb import dynamodb_table
+            items = [
+                dynamodb_table.get_item(
+                    Key={'PK': "USER#" + user_id, 'SK': "user"})['Item']
+                for user_id in ["UORGADMIN", workspace_user_id]]
+            org_members_after = Enterprise("E1").get_members()
+        self.assertEqual(uninstalled['statusCode'], "200")
+        self.assertEqual(
+            [member['user_id'] for member in org_members], ["UORGADMIN"])
+        for item in items:
+            self.assertNotIn('token', item)
+            self.assertNotIn('GSI1PK', item)
+        self.assertEqual(org_members_after, [])
+
+    def test_time_picked_for_a_time_not_understood(self):
+        from load_harness import running_harness
+        from datetime import datetime, timedelta
+        from zoneinfo import ZoneInfo
+        los_angeles = ZoneInfo("America/Los_Angeles")
+        tomorrow = datetime.now(los_angeles).date() + timedelta(days=1)
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            not_understood = harness.slash_command(
+                "schedule", team_id, user_id, "C0",
+                "tomorrow around 9ish say Lunch?")
+            blocks = harness.last_response_payloads[0]['blocks']
+            button = blocks[1]['elements'][2]
+            scheduled = harness.block_action(
+                team_id, user_id, "C0",
+                {'action_id': button['action_id'], 'value': button['value']},
+                {'picked_time': {
+                    'picked_date': {'selected_date': tomorrow.isoformat()},
+                    'picked_time': {'selected_time': "09:30"}
+                }})
+            replaced = harness.last_response_payloads[0]
+            # Changing a picker is acknowledged but does nothing else
+            picker_changed = harness.block_action(
+                team_id, user_id, "C0",
+                {'action_id': "picked_time", 'selected_time': "10:00"})
+            scheduled_messages = harness.state.scheduled_messages[
+                (user_id, "C0")]
+        self.assertIn("I don't understand the time", not_understood[0])
+        self.assertEqual(blocks[1]['elements'][0]['type'], "datepicker")
+        self.assertEqual(blocks[1]['elements'][1]['type'], "timepicker")
+        self.assertIn("I will post on your behalf", scheduled[0])
+        self.assertIn("Lunch?", scheduled[0])
+        self.assertTrue(replaced['replace_original'])
+        self.assertEqual(picker_changed, [])
+        self.assertEqual(len(scheduled_messages), 1)
+        self.assertEqual(
+            scheduled_messages[0]['post_at'],
+            datetime(tomorrow.year, tomorrow.month, tomorrow.day, 9, 30,
+                     tzinfo=los_angeles).timestamp())
+        self.assertEqual(scheduled_messages[0]['text'], "Lunch?")
+
+    def test_send_later_shortcut_and_modal(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            global_view = harness.shortcut(team_id, user_id, "send_later")
+            view = harness.shortcut(
+                team_id, user_id, "send_later", "C1", "Standup in 5")
+            post_at = int(time()) + 2 * 60 * 60
+            def state_values(post_at):
+                return {
+                    'channel': {'channel': {'selected_conversation': "C1"}},
+                    'post_at': {'post_at': {'selected_date_time': post_at}},
+                    'message': {'message': {'value': "Standup in 5"}}
+                }
+            too_early, not_scheduled = harness.view_submission(
+                team_id, user_id, view, state_values(int(time()) - 60), "C1")
+            body, scheduled = harness.view_submission(
+                team_id, user_id, view, state_values(post_at), "C1")
+            scheduled_messages = harness.state.scheduled_messages[
+                (user_id, "C1")]
+        channel_select = view['blocks'][0]['element']
+        self.assertNotIn(
+            'initial_conversation', global_view['blocks'][0]['element'])
+        self.assertEqual(channel_select['initial_conversation'], "C1")
+        self.assertTrue(channel_select['response_url_enabled'])
+        self.assertEqual(
+            view['blocks'][2]['element']['initial_value'], "Standup in 5")
+        self.assertNotIn('hint', view['blocks'][2])
+        self.assertIn("Pick a time in the future", too_early)
+        self.assertEqual(not_scheduled, [])
+        self.assertEqual(body, "")
+        self.assertIn("I will post on your behalf", scheduled[0])
+        self.assertEqual(len(scheduled_messages), 1)
+        self.assertEqual(scheduled_messages[0]['post_at'], post_at)
+        self.assertEqual(scheduled_messages[0]['text'], "Standup in 5")
+
+    def test_send_later_modal_for_a_long_message(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            long_message = "Agenda: " + "x" * 5000
+            view = harness.shortcut(
+                team_id, user_id, "send_later", "C1", long_message)
+        message_block = view['blocks'][2]
+        self.assertEqual(
+            message_block['element']['initial_value'], long_message[:3000])
+        self.assertIn("3,000", message_block['hint']['text'])
+
+    def test_enterprise_plan_covers_its_workspaces(self):
+        from load_harness import running_harness
+        from datetime import datetime, timedelta, timezone
+        with running_harness() as harness:
+            harness.install(
+                teams=2, users_per_team=1, paid_fraction=0.0,
+                enterprise_id="E1")
+            (team_id, user_id), (other_team_id, _) = harness.users
+            from dynamodb import dynamodb_table, DATETIME_FORMAT
+            now = datetime.now(timezone.utc)
+            for expired_team_id in [team_id, other_team_id]:
+                dynamodb_table.update_item(
+                    Key={'PK': "TEAM#" + expired_team_id, 'SK': "team"},
+                    UpdateExpression="SET payment_expiration = :val",
+                    ExpressionAttributeValues={":val": (
+                        now - timedelta(days=30)).strftime(DATETIME_FORMAT)})
+            trial_ended = harness.slash_command(
+                "schedule", team_id, user_id, "C0", "1 hour say Hello",
+                enterprise_id="E1")
+            dynamodb_table.put_item(Item={
+                'PK': "ENTERPRISE#E1",
+                'SK': "enterprise",
+                'payment_expiration': (
+                    now + timedelta(days=365)).strftime(DATETIME_FORMAT),
+                'payment_plan': "enterprise-annual"
+            })
+            scheduled = harness.slash_command(
+                "schedule", team_id, user_id, "C0", "1 hour say Hello",
+                enterprise_id="E1")
+            from Enterprise import Enterprise
+            team_ids = Enterprise("E1").get_team_ids()
+        self.assertIn("free trial has ended", trial_ended[0])
+        self.assertIn("I will post on your behalf", scheduled[0])
+        self.assertCountEqual(team_ids, [team_id, other_team_id])
+
+    def test_org_wide_install_sets_up_every_workspace(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            # One workspace installed and paid for before the org install
+            harness.install(
+                teams=1, users_per_team=1, paid_fraction=1.0,
+                enterprise_id="E1")
+            installed = harness.install_org("E1", teams=3)
+            reinstalled = harness.install_org("E1", teams=3)
+            scheduled = harness.slash_command(
+                "schedule", "T000002", "UORGADMIN", "C0", "1 hour say Hello",
+                enterprise_id="E1")
+            from dynamodb import dynamodb_table
+            def get_item(pk, sk):
+                return dynamodb_table.get_item(
+                    Key={'PK': pk, 'SK': sk})['Item']
+            paid_team = get_item("TEAM#T000000", "team")
+            new_team = get_item("TEAM#T000002", "team")
+            enterprise = get_item("ENTERPRISE#E1", "enterprise")
+            from Enterprise import Enterprise
+            team_ids = Enterprise("E1").get_team_ids()
+        self.assertTrue(installed)
+        self.assertTrue(reinstalled)
+        self.assertNotEqual(paid_team['payment_plan'], "trial")
+        self.assertEqual(len(paid_team['stripe_subscriptions']), 1)
+        self.assertEqual(new_team['payment_plan'], "trial")
+        self.assertEqual(enterprise['installer_id'], "UORGADMIN")
+        self.assertCountEqual(team_ids, ["T000000", "T000001", "T000002"])
+        self.assertIn("I will post on your behalf", scheduled[0])
+        self.assertEqual(harness.state.calls["slack auth.teams.list"], 2)
+
+    def test_org_wide_install_writes_workspaces_at_once(self):
+        from load_harness import running_harness
+        from threading import Lock
+        from time import sleep
+        with running_harness() as harness:
+            authorization = harness.user_authorization
+            add_new_team_to_dynamodb = authorization.add_new_team_to_dynamodb
+            lock = Lock()
+            in_flight = [0]
+            most_in_flight = [0]
+            def add_slowly(*args):
+                with lock:
+                    in_flight[0] += 1
+                    most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+                sleep(0.01)
+                try:
+                    return add_new_team_to_dynamodb(*args)
+                finally:
+                    with lock:
+                        in_flight[0] -= 1
+            authorization.add_new_team_to_dynamodb = add_slowly
+            try:
+                installed = harness.install_org("E1", teams=40)
+            finally:
+                authorization.add_new_team_to_dynamodb = (
+                    add_new_team_to_dynamodb)
+            from Enterprise import Enterprise
+            team_ids = Enterprise("E1").get_team_ids()
+        self.assertTrue(installed)
+        self.assertEqual(len(team_ids), 40)
+        self.assertGreater(most_in_flight[0], 1)
+        self.assertLessEqual(
+            most_in_flight[0], authorization.MAX_TEAM_WRITE_WORKERS)
+
+    def test_org_install_keeps_the_admins_workspace_user(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(
+                teams=1, users_per_team=1, paid_fraction=1.0,
+                enterprise_id="E1")
+            team_id, admin_id = harness.users[0]
+            # Records the admin's billing role and time zone
+            harness.slash_command("billing", team_id, admin_id, "C0", "billing")
+            harness.slash_command(
+                "schedule", team_id, admin_id, "C0", "1 hour say Hello")
+            from dynamodb import dynamodb_table
+            def get_user():
+                return dynamodb_table.get_item(
+                    Key={'PK': "USER#" + admin_id, 'SK': "user"})['Item']
+            before = get_user()
+            installed = harness.install_org("E1", teams=2, user_id=admin_id)
+            after = get_user()
+            listed = harness.slash_command(
+                "billing", team_id, admin_id, "C0", "billing list")
+            scheduled = harness.slash_command(
+                "schedule", "T000001", admin_id, "C0", "1 hour say Hello",
+                enterprise_id="E1")
+        self.assertTrue(installed)
+        for key in ['team_id', 'billing_role', 'tz', 'GSI1PK', 'GSI1SK']:
+            self.assertEqual(after[key], before[key])
+        self.assertEqual(after['enterprise_id'], "E1")
+        self.assertIn(f"<@{admin_id}> (workspace admin)", listed[0])
+        self.assertIn("I will post on your behalf", scheduled[0])
+
+    def test_team_is_created_with_one_write(self):
+        from load_harness import running_harness
+        from datetime import datetime, timedelta, timezone
+        with running_harness() as harness:
+            from Team import Team
+            import metrics
+            now = datetime.now(timezone.utc)
+            team = Team("TNEW")
+            metrics.counts.clear()
+            created = team.add_to_dynamodb(
+                "New Team", None, now, now + timedelta(days=14))
+            dynamodb_calls = metrics.counts.get("DynamoDB", 0)
+            trialing = team.is_trialing()
+            created_again = Team("TNEW").add_to_dynamodb(
+                "New Team", None, now, now + timedelta(days=1))
+            expiration = team.get_time_till_payment_is_due()
+        self.assertTrue(created)
+        self.assertEqual(dynamodb_calls, 1)
+        self.assertTrue(trialing)
+        self.assertFalse(created_again)
+        self.assertGreater(expiration, timedelta(days=13))
+
+    def test_subscription_is_added_once_without_stripe(self):
+        from load_harness import running_harness
+        from datetime import datetime, timedelta, timezone
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=0.0)
+            team_id, user_id = harness.users[0]
+            subscription_id = harness.subscribe(team_id)
+            harness.subscribe(team_id, subscription_id)
+            webhook_stripe_calls = (
+                harness.state.calls["stripe subscriptions.retrieve"])
+            from dynamodb import dynamodb_table
+            def get_team():
+                return dynamodb_table.get_item(
+                    Key={'PK': "TEAM#" + team_id, 'SK': "team"})['Item']
+            after_webhooks = get_team()
+            for i in range(2):
+                harness.slash_command(
+                    "schedule", team_id, user_id, "C0", f"1 hour say {i}")
+            after_commands = get_team()
+        self.assertEqual(webhook_stripe_calls, 0)
+        self.assertEqual(
+            after_webhooks['stripe_subscriptions'], [subscription_id])
+        # The subscription event has the real period end and plan, so
+        # using DelaySay afterward doesn't ask Stripe either.
+        self.assertEqual(
+            after_webhooks['payment_plan'], "recurring-1month-loadtest")
+        expiration = datetime.strptime(
+            after_webhooks['payment_expiration'], "%Y-%m-%dT%H:%M:%S%z")
+        self.assertGreater(
+            expiration - datetime.now(timezone.utc), timedelta(days=29))
+        self.assertEqual(after_commands, after_webhooks)
+        self.assertEqual(
+            harness.state.calls["stripe subscriptions.retrieve"], 0)
+        self.assertEqual(harness.errors["stripe webhook"], 0)
+
+    def test_checkout_is_paid_until_the_invoice(self):
+        from load_harness import running_harness
+        from datetime import datetime, timedelta, timezone
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=0.0)
+            team_id, user_id = harness.users[0]
+            from dynamodb import dynamodb_table
+            team_key = {'PK': "TEAM#" + team_id, 'SK': "team"}
+            dynamodb_table.update_item(
+                Key=team_key,
+                UpdateExpression="SET payment_expiration = :val",
+                ExpressionAttributeValues={
+                    ":val": "2020-01-01T00:00:00+0000"})
+            subscription_id = harness.subscribe(
+                team_id, subscription_event=False)
+            after_checkout = dynamodb_table.get_item(Key=team_key)['Item']
+            scheduled = harness.slash_command(
+                "schedule", team_id, user_id, "C0", "1 hour say Hi")
+            stripe_calls = harness.state.calls["stripe subscriptions.retrieve"]
+            # Offers the customer portal, which reads the subscription
+            billing = harness.slash_command(
+                "billing", team_id, user_id, "C0", "billing")
+            period_end = int(time()) + 31 * 24 * 60 * 60
+            invoice = {
+                'object': "invoice",
+                'subscription': subscription_id,
+                'billing_reason': "subscription_create",
+                'lines': {
+                    'data': [
+                        {
+                            'period': {'end': period_end},
+                            'plan': {'nickname': "recurring-1month-loadtest"}
+                        }
+                    ]
+                }
+            }
+            invoice_response = harness.send_stripe_event(
+                "invoice.paid", invoice)
+            after_invoice = dynamodb_table.get_item(Key=team_key)['Item']
+        # Paid, but only provisionally until Stripe says for how long
+        self.assertEqual(after_checkout['payment_plan'], "paid")
+        expiration = datetime.strptime(
+            after_checkout['payment_expiration'], "%Y-%m-%dT%H:%M:%S%z")
+        self.assertGreater(expiration, datetime.now(timezone.utc))
+        self.assertLess(
+            expiration, datetime.now(timezone.utc) + timedelta(days=2))
+        self.assertEqual(len(scheduled), 1)
+        self.assertNotIn("subscribe", scheduled[0])
+        self.assertNotIn("free trial", billing[0])
+        self.assertIn("Here's your Stripe customer portal", billing[0])
+        self.assertEqual(stripe_calls, 0)
+        self.assertEqual(invoice_response['statusCode'], "200")
+        self.assertEqual(
+            after_invoice['payment_plan'], "recurring-1month-loadtest")
+        self.assertEqual(
+            datetime.strptime(
+                after_invoice['payment_expiration'], "%Y-%m-%dT%H:%M:%S%z"),
+            datetime.fromtimestamp(period_end, timezone.utc))
+
+    def test_subscription_events_out_of_order(self):
+        from load_harness import running_harness
+        from datetime import datetime, timedelta, timezone
+        with running_harness() as harness:
+            harness.install(teams=2, users_per_team=1, paid_fraction=0.0)
+            (team_id, _), (other_team_id, _) = harness.users
+            from dynamodb import dynamodb_table
+            def get_team(team_id):
+                return dynamodb_table.get_item(
+                    Key={'PK': "TEAM#" + team_id, 'SK': "team"})['Item']
+            # Before its checkout: Stripe retries it after the checkout.
+            subscription_id = "sub_early"
+            harness.state.add_subscription(subscription_id, "cus_" + team_id)
+            subscription = harness.state.subscriptions[subscription_id]
+            early = harness.send_stripe_event(
+                "customer.subscription.created", subscription)
+            harness.subscribe(
+                team_id, subscription_id, subscription_event=False)
+            retried = harness.send_stripe_event(
+                "customer.subscription.created", subscription)
+            team = get_team(team_id)
+            # After its checkout recorded the team but before it added the
+            # subscription: the checkout doesn't undo the real period end.
+            other_subscription_id = "sub_between"
+            harness.state.add_subscription(
+                other_subscription_id, "cus_" + other_team_id)
+            from Team import add_subscription_team_to_dynamodb
+            add_subscription_team_to_dynamodb(
+                other_subscription_id, other_team_id)
+            between = harness.send_stripe_event(
+                "customer.subscription.created",
+                harness.state.subscriptions[other_subscription_id])
+            harness.subscribe(
+                other_team_id, other_subscription_id, subscription_event=False)
+            other_team = get_team(other_team_id)
+        self.assertEqual(early['statusCode'], "500")
+        self.assertEqual(retried['statusCode'], "200")
+        self.assertEqual(team['payment_plan'], "recurring-1month-loadtest")
+        self.assertEqual(team['stripe_subscriptions'], [subscription_id])
+        self.assertEqual(between['statusCode'], "200")
+        self.assertEqual(
+            other_team['payment_plan'], "recurring-1month-loadtest")
+        self.assertEqual(
+            other_team['stripe_subscriptions'], [other_subscription_id])
+        expiration = datetime.strptime(
+            other_team['payment_expiration'], "%Y-%m-%dT%H:%M:%S%z")
+        self.assertGreater(
+            expiration - datetime.now(timezone.utc), timedelta(days=29))
+
+    def test_long_list_is_sent_in_parts(self):
+        from load_harness import running_harness
+        with running_harness() as harness:
+            harness.install(teams=1, users_per_team=1, paid_fraction=1.0)
+            team_id, user_id = harness.users[0]
+            for i in range(12):
+                harness.slash_command(
+                    "schedule", team_id, user_id, "C0",
+                    f"{i + 1} hours say Message {i + 1} " + "la " * 30)
+            harness.second_responder.LIST_RESPONSE_PART_LENGTH = 600
+            parts = harness.slash_command(
+                "list", team_id, user_id, "C0", "list")
+            harness.second_responder.MAX_LIST_RESPONSE_PARTS = 2
+            capped = harness.slash_command(
+                "list", team_id, user_id, "C0", "list")
+        self.assertGreater(len(parts), 2)
+        self.assertTrue(all(len(part) <= 600 for part in parts))
+        listed = "".join(parts)
+        for i in range(12):
+            self.assertIn(f"*{i + 1}) ", listed)
+            self.assertIn(f"Message {i + 1} ", listed)
+        self.assertEqual(len(capped), 2)
+        self.assertIn("more, which don't fit in this reply", capped[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3.10
+
+import sys, os
+sys.path.insert(
+    1, os.path.dirname(
+        os.path.realpath(__file__)) + '/../code-layer-exceptions')
+
+import unittest
+from threading import Thread
+import metrics
+
+class MetricsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        metrics.durations.clear()
+        metrics.counts.clear()
+        # Switch threads as often as possible, to catch lost updates
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+        metrics.durations.clear()
+        metrics.counts.clear()
+
+    def test_timers_in_many_threads_all_count(self):
+        threads = 8
+        calls_per_thread = 5000
+        def time_calls():
+            for i in range(calls_per_thread):
+                with metrics._Timer("Slack"):
+                    pass
+                with metrics._Timer("DynamoDB"):
+                    pass
+        workers = [Thread(target=time_calls) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(metrics.counts["Slack"], threads * calls_per_thread)
+        self.assertEqual(
+            metrics.counts["DynamoDB"], threads * calls_per_thread)
+        self.assertGreaterEqual(metrics.durations["Slack"], 0)
+
+if __name__ == '__main__':
+    unittest.main()